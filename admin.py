@@ -0,0 +1,210 @@
+"""Admin API: streaming exports and aggregates for user_metrics/user_feedback.
+
+    GET  /admin/exports/user_feedback.csv?since=2025-06-01
+    GET  /admin/exports/user_metrics.ndjson
+    GET  /admin/aggregates
+    POST /admin/aggregates/rebuild
+
+Exports read the table through a server-side cursor (``yield_per``) and
+send it EXPORT_BATCH_ROWS rows at a time, so a worker's memory does not grow
+with the table. Aggregates come from the admin_stats table:
+
+* user_metrics totals are kept up to date by metrics_buffer on every flush;
+* user_feedback is append-only, so a refresh only groups the rows with an
+  id above the last one counted (stored as ``user_feedback.last_id``). A
+  row whose insert commits after a higher id was counted is missed until
+  the next rebuild.
+
+Access needs a login whose email is in ADMIN_EMAILS (comma separated) or
+``Authorization: Bearer $ADMIN_API_TOKEN``.
+"""
+import csv
+import hmac
+import io
+import json
+import os
+from datetime import datetime
+from functools import wraps
+
+from flask import Blueprint, Response, abort, jsonify, request, stream_with_context
+from flask_login import current_user
+
+import metrics_buffer
+
+
+ADMIN_EMAILS = {e.strip().lower() for e in os.environ.get("ADMIN_EMAILS", "").split(",")
+                if e.strip()}
+ADMIN_API_TOKEN = os.environ.get("ADMIN_API_TOKEN", "")
+EXPORT_BATCH_ROWS = int(os.environ.get("EXPORT_BATCH_ROWS", "1000"))
+
+EXPORT_FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+# Funnel steps, in the order users normally reach them
+FUNNEL = ("login", "generate", "regenerate", "infographic", "insert_image", "export_pdf")
+
+
+def admin_required(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if ADMIN_API_TOKEN and hmac.compare_digest(token, ADMIN_API_TOKEN):
+            return view(*args, **kwargs)
+        if current_user.is_authenticated and (current_user.email or "").lower() in ADMIN_EMAILS:
+            return view(*args, **kwargs)
+        abort(403)
+    return wrapper
+
+
+def _json_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _csv_chunks(columns, partitions):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in partitions:
+        writer.writerows([_json_value(v) for v in row] for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _ndjson_chunks(columns, partitions):
+    for rows in partitions:
+        yield "".join(
+            json.dumps(dict(zip(columns, map(_json_value, row))), ensure_ascii=False) + "\n"
+            for row in rows)
+
+
+def create_blueprint(db, user_metrics, feedback_model, stats_model):
+    """user_metrics is the app's metrics_buffer.CounterBuffer."""
+    admin = Blueprint("admin", __name__, url_prefix="/admin")
+    stats = stats_model.__table__
+    feedback = feedback_model.__table__
+    tables = {user_metrics.table.name: user_metrics.table, feedback.name: feedback}
+
+    def read_stats(conn):
+        return dict(conn.execute(db.select(stats.c.name, stats.c.value)).all())
+
+    def refresh_feedback(conn, last_id):
+        """Count feedback rows added since last_id (unless another worker just did)."""
+        new_rows = conn.execute(
+            db.select(feedback.c.star_rating, feedback.c.would_recommend,
+                      db.func.count(), db.func.max(feedback.c.id))
+            .where(feedback.c.id > last_id)
+            .group_by(feedback.c.star_rating, feedback.c.would_recommend)
+        ).all()
+        if not new_rows:
+            return
+        deltas = {}
+        for rating, recommended, count, _ in new_rows:
+            deltas["user_feedback.count"] = deltas.get("user_feedback.count", 0) + count
+            key = f"user_feedback.rating_{rating}"
+            deltas[key] = deltas.get(key, 0) + count
+            if recommended:
+                deltas["user_feedback.recommended"] = deltas.get("user_feedback.recommended", 0) + count
+        new_last_id = max(row[3] for row in new_rows)
+        # Move the high-water mark first: if another worker already did,
+        # this matches nothing and the deltas are not added twice
+        if last_id:
+            moved = conn.execute(
+                stats.update()
+                .where(stats.c.name == "user_feedback.last_id", stats.c.value == last_id)
+                .values(value=new_last_id)
+            ).rowcount
+        else:
+            moved = conn.execute(
+                metrics_buffer.upsert(db, stats)
+                .values(name="user_feedback.last_id", value=new_last_id)
+                .on_conflict_do_nothing()
+            ).rowcount
+        if moved:
+            metrics_buffer.add_totals(conn, db, stats_model, deltas)
+
+    def rebuild_feedback(conn):
+        conn.execute(stats.delete().where(stats.c.name.like("user\\_feedback.%", escape="\\")))
+        refresh_feedback(conn, 0)
+
+    @admin.route("/exports/<table>.<fmt>")
+    @admin_required
+    def export(table, fmt):
+        if table not in tables or fmt not in EXPORT_FORMATS:
+            abort(404)
+        source = tables[table]
+        query = db.select(source).order_by(*source.primary_key.columns)
+        since = request.args.get("since")
+        if since:
+            try:
+                since = datetime.fromisoformat(since)
+            except ValueError:
+                return jsonify({"error": "since must be an ISO date or datetime"}), 400
+            changed = source.c.get("updated_at", source.c.get("submitted_at"))
+            query = query.where(changed >= since)
+        columns = [c.name for c in source.columns]
+        chunks = _csv_chunks if fmt == "csv" else _ndjson_chunks
+
+        def generate():
+            with db.engine.connect() as conn:
+                result = conn.execution_options(yield_per=EXPORT_BATCH_ROWS).execute(query)
+                yield from chunks(columns, result.partitions())
+
+        stamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+        return Response(stream_with_context(generate()), mimetype=EXPORT_FORMATS[fmt],
+                        headers={"Content-Disposition":
+                                 f"attachment; filename={table}-{stamp}.{fmt}"})
+
+    @admin.route("/aggregates")
+    @admin_required
+    def aggregates():
+        with db.engine.begin() as conn:
+            values = read_stats(conn)
+        if f"{user_metrics.table.name}.rebuilt_at" not in values:
+            # First call: totals from before the buffer kept them
+            user_metrics.rebuild_totals()
+        with db.engine.begin() as conn:
+            refresh_feedback(conn, read_stats(conn).get("user_feedback.last_id", 0))
+        with db.engine.begin() as conn:
+            values = read_stats(conn)
+        return jsonify(_report(values, user_metrics))
+
+    @admin.route("/aggregates/rebuild", methods=["POST"])
+    @admin_required
+    def rebuild_aggregates():
+        user_metrics.rebuild_totals()
+        with db.engine.begin() as conn:
+            rebuild_feedback(conn)
+            values = read_stats(conn)
+        return jsonify(_report(values, user_metrics))
+
+    return admin
+
+
+def _report(values, user_metrics):
+    name = user_metrics.table.name
+    active = values.get(f"{name}.users", 0)
+    funnel = []
+    for action in FUNNEL:
+        users = values.get(f"{name}.{action}_count.users", 0)
+        funnel.append({
+            "action": action,
+            "users": users,
+            "total": values.get(f"{name}.{action}_count", 0),
+            "share_of_active_users": round(users / active, 4) if active else None,
+        })
+    count = values.get("user_feedback.count", 0)
+    distribution = {str(r): values.get(f"user_feedback.rating_{r}", 0) for r in range(1, 6)}
+    return {
+        "active_users": active,
+        "totals_rebuilt_at": values.get(f"{name}.rebuilt_at"),
+        "funnel": funnel,
+        "feedback": {
+            "count": count,
+            "rating_distribution": distribution,
+            "average_rating": round(sum(int(r) * n for r, n in distribution.items()) / count, 3)
+            if count else None,
+            "recommend_rate": round(values.get("user_feedback.recommended", 0) / count, 4)
+            if count else None,
+            "last_id": values.get("user_feedback.last_id", 0),
+        },
+    }
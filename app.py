@@ -1,46 +1,65 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for,send_file,Response
-import requests
+"""GeniusPost web app.
+
+``create_app()`` builds the Flask app; ``app.app`` (what ``gunicorn app:app``,
+``flask --app app`` and asgi.py look up) is created on first access. Importing
+this module stays cheap: nothing connects to the database, and WeasyPrint and
+the LLM SDKs are only loaded by the code that needs them (pdf_jobs' pool
+processes, llm_gateway's first call).
+
+Tables and indexes are not created at import any more; run
+``flask --app app init-db`` when the schema changes (or set DB_INIT_ON_START=1
+to do it in create_app).
+"""
+from flask import Flask, Blueprint, render_template, request, jsonify, redirect, url_for,send_file,Response
 from flask_cors import CORS
 import os
-import openai
-from openai import OpenAI
-import anthropic
-from authlib.integrations.flask_client import OAuth
+import llm_gateway
+import response_cache
+import sse
+import generations
+import markdown_stream
+import prompts
+import providers
+import pdf_cache
+import pdf_jobs
+import metrics_buffer
+import user_cache
+import admin
+import google_auth
+import telemetry
 from flask_login import LoginManager, UserMixin, login_user, login_required, current_user, logout_user
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime, timezone
+from flask.sessions import SecureCookieSessionInterface
+from datetime import datetime
 
-from weasyprint import HTML, CSS
-from weasyprint.text.fonts import FontConfiguration
-from bs4 import BeautifulSoup
-
-import tempfile
 import base64
-from io import BytesIO
-import markdown 
+import threading
 import time
-import json 
 
 
+DB_INIT_ON_START = os.environ.get("DB_INIT_ON_START", "") == "1"
+
+# Bound to the app in create_app()
+db = SQLAlchemy()
+login_manager = LoginManager()
+login_manager.login_view = 'main.login'
+
+main = Blueprint("main", __name__)
 
+class AssetSkippingSessionInterface(SecureCookieSessionInterface):
+    """Don't verify or re-send the session cookie for /static files"""
+    def _is_asset(self, app, request):
+        return request.path.startswith(app.static_url_path + "/")
 
-app = Flask(__name__, template_folder="templates", static_folder="static")
-CORS(app)
-# openai.api_key = os.getenv("OPENAI_API_KEY")  # Set in environment
-app.secret_key = os.environ['SECRET_KEY']
-# Add this near the top with other configurations
-app.config['SESSION_COOKIE_DOMAIN'] = '.geniuspostai.com'  # Allow cookies across subdomains
-app.config['SESSION_COOKIE_SECURE'] = True  # HTTPS only
-app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
-# ─── Database Configuration ────────────────────────────
-# Render will inject DATABASE_URL into your environment
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ["DATABASE_URL"] 
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
+    def open_session(self, app, request):
+        if self._is_asset(app, request):
+            return self.null_session_class()
+        return super().open_session(app, request)
 
-# Setup Flask-Login
-login_manager = LoginManager(app)
-login_manager.login_view = 'login'
+    def save_session(self, app, session, response):
+        if self._is_asset(app, request):
+            return
+        return super().save_session(app, session, response)
 
 #### Added Db model 
 class User(db.Model, UserMixin):
@@ -65,44 +84,55 @@ class UserMetrics(db.Model):
     insert_image_count = db.Column(db.Integer, default=0, nullable=False)
     regenerate_count   = db.Column(db.Integer, default=0, nullable=False)
     clear_count        = db.Column(db.Integer, default=0, nullable=False)
-    updated_at         = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at         = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
 
     user = db.relationship("User", backref="metrics", uselist=False)
 
-
-    def touch(self, action):
-        """Increment the right counter (even if it was None) and update timestamp."""
-        attr = f"{action}_count"
-        current = getattr(self, attr) or 0
-        setattr(self, attr, current + 1)
-        self.updated_at = datetime.now(timezone.utc)
-
 ########################User Feedback ################################
 class UserFeedback(db.Model):
     __tablename__ = "user_feedback"
     
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    user_id = db.Column(db.String(50), db.ForeignKey("user.id"), nullable=False)
+    user_id = db.Column(db.String(50), db.ForeignKey("user.id"), nullable=False, index=True)
     username = db.Column(db.String(150), nullable=False)
     email = db.Column(db.String(150), nullable=False)
     star_rating = db.Column(db.Integer, nullable=False)  # 1-5
     improvement_suggestion = db.Column(db.Text, nullable=True)  # What could make it 100x better
     would_recommend = db.Column(db.Boolean, nullable=False)  # True=Yes, False=No
-    submitted_at = db.Column(db.DateTime, default=datetime.now(timezone.utc), nullable=False)
+    submitted_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
     
     user = db.relationship("User", backref="feedback")
     
     def __repr__(self):
         return f"<UserFeedback user_id={self.user_id} rating={self.star_rating}>"
+
+# Running totals behind /admin/aggregates (admin.py)
+class AdminStat(db.Model):
+    __tablename__ = "admin_stats"
+
+    name  = db.Column(db.String(100), primary_key=True)
+    value = db.Column(db.BigInteger, default=0, nullable=False)
 ########################################################
-# Create the database tables if they don't exist
-with app.app_context():
+
+def init_db():
+    """Create missing tables, and indexes declared since a table was created
+    (create_all skips tables that already exist)."""
     db.create_all()
+    for model in (UserMetrics, UserFeedback):
+        for index in model.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
+
+# Counter bumps are buffered and written in batches (metrics_buffer.py)
+user_metrics = metrics_buffer.CounterBuffer(db, UserMetrics, totals=AdminStat)
+
+admin_api = admin.create_blueprint(db, user_metrics, UserFeedback, AdminStat)
+
+# Logged-in users are cached per worker instead of loaded on every request (user_cache.py)
+user_by_id = user_cache.UserCache(User)
 
 @login_manager.user_loader
 def load_user(user_id):
-    print("USER ID", User.query.get(user_id))
-    return User.query.get(user_id) 
+    return user_by_id.get(user_id)
     
 # Google OAuth configuration – store these in your environment variables
 GOOGLE_CLIENT_ID = os.environ.get("GOOGLE_CLIENT_ID")
@@ -110,229 +140,379 @@ GOOGLE_CLIENT_SECRET = os.environ.get("GOOGLE_CLIENT_SECRET")
 # Set your redirect URI as registered in the Google console
 REDIRECT_URI = os.environ.get("REDIRECT_URI")
 
-# to alert at startup whether a var is missing. 
-for var in ('GOOGLE_CLIENT_ID','GOOGLE_CLIENT_SECRET','REDIRECT_URI','SECRET_KEY'):
-    if not os.environ.get(var):
-        raise RuntimeError(f"Missing required env var: {var}")
-
-@app.route("/login")
+@main.route("/login")
 def login():
     # grab the “next” page (default to /geniuspost)
-    next_page = request.args.get("next", url_for("geniuspost"))
+    next_page = request.args.get("next", url_for("main.geniuspost"))
 
     # include that as state, so Google will echo it back
-    google_auth_url = (
-        "https://accounts.google.com/o/oauth2/auth?"
-        "response_type=code"
-        f"&client_id={GOOGLE_CLIENT_ID}"
-        f"&redirect_uri={REDIRECT_URI}"
-        "&scope=openid+email+profile"
-        f"&state={next_page}"
-    )
-    return redirect(google_auth_url)
+    return redirect(google_auth.auth_url(GOOGLE_CLIENT_ID, REDIRECT_URI, next_page))
 
-@app.route("/authorize")
+@main.route("/authorize")
 def authorize():
     code = request.args.get("code")
     if not code:
         return "Error: No code provided", 400
     # Google will return us the original state
-    next_page = request.args.get("state", url_for("geniuspost"))
-    # Exchange authorization code for tokens 
-    token_url = "https://oauth2.googleapis.com/token"
-    token_data = {
-        "code": code,
-        "client_id": GOOGLE_CLIENT_ID,
-        "client_secret": GOOGLE_CLIENT_SECRET,
-        "redirect_uri": REDIRECT_URI,
-        "grant_type": "authorization_code"
-    }
-    print("Token data:", token_data)
-    token_response = requests.post(token_url, data=token_data)
-    token_json = token_response.json()
-    print("Token response:", token_json)
-    access_token = token_json.get("access_token")
-    if not access_token:
-        # Log error details if access token is missing
-        return "Access token not retrieved. Check token response.", 400 
-    
-    # Fetch user info from Google
-    user_info_url = "https://openidconnect.googleapis.com/v1/userinfo" #"https://www.googleapis.com/oauth2/v2/userinfo"
-    headers = {"Authorization": f"Bearer {access_token}"}
-    user_info_response = requests.get(user_info_url, headers=headers)
-    print("User info response:", user_info_response.json())
-    
-    if user_info_response.status_code == 200:
-        user_data = user_info_response.json()
-        # Check if user already exists in the database
-        user = User.query.get(user_data["sub"])
-        print("User validated:", user)
-        if not user:
-            user = User(
-                id=user_data["sub"],
-                name=user_data["name"],
-                email=user_data["email"],
-                avatar_url=user_data.get("picture")
-            )
-            db.session.add(user)
-            db.session.commit()
-        print("\n\nUser Record:\n\n",user )
-        # login_user(user)
-        # return redirect(url_for("home"))
-        login_user(user)
-        # fetch or create the metrics row
-        metrics = UserMetrics.query.get(user.id)
-        if not metrics:
-            metrics = UserMetrics(
-                user_id=user.id,
-                username=user.name,
-                email=user.email
-            )
-            db.session.add(metrics)
-
-        metrics.touch("login")
+    next_page = request.args.get("state", url_for("main.geniuspost"))
+    # Exchange the code for tokens; the user comes from the id_token, checked
+    # locally against Google's (cached) signing keys - no userinfo call
+    try:
+        tokens = google_auth.exchange_code(code, GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET, REDIRECT_URI)
+        user_data = google_auth.verify_id_token(tokens["id_token"], GOOGLE_CLIENT_ID)
+    except google_auth.GoogleAuthError as e:
+        print(f"Google sign-in failed: {e}")
+        return "User information could not be retrieved", 400
+
+    # Check if user already exists in the database
+    user = User.query.get(user_data["sub"])
+    print("User validated:", user)
+    if not user:
+        user = User(
+            id=user_data["sub"],
+            name=user_data.get("name") or user_data["email"],
+            email=user_data["email"],
+            avatar_url=user_data.get("picture")
+        )
+        db.session.add(user)
         db.session.commit()
-
-        # finally send them on to whatever they originally wanted
-        return redirect(next_page)
-    else:
-        return "User information could not be retrieved", 400  
-
-@app.route("/logout")
+    print("\n\nUser Record:\n\n",user )
+    # login_user(user)
+    # return redirect(url_for("home"))
+    user_by_id.put(user)
+    login_user(user)
+    # bump the login counter (the metrics row is created on first flush)
+    user_metrics.add(user, "login")
+
+    # finally send them on to whatever they originally wanted
+    return redirect(next_page)
+
+@main.route("/logout")
 @login_required
 def logout():
+    user_by_id.forget(current_user.id)
     logout_user()
-    return redirect(url_for("home"))
+    return redirect(url_for("main.home"))
 
-@app.route('/')
+@main.route('/')
 def home():
     # return render_template('index_claude.html')
     return render_template('geniuspost_homepage.html',current_user=current_user) 
 
-@app.before_request
+@main.before_app_request
 def require_login_for_genius():
+    if request.endpoint == "static":
+        return
     # if they hit /geniuspost and aren’t authed, send to login
-    if request.endpoint == "geniuspost" and not current_user.is_authenticated:
-        return redirect(url_for("login", next=url_for("geniuspost")))
+    if request.endpoint == "main.geniuspost" and not current_user.is_authenticated:
+        return redirect(url_for("main.login", next=url_for("main.geniuspost")))
 
-@app.route("/geniuspost") 
+@main.route("/geniuspost") 
 def geniuspost():
     return render_template("index_claude.html", current_user=current_user)
 
-@app.route("/pricing")
+@main.route("/pricing")
 def pricing():
     return render_template('pricing.html') 
 
+################################################################################
+# Claude calls shared by /generate and /generate-stream (and asgi.py)
+
+# Opt-in (RESPONSE_CACHE=memory|sqlite); None when disabled
+llm_cache = response_cache.from_env()
+llm_inflight = response_cache.SingleFlight()
+
+
+def close_on_cancel(stream, flight=None):
+    """Close the upstream stream as soon as the generation reading it is
+    cancelled, unless other requests are following the same flight."""
+    generation = generations.current()
+    if generation is None:
+        return
+
+    def close():
+        if flight is None or flight.abandon("no readers left"):
+            stream.close()
+
+    generation.on_cancel(close)
+
+
+def pump_flight(key, flight, stream, upstream):
+    """Finish a flight whose leader stopped reading, for its followers;
+    stops once the last of them leaves too."""
+    try:
+        for text in upstream:
+            flight.append(text)
+            if flight.abandon("no readers left"):
+                stream.close()
+                return
+    except Exception as e:
+        flight.fail(e)
+        return
+    if providers.from_primary(stream):
+        llm_cache.set(key, flight.text())
+    flight.finish()
+
+
+def claude_text_stream(prompt):
+    """Yield the answer's text deltas for prompt (from Claude, or from the
+    secondary provider when providers.py hedges or fails over).
+
+    With the response cache enabled, cached answers are replayed and
+    concurrent identical prompts follow a single upstream stream.
+    """
+    if llm_cache is None:
+        stream = providers.stream(prompt)
+        close_on_cancel(stream)
+        yield from telemetry.llm_stream(stream, "upstream", stream.output_tokens)
+        return
+
+    key = response_cache.make_key(prompt, **prompts.cache_params())
+    cached = llm_cache.get(key)
+    if cached is not None:
+        yield from telemetry.llm_stream(response_cache.replay(cached), "cache")
+        return
+    flight, leader = llm_inflight.join(key)
+    if not leader:
+        try:
+            yield from telemetry.llm_stream(flight.follow(), "shared")
+        except GeneratorExit:
+            # The leader's upstream call goes on without this reader
+            generations.detach()
+            raise
+        return
+    try:
+        stream = providers.stream(prompt)
+        close_on_cancel(stream, flight)
+        upstream = telemetry.llm_stream(stream, "upstream", stream.output_tokens)
+        for text in upstream:
+            flight.append(text)
+            yield text
+    except GeneratorExit:
+        # This reader went away (e.g. its generation was cancelled), but
+        # followers still need the rest of the answer
+        if flight.abandon("no readers left"):
+            stream.close()
+        else:
+            generations.detach()
+            threading.Thread(target=pump_flight, args=(key, flight, stream, upstream),
+                             daemon=True).start()
+        raise
+    except BaseException as e:
+        flight.fail(e)
+        raise
+    if providers.from_primary(stream):
+        llm_cache.set(key, flight.text())
+    flight.finish()
+
+
+def claude_complete(prompt):
+    """Return Claude's full answer for prompt, using the cache when enabled."""
+    if llm_cache is None:
+        # Streamed, so the first-token deadline applies here as well
+        return "".join(providers.stream(prompt))
+
+    key = response_cache.make_key(prompt, **prompts.cache_params())
+    cached = llm_cache.get(key)
+    if cached is not None:
+        return cached
+    flight, leader = llm_inflight.join(key)
+    if not leader:
+        return flight.result()
+    try:
+        stream = providers.stream(prompt)
+        text = "".join(stream)
+    except BaseException as e:
+        flight.fail(e)
+        raise
+    flight.append(text)
+    if providers.from_primary(stream):
+        llm_cache.set(key, text)
+    flight.finish()
+    return text
+
 ################################################################################
 # 1. ADD THIS NEW STREAMING ENDPOINT - Replace your existing /generate route
 
-@app.route('/generate-stream', methods=['POST'])
+generation_registry = generations.GenerationRegistry()
+
+
+@main.route('/generate-stream', methods=['POST'])
 def generate_stream():
     """Streaming endpoint that sends chunks as they're generated"""
+    # A reconnecting client resumes its generation instead of starting over
+    resume = generations.parse_event_id(request.headers.get('Last-Event-ID'))
+    if resume:
+        generation = generation_registry.get(resume[0])
+        if generation is not None:
+            return stream_generation(generation, resume[1], request.args.get('render') == 'html')
+
     data = request.json or {}
+    # The instructions go in the system block (prompts.py), so this sees the user's own text
     prompt = data.get('prompt', '').strip()
-    prompt_decorator = 'Important: 1) Dont give unnecessary information. 2) Sound as human-like as possible. Understand when to be creative, formal, casual, or smart. 3) Always use headings and subheadings unless mentioned otherwise. 4) Always split the code into smaller chunks.' 
-    prompt = prompt + prompt_decorator
-    
     if not prompt:
         return jsonify({'error': 'Prompt is required.'}), 400
 
+    generation = generation_registry.start(claude_text_stream(prompt))
+    # render: "html" adds incremental HTML patches to the frames (markdown_stream.py)
+    return stream_generation(generation, 0, data.get('render') == 'html')
+
+
+@main.route('/generate-stream/<generation_id>', methods=['GET'])
+def resume_generation_stream(generation_id):
+    """Replay a generation from Last-Event-ID (or ?offset=) and keep streaming"""
+    generation = generation_registry.get(generation_id)
+    if generation is None:
+        return jsonify({'error': 'Generation expired or unknown.'}), 404
+    offset = request.args.get('offset', 0, type=int)
+    resume = generations.parse_event_id(request.headers.get('Last-Event-ID'))
+    if resume and resume[0] == generation_id:
+        offset = resume[1]
+    return stream_generation(generation, offset, request.args.get('render') == 'html')
+
+
+@main.route('/generate-stream/<generation_id>', methods=['DELETE'])
+def cancel_generation_stream(generation_id):
+    """Stop a generation straight away (e.g. the user pressed clear)"""
+    generation = generation_registry.get(generation_id)
+    if generation is None:
+        return jsonify({'error': 'Generation expired or unknown.'}), 404
+    return jsonify({'cancelled': generation.cancel('cancelled by client')})
+
+
+# How many versions one /generate-variants request may ask for, and how many
+# of a user's generations it runs upstream at once (the rest wait their turn)
+GENERATE_VARIANTS_MAX = int(os.environ.get("GENERATE_VARIANTS_MAX", "6"))
+GENERATE_VARIANTS_PER_USER = int(os.environ.get("GENERATE_VARIANTS_PER_USER", "3"))
+
+variant_limiter = generations.KeyedLimiter(GENERATE_VARIANTS_PER_USER)
+
+
+def limited_text_stream(prompt, user_key):
+    """claude_text_stream(prompt) once the user has a free variant slot"""
+    generation = generations.current()
+    with variant_limiter.hold(user_key, lambda: generation is not None and generation.cancelled):
+        yield from claude_text_stream(prompt)
+
+
+def _strings(value):
+    """value as a list of stripped strings, or None if it is not a list of strings"""
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        return None
+    return [item.strip() for item in value]
+
+
+@main.route('/generate-variants', methods=['POST'])
+@login_required
+def generate_variants():
+    """Several versions at once over one SSE stream: {"prompt", "variants": [styles]}
+    or {"prompts": [...]} (e.g. a carousel series). Every frame carries its
+    "variant" index; the first one lists the variants with their generation
+    ids, which /generate-stream/<id> can resume one by one.
+
+    Signed-in users only: GENERATE_VARIANTS_PER_USER is counted per account."""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object.'}), 400
+    if data.get('prompts') is not None:
+        labels = _strings(data['prompts'])
+        if labels is None:
+            return jsonify({'error': '"prompts" must be a list of strings.'}), 400
+        variant_prompts = labels
+    else:
+        prompt = data.get('prompt') or ''
+        labels = _strings(data.get('variants') or [])
+        if not isinstance(prompt, str) or labels is None:
+            return jsonify({'error': '"prompt" must be a string and "variants" a list of strings.'}), 400
+        prompt = prompt.strip()
+        if not prompt:
+            return jsonify({'error': 'Prompt is required.'}), 400
+        variant_prompts = [prompts.variant_prompt(prompt, label) for label in labels]
+    if not labels or not all(labels):
+        return jsonify({'error': 'Give non-empty "variants" or "prompts".'}), 400
+    if len(labels) > GENERATE_VARIANTS_MAX:
+        return jsonify({'error': f'At most {GENERATE_VARIANTS_MAX} variants per request.'}), 400
+
+    user_key = current_user.get_id()
+    # All start now; the limiter decides how many reach the upstream at once
+    started = [generation_registry.start(limited_text_stream(p, user_key))
+               for p in variant_prompts]
+    render_html = data.get('render') == 'html'
+
+    def generate_frames():
+        source = generations.MultiSubscription(started)
+        writers = [
+            sse.StreamWriter(id_prefix=f"{generation.id}:", fields={'variant': index},
+                             renderer=markdown_stream.IncrementalMarkdown() if render_html else None)
+            for index, generation in enumerate(started)
+        ]
+        try:
+            yield sse.format_event({'variants': [
+                {'variant': index, 'label': label, 'generation': generation.id}
+                for index, (label, generation) in enumerate(zip(labels, started))]})
+            yield from sse.multiplex(writers, source)
+        finally:
+            source.close()
+
+    return Response(generate_frames(), mimetype=sse.MIMETYPE, headers=sse.HEADERS)
+
+
+def stream_generation(generation, offset, render_html=False):
     def generate_chunks():
-        """Generator function that yields chunks as they come from Claude"""
+        """Yield coalesced SSE frames as the text comes from Claude"""
+        # 🔥 Deltas are merged into frames on a time/byte budget (see sse.py)
+        subscription = generation.subscribe(offset)
+        renderer = None
+        if render_html:
+            # Catch up on the text before the offset; the first frame then
+            # sends every finished block again
+            renderer = markdown_stream.IncrementalMarkdown()
+            renderer.feed(generation.text[:subscription.offset])
+        writer = sse.StreamWriter(offset=subscription.offset, id_prefix=f"{generation.id}:",
+                                  renderer=renderer)
         try:
-            client = anthropic.Anthropic(api_key=os.environ["CLAUDE_APIKEY"])
-            
-            # 🔥 USE STREAMING API - This is the key change
-            with client.messages.stream(
-                model="claude-sonnet-4-20250514",
-                max_tokens=1200,
-                temperature=1,
-                messages=[{
-                    "role": "user", 
-                    "content": prompt
-                }]
-            ) as stream:
-                for text in stream.text_stream:
-                    if text:  # Only send non-empty chunks
-                        # Format as Server-Sent Events
-                        yield f"data: {json.dumps({'chunk': text, 'done': False})}\n\n"
-            
-            # Send completion signal
-            yield f"data: {json.dumps({'chunk': '', 'done': True})}\n\n"
-            
-        except Exception as e:
-            # Send error
-            yield f"data: {json.dumps({'error': str(e), 'done': True})}\n\n"
-
-    return Response(
-        generate_chunks(),
-        content_type='text/plain; charset=utf-8',
-        headers={
-            'Cache-Control': 'no-cache',
-            'Connection': 'keep-alive',
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Headers': 'Content-Type',
-        }
-    )
+            yield from writer.frames(subscription)
+        finally:
+            # GeneratorExit lands here when the client goes away; the last
+            # reader leaving starts the orphan grace period
+            subscription.close()
+
+    headers = dict(sse.HEADERS, **{'X-Generation-Id': generation.id})
+    return Response(generate_chunks(), mimetype=sse.MIMETYPE, headers=headers)
 
 # 2. KEEP YOUR EXISTING /generate ROUTE AS FALLBACK (in case streaming fails)
 ###################################################################################
-@app.route('/generate', methods=['POST'])
+@main.route('/generate', methods=['POST'])
 def generate():
     data = request.json or {}
     prompt = data.get('prompt', '').strip()
-    prompt_decorator = 'Important: 1) Dont give unnecessary information. 2) Sound as human-like as possible. Understand when to be creative, formal, casual, or smart. 3) Always use headings and subheadings unless mentioned otherwise. 4) Always split the code into smaller chunks.' 
-    prompt = prompt + prompt_decorator
     if not prompt:
         return jsonify({'error': 'Prompt is required.'}), 400
 
-    # client = OpenAI(organization=os.environ["GPT_ORG"],
-    #                 project=os.environ["GPT_PROJECT"],
-    #                 api_key = os.environ["GPT_APIKEY"])
-    # try:
-    #     response = client.chat.completions.create(
-    #         model="gpt-4o-mini",  # Specify the GPT-4o Mini model
-    #         messages=[
-    #             {"role": "user", "content": prompt} 
-    #         ],
-    #         max_tokens=2000,       # Adjust based on your requirements
-    #         temperature=0.7,      # Controls randomness
-    #         top_p=1.0,            # Controls diversity of the output
-    #         n=1                   # Number of responses to generate
-    #     )
-        
-    #     text = response.choices[0].message.content.strip() 
-    
-    client = anthropic.Anthropic(
-        api_key=os.environ["CLAUDE_APIKEY"]
-    )
+    started = time.perf_counter()
     try:
-        response = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=1200,
-            temperature=1,
-            messages=[
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ]
-        )
-        text = response.content[0].text.strip()
+        text = claude_complete(prompt).strip()
+        telemetry.GENERATE_LATENCY.labels("ok").observe(time.perf_counter() - started)
         return jsonify({ 'result': text })
+    except llm_gateway.GatewayBusy as e:
+        telemetry.GENERATE_LATENCY.labels("busy").observe(time.perf_counter() - started)
+        telemetry.GENERATE_ERRORS.labels(type(e).__name__).inc()
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
     except Exception as e:
+        telemetry.GENERATE_LATENCY.labels("error").observe(time.perf_counter() - started)
+        telemetry.GENERATE_ERRORS.labels(type(e).__name__).inc()
         return jsonify({'error': str(e)}), 500
 
-@app.route('/markdown_editor.html')
+@main.route('/markdown_editor.html')
 def markdown_editor():
     return render_template('markdown_editor.html')
 
-@app.route("/carousel_template.html")
+@main.route("/carousel_template.html")
 def carousel_template():
     return render_template("carousel_template.html")
 
 
-@app.route("/track_action", methods=["POST"])
+@main.route("/track_action", methods=["POST"])
 @login_required
 def track_action():
     data   = request.get_json() or {}
@@ -349,24 +529,13 @@ def track_action():
     if action not in allowed:
         return jsonify({"error": "Invalid action"}), 400
 
-    # fetch or create the single metrics row
-    metrics = UserMetrics.query.get(current_user.id)
-    if not metrics:
-        metrics = UserMetrics(
-            user_id=current_user.id,
-            username=current_user.name,
-            email=current_user.email
-        )
-        db.session.add(metrics)
-
-    # bump the right counter
-    metrics.touch(allowed[action])
-    db.session.commit()
+    # bump the right counter (written to user_metrics in the background)
+    user_metrics.add(current_user, allowed[action])
 
     return jsonify({"status": "ok"})
 
 #####################submit_feedback route#############################
-@app.route("/submit_feedback", methods=["POST"])
+@main.route("/submit_feedback", methods=["POST"])
 @login_required
 def submit_feedback():
     try:
@@ -402,7 +571,7 @@ def submit_feedback():
         print(f"Feedback submission error: {str(e)}")
         return jsonify({"error": "Failed to submit feedback"}), 500
 
-@app.route("/check_feedback_status", methods=["GET"])
+@main.route("/check_feedback_status", methods=["GET"])
 
 @login_required
 def check_feedback_status():
@@ -410,483 +579,116 @@ def check_feedback_status():
     existing_feedback = UserFeedback.query.filter_by(user_id=current_user.id).first()
     return jsonify({"has_submitted": existing_feedback is not None})
 
-def create_enhanced_pdf_html(content, template, captured_styles=''):
-    """Create complete HTML document with variable fonts for PDF generation"""
-    
-    # Get absolute path to static directory
-    static_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), 'static'))
-    fonts_dir = os.path.join(static_dir, 'fonts')
-    
-    # Debug: Print font paths to verify they exist
-    print(f"Static directory: {static_dir}")
-    print(f"Fonts directory: {fonts_dir}")
-    print(f"Fonts directory exists: {os.path.exists(fonts_dir)}")
-    
-    # Generate variable font-face declarations with absolute file paths
-    variable_font_css = f"""
-        /* Variable Font Definitions for PDF */
-        @font-face {{
-            font-family: 'Inter';
-            src: url('file://{fonts_dir}/Inter-VariableFont.ttf') format('truetype');
-            font-weight: 100 900;
-            font-style: normal;
-        }}
-        @font-face {{
-            font-family: 'Inter';
-            src: url('file://{fonts_dir}/Inter-Italic-VariableFont.ttf') format('truetype');
-            font-weight: 100 900;
-            font-style: italic;
-        }}
-
-        @font-face {{
-            font-family: 'JetBrains Mono';
-            src: url('file://{fonts_dir}/JetBrainsMono-VariableFont.ttf') format('truetype');
-            font-weight: 100 800;
-            font-style: normal;
-        }}
-        @font-face {{ 
-            font-family: 'JetBrains Mono';
-            src: url('file://{fonts_dir}/JetBrainsMono-Italic-VariableFont.ttf') format('truetype');
-            font-weight: 100 800;
-            font-style: italic;
-        }}
-
-        @font-face {{
-            font-family: 'Playfair Display';
-            src: url('file://{fonts_dir}/PlayfairDisplay-VariableFont.ttf') format('truetype');
-            font-weight: 400 900;
-            font-style: normal;
-        }}
-        @font-face {{
-            font-family: 'Playfair Display';
-            src: url('file://{fonts_dir}/PlayfairDisplay-Italic-VariableFont.ttf') format('truetype');
-            font-weight: 400 900;
-            font-style: italic;
-        }}
-
-        @font-face {{
-            font-family: 'Space Grotesk';
-            src: url('file://{fonts_dir}/SpaceGrotesk-VariableFont.ttf') format('truetype');
-            font-weight: 300 700;
-            font-style: normal;
-        }}
-
-        @font-face {{
-            font-family: 'Crimson Pro';
-            src: url('file://{fonts_dir}/CrimsonPro-VariableFont.ttf') format('truetype');
-            font-weight: 200 900;
-            font-style: normal;
-        }}
-        @font-face {{
-            font-family: 'Crimson Pro';
-            src: url('file://{fonts_dir}/CrimsonPro-Italic-VariableFont.ttf') format('truetype');
-            font-weight: 200 900;
-            font-style: italic;
-        }}
-
-        @font-face {{
-            font-family: 'Fraunces';
-            src: url('file://{fonts_dir}/Fraunces-VariableFont.ttf') format('truetype');
-            font-weight: 100 900;
-            font-style: normal;
-        }}
-        @font-face {{
-            font-family: 'Fraunces';
-            src: url('file://{fonts_dir}/Fraunces-Italic-VariableFont.ttf') format('truetype');
-            font-weight: 100 900;
-            font-style: italic;
-        }}
-
-        @font-face {{
-            font-family: 'Open Sans';
-            src: url('file://{fonts_dir}/OpenSans-VariableFont.ttf') format('truetype');
-            font-weight: 300 800;
-            font-style: normal;
-        }}
-        @font-face {{
-            font-family: 'Open Sans';
-            src: url('file://{fonts_dir}/OpenSans-Italic-VariableFont.ttf') format('truetype');
-            font-weight: 300 800;
-            font-style: italic;
-        }}
-
-        /* Static fonts */
-        @font-face {{
-            font-family: 'Kalam';
-            src: url('file://{fonts_dir}/Kalam-Light.ttf') format('truetype');
-            font-weight: 300;
-            font-style: normal;
-        }}
-        @font-face {{
-            font-family: 'Kalam';
-            src: url('file://{fonts_dir}/Kalam-Regular.ttf') format('truetype');
-            font-weight: 400;
-            font-style: normal;
-        }}
-        @font-face {{
-            font-family: 'Kalam';
-            src: url('file://{fonts_dir}/Kalam-Bold.ttf') format('truetype');
-            font-weight: 700;
-            font-style: normal;
-        }}
-    """
-    
-    complete_template_styles = f"""
-    <style>
-        /* VARIABLE FONT DEFINITIONS FOR PDF */
-        {variable_font_css}
-        
-        /* PDF PAGE CONTROL - CUSTOM SIZE */
-        @page {{
-            size: 1080px 1350px;
-            margin: 8px;
-            padding: 0px;
-        }}
-        
-        /* ✅ FIRST PAGE ONLY - Footer */
-        @page :first {{
-            margin: 8px 8px 30px 8px; 
-            
-            @bottom-center {{
-                content: "Generated with GeniusPost AI";
-                font-family: 'Space Grotesk', Arial, sans-serif;
-                font-size: 18px;
-                font-weight: 700;
-                color: #2c3e50;
-                background: rgba(255,255,255,0.9);
-                padding: 8px 16px;
-                border-radius: 20px;
-                letter-spacing: 1px;
-                text-transform: uppercase;
-                box-shadow: 0 2px 8px rgba(0,0,0,0.15);
-                margin-top: 5px;
-            }}
-        }}
-        
-        /* BASIC PDF LAYOUT - NO FONT OVERRIDES */
-        * {{
-            box-sizing: border-box;
-            margin: 0;
-            padding: 0;
-        }}
-        
-        html, body {{
-            width: 1064px;
-            margin: 0 !important;
-            padding: 0px !important;
-            /* NO font-family here - let captured styles handle it */
-        }}
-        
-        .pdf-container {{
-            width: 1064px;
-            margin: 0;
-            padding: 0;
-            position: relative;
-        }}
-        
-        .template-base {{
-            width: 1064px !important;
-            min-height: 1324px !important;
-            margin: 0 !important;
-            padding: 30px !important;
-            position: relative;
-            box-sizing: border-box;
-            page-break-inside: auto;
-        }}
-        
-        /* 🔥 PAGE BREAK CONTROLS - NO FONT OVERRIDES */
-        h1, h2, h3, h4, h5, h6 {{
-            page-break-after: auto !important;
-            page-break-inside: avoid;
-            page-break-before: auto;
-            margin-top: 20px;
-            margin-bottom: 15px;
-            orphans: 2;
-            widows: 2;
-        }}
-
-        p {{
-            page-break-inside: auto;
-            orphans: 2;
-            widows: 2;
-            margin-bottom: 12px;
-            line-height: 1.6;
-            /* NO font-family - let captured styles handle it */
-        }}
-        
-        ul, ol {{
-            page-break-inside: auto;
-            margin: 15px 0;
-        }}
-        
-        li {{
-            page-break-inside: auto;
-            orphans: 2;
-            widows: 2;
-            margin-bottom: 8px;
-            /* NO font-family - let captured styles handle it */
-        }}
-        
-        blockquote {{
-            page-break-inside: auto;
-            margin: 20px 0;
-            padding: 15px 20px;
-            border-left: 4px solid #ddd;
-            background: #f9f9f9;
-            orphans: 2;
-            widows: 2;
-        }}
-        
-        table {{
-            page-break-inside: auto;
-            margin: 20px 0;
-            width: 100%;
-            border-collapse: collapse;
-        }}
-        
-        thead {{
-            page-break-after: avoid;
-        }}
-        
-        tbody tr {{
-            page-break-inside: avoid;
-            page-break-after: auto;
-        }}
-        
-        th, td {{
-            padding: 12px;
-            border: 1px solid #ddd;
-            vertical-align: top;
-            /* NO font-family - let captured styles handle it */
-        }}
-        
-        th {{
-            font-weight: 600;
-            /* NO font-family - let captured styles handle it */
-        }}
-        
-        img {{
-            max-width: 1004px !important;
-            width: 100% !important;
-            height: auto !important;
-            display: block !important;
-            page-break-inside: avoid;
-            page-break-before: auto;
-            page-break-after: auto;
-            margin: 20px auto !important;
-            object-fit: contain !important;
-            border-radius: 16px !important;
-            position: relative !important;
-        }}
-        
-        div {{
-            page-break-inside: auto;
-        }}
-        
-        /* CAPTURED STYLES - This handles all fonts and styling */
-        {captured_styles}
-        
-        /* 🔥 MINIMAL OVERRIDES - Only fix what breaks in PDF */
-        @import {{ display: none !important; }}
-        
-        /* Only override code fonts (functional requirement) */
-        pre, code {{
-            font-family: 'JetBrains Mono', 'Courier New', monospace !important;
-        }}
-        
-        /* Print optimization */
-        * {{
-            -webkit-print-color-adjust: exact !important;
-            color-adjust: exact !important;
-        }}
-    </style>
-    """
-    
-    # Preprocess content for better page breaks
-    processed_content = preprocess_content_for_pdf(content)
-    
-    return f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="UTF-8">
-        <title>Carousel PDF - {template}</title>
-        {complete_template_styles}
-    </head>
-    <body>
-        <div class="pdf-container">
-            <div class="{template}-template template-base">
-                {processed_content}
-            </div>
-        </div>
-    </body>
-    </html>
-    """
+pdf_job_queue = pdf_jobs.JobQueue(cache=pdf_cache.from_env())
 
 
-def preprocess_content_for_pdf(content):
-    """
-    Preprocess HTML content to optimize for PDF page breaks
-    """
-    
+def pdf_job_params():
+    data = request.get_json() or {}
+    return {
+        'content': data.get('content', ''),
+        'template': data.get('template', 'tech-neural'),
+        'styles': data.get('styles', ''),
+        'base_url': request.url_root,
+        'mode': data.get('mode') or pdf_jobs.PDF_RENDER_MODE,
+    }
+
+
+@main.route('/pdf-jobs', methods=['POST'])
+def submit_pdf_job():
+    """Queue a PDF export; poll status_url, then fetch download_url"""
     try:
-        soup = BeautifulSoup(content, 'html.parser')
-        
-        # 🔥 SMART CONTENT SPLITTING
-        
-        # Find very long paragraphs and add soft breaks
-        for p in soup.find_all('p'):
-            if p.get_text() and len(p.get_text()) > 800:  # Long paragraphs
-                p['class'] = p.get('class', []) + ['long-content']
-                
-                # Split very long paragraphs at sentence boundaries
-                text = p.get_text()
-                if len(text) > 1200:  # Very long content
-                    sentences = text.split('. ')
-                    if len(sentences) > 3:
-                        # Split into smaller paragraphs
-                        p.clear()
-                        mid_point = len(sentences) // 2
-                        
-                        # First half
-                        first_half = '. '.join(sentences[:mid_point]) + '.'
-                        first_p = soup.new_tag('p', **{'class': 'long-content'})
-                        first_p.string = first_half
-                        
-                        # Second half  
-                        second_half = '. '.join(sentences[mid_point:])
-                        if not second_half.endswith('.'):
-                            second_half += '.'
-                        second_p = soup.new_tag('p', **{'class': 'long-content'})
-                        second_p.string = second_half
-                        
-                        # Replace original paragraph
-                        p.insert_before(first_p)
-                        p.insert_before(second_p)
-                        p.decompose()
-        
-        # 🔥 OPTIMIZE LISTS FOR PAGE BREAKS
-        for ul in soup.find_all(['ul', 'ol']):
-            items = ul.find_all('li')
-            if len(items) > 8:  # Long lists
-                # Add page break hints every 6-8 items
-                for i, item in enumerate(items):
-                    if i > 0 and i % 7 == 0:  # Every 7th item
-                        item['style'] = item.get('style', '') + ' page-break-before: auto;'
-        
-        # 🔥 HANDLE LARGE CODE BLOCKS
-        for pre in soup.find_all('pre'):
-            code_text = pre.get_text()
-            if len(code_text) > 1000:  # Long code blocks
-                # Add line break opportunities
-                lines = code_text.split('\n')
-                if len(lines) > 25:  # Many lines
-                    # Split into smaller code blocks
-                    pre.clear()
-                    chunk_size = 20
-                    
-                    for i in range(0, len(lines), chunk_size):
-                        chunk_lines = lines[i:i + chunk_size]
-                        new_pre = soup.new_tag('pre')
-                        new_pre.string = '\n'.join(chunk_lines)
-                        
-                        if i > 0:  # Add spacing between chunks
-                            spacing = soup.new_tag('div', style='height: 10px;')
-                            pre.insert_before(spacing)
-                        
-                        pre.insert_before(new_pre)
-                    
-                    pre.decompose()
-        
-        # 🔥 ADD SMART BREAK OPPORTUNITIES
-        
-        # Add break opportunities after every few headings
-        headings = soup.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
-        for i, heading in enumerate(headings):
-            if i > 0 and i % 3 == 0:  # Every 3rd heading
-                # Add a subtle break opportunity
-                break_div = soup.new_tag('div', **{
-                    'class': 'page-break-opportunity',
-                    'style': 'page-break-before: auto; height: 1px;'
-                })
-                heading.insert_before(break_div)
-        
-        # 🔥 REMOVE EXCESSIVE WHITE SPACE
-        
-        # Remove multiple consecutive <br> tags
-        for br in soup.find_all('br'):
-            next_sibling = br.next_sibling
-            if next_sibling and next_sibling.name == 'br':
-                br.decompose()
-        
-        # Clean up empty paragraphs
-        for p in soup.find_all('p'):
-            if not p.get_text().strip() and not p.find('img'):
-                p.decompose()
-        
-        return str(soup)
-    
-    except Exception as e:
-        print(f"Content preprocessing error: {e}")
-        return content  # Return original content if preprocessing fails
+        job_id = pdf_job_queue.submit(**pdf_job_params())
+    except pdf_jobs.QueueFull as e:
+        return jsonify({'success': False, 'error': str(e)}), 429, {'Retry-After': str(e.retry_after)}
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    status_url = url_for('main.pdf_job_status', job_id=job_id)
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status': pdf_jobs.QUEUED,
+        'status_url': status_url,
+        'download_url': url_for('main.download_pdf_job', job_id=job_id),
+    }), 202, {'Location': status_url}
+
+
+@main.route('/pdf-jobs/<job_id>', methods=['GET'])
+def pdf_job_status(job_id):
+    job = pdf_job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired PDF job.'}), 404
+    if job['status'] == pdf_jobs.DONE:
+        job['download_url'] = url_for('main.download_pdf_job', job_id=job_id)
+    return jsonify(job)
+
+
+@main.route('/pdf-jobs/<job_id>/download', methods=['GET'])
+def download_pdf_job(job_id):
+    job = pdf_job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired PDF job.'}), 404
+    if job['status'] != pdf_jobs.DONE:
+        return jsonify({'error': 'PDF is not ready.', 'status': job['status']}), 409
+    return send_pdf_job(job)
+
+
+def wants_base64_pdf():
+    """Old clients get the PDF base64-encoded in JSON; everyone else gets
+    the file itself. Pass format=base64 (query or body) to force JSON."""
+    data = request.get_json(silent=True) or {}
+    fmt = request.args.get('format') or data.get('format')
+    if fmt:
+        return fmt in ('base64', 'json')
+    # Legacy callers only ever sent Accept: application/json
+    best = request.accept_mimetypes.best_match(['application/pdf', 'application/json'])
+    return best == 'application/json'
+
+
+def send_pdf_job(job):
+    """Stream a finished job's PDF from disk, without loading it into memory"""
+    return send_file(
+        pdf_job_queue.result_path(job['job_id']),
+        mimetype='application/pdf',
+        as_attachment=True,
+        download_name=job['filename'],
+    )
 
 
-# 🔥 ENHANCED PDF GENERATION WITH BETTER WEASYPRINT SETTINGS
-@app.route('/generate-pdf', methods=['POST'])
+# 🔥 ENHANCED PDF GENERATION - synchronous wrapper around the job queue
+@main.route('/generate-pdf', methods=['POST'])
 def generate_pdf():
     try:
-        data = request.get_json()
-        content = data.get('content', '')
-        template = data.get('template', 'tech-neural')
-        styles = data.get('styles', '')
-        
-        # Create the complete HTML document with smart page breaks
-        full_html = create_enhanced_pdf_html(content, template, styles)
-        
-        # 🔥 ENHANCED WEASYPRINT CONFIGURATION
-        font_config = FontConfiguration()
-        
-        # Create temporary file for PDF
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-            HTML(
-                string=full_html, 
-                base_url=request.url_root,
-                encoding='utf-8'
-            ).write_pdf(
-                tmp_file.name,
-                font_config=font_config,
-                optimize_images=False,
-                presentational_hints=True,
-                # 🔥 ENHANCED SETTINGS FOR BETTER PAGE BREAKING
-                stylesheets=[],
-                attachments=[],
-                # Additional WeasyPrint options for better rendering
-                uncompressed_pdf=False,  # Keep file size reasonable
-                pdf_version='1.7',       # Modern PDF version
-            )
-            tmp_file_path = tmp_file.name
-        
-        # Read PDF content
-        with open(tmp_file_path, 'rb') as pdf_file:
-            pdf_content = pdf_file.read()
-        
-        # Clean up temporary file
-        os.unlink(tmp_file_path)
-        
-        # Return PDF as base64 encoded string
-        pdf_base64 = base64.b64encode(pdf_content).decode('utf-8')
+        job_id = pdf_job_queue.submit(**pdf_job_params())
+        job = pdf_job_queue.wait(job_id, pdf_jobs.PDF_SYNC_WAIT)
+        if job is None:
+            # Removed from the queue before it finished (e.g. PDF_JOBS_DIR was wiped)
+            return jsonify({'success': False, 'error': 'PDF job was lost, please retry.'}), 500
+        if job['status'] != pdf_jobs.DONE:
+            raise RuntimeError(job['error'] or 'PDF generation timed out')
+
+        if not wants_base64_pdf():
+            return send_pdf_job(job)
+        
+        # Legacy mode: return PDF as base64 encoded string
+        with open(pdf_job_queue.result_path(job_id), 'rb') as pdf_file, \
+                telemetry.pdf_phase("encode"):
+            pdf_base64 = base64.b64encode(pdf_file.read()).decode('ascii')
         
         return jsonify({
             'success': True,
             'pdf_data': pdf_base64,
-            'filename': f'carousel-{template}-{int(time.time())}.pdf'
+            'filename': job['filename']
         })
         
+    except pdf_jobs.QueueFull as e:
+        return jsonify({'success': False, 'error': str(e)}), 429, {'Retry-After': str(e.retry_after)}
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         print(f"PDF generation error: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route("/debug")
+@main.route("/debug")
 def debug():
     return jsonify({
         "host": request.host,
@@ -894,7 +696,24 @@ def debug():
         "current_user": current_user.is_authenticated if current_user else False
     })
 
-@app.route('/debug-fonts')
+@main.route('/debug-generations')
+def debug_generations():
+    """Cancellation counters for /generate-stream"""
+    return jsonify(generation_registry.cancellation_report())
+
+@main.route('/debug-pdf-cache')
+def debug_pdf_cache():
+    """Hit/miss/eviction counters for the PDF render cache"""
+    if pdf_job_queue.cache is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(pdf_job_queue.cache.report(), enabled=True))
+
+@main.route('/debug-user-cache')
+def debug_user_cache():
+    """Hit/miss counters for this worker's user cache"""
+    return jsonify(user_by_id.report())
+
+@main.route('/debug-fonts')
 def debug_fonts():
     """Debug route to check variable font availability"""
     fonts_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), 'static', 'fonts'))
@@ -945,6 +764,63 @@ def debug_fonts():
     })
 ##################################################
 
+def create_app(config=None):
+    """Build the app from the environment; config overrides app.config."""
+    # to alert at startup whether a var is missing. 
+    for var in ('GOOGLE_CLIENT_ID','GOOGLE_CLIENT_SECRET','REDIRECT_URI','SECRET_KEY'):
+        if not os.environ.get(var):
+            raise RuntimeError(f"Missing required env var: {var}")
+
+    app = Flask(__name__, template_folder="templates", static_folder="static")
+    CORS(app)
+    app.secret_key = os.environ['SECRET_KEY']
+    app.config['SESSION_COOKIE_DOMAIN'] = '.geniuspostai.com'  # Allow cookies across subdomains
+    app.config['SESSION_COOKIE_SECURE'] = True  # HTTPS only
+    app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
+    # ─── Database Configuration ────────────────────────────
+    # Render will inject DATABASE_URL into your environment
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get("DATABASE_URL")
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config.update(config or {})
+    app.session_interface = AssetSkippingSessionInterface()
+
+    db.init_app(app)
+    login_manager.init_app(app)
+    app.register_blueprint(main)
+    app.register_blueprint(admin_api)
+    app.cli.command("init-db")(init_db)
+    if DB_INIT_ON_START:
+        with app.app_context():
+            init_db()
+
+    user_metrics.init_app(app)
+    pdf_job_queue.start()
+
+    telemetry.init_app(app)
+    if llm_cache is not None:
+        telemetry.export_stats("response_cache", lambda: llm_cache.stats)
+    if pdf_job_queue.cache is not None:
+        telemetry.export_stats("pdf_cache", lambda: pdf_job_queue.cache.stats)
+    telemetry.export_stats("generations", lambda: generation_registry.stats)
+    telemetry.export_stats("user_metrics", lambda: user_metrics.stats)
+    telemetry.export_stats("user_cache", lambda: user_by_id.stats)
+    telemetry.export_stats("google_signing_keys", lambda: google_auth.signing_keys.stats)
+    telemetry.export_stats("variant_limiter", lambda: variant_limiter.stats)
+    telemetry.export_stats("llm_providers", lambda: providers.stats)
+    for name, breaker in providers.breakers.items():
+        telemetry.export_stats(f"llm_breaker_{name}", lambda breaker=breaker: breaker.stats)
+    return app
+
+
+def __getattr__(name):
+    # `app.app` is built on first use, so importing this module stays cheap
+    if name == "app":
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 if __name__ == '__main__':
-    app.run(host="127.0.0.1", debug=True, port=8000)
+    create_app().run(host="127.0.0.1", debug=True, port=8000)
 
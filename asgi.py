@@ -0,0 +1,285 @@
+"""ASGI entry point: asyncio streaming for /generate-stream, Flask for everything else.
+
+With sync gunicorn workers every open /generate-stream pins a whole worker
+for the 10-30 s a generation takes. Here the streaming route runs on the
+event loop with the async provider clients (providers.py), so one process multiplexes
+hundreds of streams, while all other routes are served by the unchanged
+Flask app through a WSGI adapter (on a thread pool). Resuming with
+Last-Event-ID (generations.py) is only offered by the threaded route: the
+event ids here are bare offsets, which the editor neither resumes nor
+DELETEs. Clearing the editor aborts the request instead, and the
+disconnect stops the upstream call; such cancellations are counted in
+``generation_registry`` (/debug-generations) like the threaded ones.
+
+Run with:
+    gunicorn asgi:application -k uvicorn.workers.UvicornWorker
+"""
+import asyncio
+import json
+import sys
+import tempfile
+import threading
+import time
+
+from asgiref.sync import async_to_sync, sync_to_async
+
+import markdown_stream
+import prompts
+import providers
+import response_cache
+import sse
+import telemetry
+from app import app as flask_app, generation_registry, llm_cache
+
+
+def _environ(scope, body):
+    """The PEP 3333 environ for an ASGI HTTP scope."""
+    script_name = scope.get("root_path", "").encode("utf8").decode("latin1")
+    path_info = scope["path"].encode("utf8").decode("latin1")
+    if path_info.startswith(script_name):
+        path_info = path_info[len(script_name):]
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": script_name,
+        "PATH_INFO": path_info,
+        "QUERY_STRING": scope.get("query_string", b"").decode("ascii"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1] or 0),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"], environ["REMOTE_PORT"] = scope["client"][0], str(scope["client"][1])
+    for name, value in scope.get("headers", []):
+        name, value = name.decode("latin1").upper(), value.decode("latin1")
+        key = {"CONTENT-LENGTH": "CONTENT_LENGTH", "CONTENT-TYPE": "CONTENT_TYPE"}.get(
+            name, "HTTP_" + name.replace("-", "_"))
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+class WsgiAdapter:
+    """Serves the Flask app over ASGI, each request on the default thread
+    pool (``sync_to_async(thread_sensitive=False)``; asgiref's own WsgiToAsgi
+    runs them all on one thread, queueing every request behind the previous
+    one). The response is always closed, which runs the call_on_close
+    callbacks (telemetry's request timing and in-flight count) and closes
+    streamed generators, straight away when the client disconnects."""
+
+    def __init__(self, wsgi_application):
+        self.wsgi_application = wsgi_application
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            raise ValueError("WSGI adapter received a non-HTTP scope")
+        body = tempfile.SpooledTemporaryFile(max_size=65536)
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body.write(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        body.seek(0)
+        disconnected = threading.Event()
+
+        async def watch():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            disconnected.set()
+
+        watcher = asyncio.ensure_future(watch())
+        try:
+            await sync_to_async(self._run, thread_sensitive=False)(
+                _environ(scope, body), async_to_sync(send), disconnected)
+        finally:
+            watcher.cancel()
+            body.close()
+
+    def _run(self, environ, send, disconnected):
+        start = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and start.get("sent"):
+                raise exc_info[1].with_traceback(exc_info[2])
+            start["message"] = {
+                "type": "http.response.start",
+                "status": int(status.split(" ", 1)[0]),
+                "headers": [(name.lower().encode("ascii"), value.encode("latin1"))
+                            for name, value in headers],
+            }
+
+        def send_start():
+            if not start.get("sent"):
+                start["sent"] = True
+                send(start["message"])
+
+        response = self.wsgi_application(environ, start_response)
+        try:
+            for chunk in response:
+                if disconnected.is_set():
+                    return
+                send_start()
+                if chunk:
+                    send({"type": "http.response.body", "body": chunk, "more_body": True})
+            send_start()
+            send({"type": "http.response.body", "body": b""})
+        finally:
+            close = getattr(response, "close", None)
+            if close is not None:
+                close()
+
+
+wsgi_app = WsgiAdapter(flask_app)
+
+STREAM_HEADERS = [(b"content-type", sse.MIMETYPE.encode())] + [
+    (name.lower().encode(), value.encode()) for name, value in sse.HEADERS.items()
+]
+
+
+async def claude_text_stream_async(prompt):
+    """Async twin of ``app.claude_text_stream`` (cache hits are replayed, misses
+    are stored; single-flight sharing stays on the threaded path)."""
+    key = None
+    if llm_cache is not None:
+        key = response_cache.make_key(prompt, **prompts.cache_params())
+        cached = await asyncio.to_thread(llm_cache.get, key)
+        if cached is not None:
+            for piece in telemetry.llm_stream(response_cache.replay(cached), "cache"):
+                yield piece
+            return
+
+    parts = []
+    stream = providers.astream(prompt)
+    async for text in telemetry.llm_stream_async(stream, "upstream", stream.output_tokens):
+        parts.append(text)
+        yield text
+    if key is not None and providers.from_primary(stream):
+        await asyncio.to_thread(llm_cache.set, key, "".join(parts))
+
+
+async def _read_json(receive):
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    try:
+        return json.loads(body or b"{}") or {}
+    except ValueError:
+        return {}
+
+
+async def sse_frames(deltas, renderer=None):
+    """Async driver for ``sse.StreamWriter`` (same coalescing and heartbeats)."""
+    writer = sse.StreamWriter(renderer=renderer)
+    pending = asyncio.Queue()
+
+    async def produce():
+        try:
+            async for text in deltas:
+                await pending.put(text)
+            await pending.put(None)
+        except Exception as e:
+            await pending.put(e)
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(pending.get(), writer.timeout())
+            except asyncio.TimeoutError:
+                frame = writer.tick()
+            else:
+                if item is None:
+                    yield writer.done()
+                    return
+                if isinstance(item, Exception):
+                    yield writer.error(item)
+                    return
+                frame = writer.add(item)
+            if frame:
+                yield frame
+    finally:
+        producer.cancel()
+
+
+async def generate_stream(scope, receive, send):
+    # Counted like the Flask routes (telemetry.init_app)
+    started = time.perf_counter()
+    telemetry.HTTP_IN_FLIGHT.labels("/generate-stream").inc()
+    try:
+        await _generate_stream(scope, receive, send)
+    finally:
+        telemetry.HTTP_IN_FLIGHT.labels("/generate-stream").dec()
+        telemetry.HTTP_LATENCY.labels("/generate-stream", "POST").observe(
+            time.perf_counter() - started)
+
+
+async def _generate_stream(scope, receive, send):
+    started_at = time.perf_counter()
+    data = await _read_json(receive)
+    if data is None:
+        return
+    prompt = (data.get("prompt") or "").strip()
+    if not prompt:
+        body = json.dumps({"error": "Prompt is required."}).encode()
+        await send({"type": "http.response.start", "status": 400,
+                    "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": body})
+        telemetry.HTTP_REQUESTS.labels("/generate-stream", "POST", 400).inc()
+        return
+
+    await send({"type": "http.response.start", "status": 200, "headers": STREAM_HEADERS})
+    telemetry.HTTP_REQUESTS.labels("/generate-stream", "POST", 200).inc()
+
+    renderer = markdown_stream.IncrementalMarkdown() if data.get("render") == "html" else None
+    streamed = {"chars": 0}
+
+    async def counted(deltas):
+        async for text in deltas:
+            streamed["chars"] += len(text)
+            yield text
+
+    async def pump():
+        async for frame in sse_frames(counted(claude_text_stream_async(prompt)), renderer):
+            await send({"type": "http.response.body",
+                        "body": frame.encode("utf-8"),
+                        "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def wait_for_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    # Stop reading from Claude as soon as the client goes away
+    streaming = asyncio.ensure_future(pump())
+    watcher = asyncio.ensure_future(wait_for_disconnect())
+    await asyncio.wait({streaming, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    cancelled = not streaming.done()
+    for task in (streaming, watcher):
+        task.cancel()
+    await asyncio.gather(streaming, watcher, return_exceptions=True)
+    generation_registry.record(time.perf_counter() - started_at, streamed["chars"],
+                               "cancelled" if cancelled else "completed")
+
+
+async def application(scope, receive, send):
+    if (
+        scope["type"] == "http"
+        and scope["path"] == "/generate-stream"
+        and scope["method"] == "POST"
+    ):
+        await generate_stream(scope, receive, send)
+    else:
+        await wsgi_app(scope, receive, send)
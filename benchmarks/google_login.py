@@ -0,0 +1,93 @@
+"""Google sign-in callback: old two-call flow vs google_auth.
+
+Runs tools/fake_google_oauth.py in-process with --latency-ms on every
+response (standing in for the round trip to Google) and times what
+``/authorize`` spends talking to the provider per login:
+
+* "legacy": bare requests.post to the token endpoint and requests.get to
+  userinfo, as the callback used to do;
+* "google_auth": one token exchange on the pooled session plus local
+  id_token verification against the cached JWKS.
+
+    python benchmarks/google_login.py --logins 200 --latency-ms 40
+
+Plain HTTP on localhost has no TLS handshake, which the pooled session also
+saves against the real Google, so this understates the difference.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+import requests
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+
+import fake_google_oauth  # noqa: E402
+
+CLIENT_ID = "benchmark-client"
+REDIRECT_URI = "http://127.0.0.1/authorize"
+
+
+def legacy_login(issuer, code):
+    token_json = requests.post(f"{issuer}/token", data={
+        "code": code, "client_id": CLIENT_ID, "client_secret": "secret",
+        "redirect_uri": REDIRECT_URI, "grant_type": "authorization_code",
+    }).json()
+    headers = {"Authorization": f"Bearer {token_json['access_token']}"}
+    return requests.get(f"{issuer}/userinfo", headers=headers).json()
+
+
+def new_login(google_auth, code):
+    tokens = google_auth.exchange_code(code, CLIENT_ID, "secret", REDIRECT_URI)
+    return google_auth.verify_id_token(tokens["id_token"], CLIENT_ID)
+
+
+def measure(fake, login, logins):
+    before = dict(fake.stats)
+    timings = []
+    for i in range(logins):
+        location = fake.authorize({"client_id": [CLIENT_ID], "redirect_uri": [REDIRECT_URI],
+                                   "login_hint": [f"user{i}@example.com"]})
+        code = location.split("code=")[1].split("&")[0]
+        started = time.perf_counter()
+        claims = login(code)
+        timings.append((time.perf_counter() - started) * 1000)
+        assert claims["email"] == f"user{i}@example.com", claims
+    timings.sort()
+    calls = {name: fake.stats[name] - before[name] for name in ("token", "userinfo", "certs")}
+    return {
+        "logins": logins,
+        "p50_ms": round(statistics.median(timings), 2),
+        "p95_ms": round(timings[int(0.95 * (len(timings) - 1))], 2),
+        "upstream_calls_per_login": round(sum(calls.values()) / logins, 3),
+        "calls": calls,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=40)
+    args = parser.parse_args()
+
+    server, fake = fake_google_oauth.serve(latency=args.latency_ms / 1000)
+    os.environ.update(GOOGLE_TOKEN_URL=f"{fake.issuer}/token",
+                      GOOGLE_CERTS_URL=f"{fake.issuer}/certs",
+                      GOOGLE_ISSUERS=fake.issuer)
+    import google_auth
+
+    results = {
+        "legacy": measure(fake, lambda code: legacy_login(fake.issuer, code), args.logins),
+        "google_auth": measure(fake, lambda code: new_login(google_auth, code), args.logins),
+    }
+    server.shutdown()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
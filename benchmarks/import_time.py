@@ -0,0 +1,107 @@
+"""Cold start of the web app: ``import app`` and getting the WSGI app ready.
+
+Every measurement runs in a fresh interpreter (that is what a gunicorn
+worker boot or a test process pays) and the median of --runs is reported,
+along with the slowest imports made by app.py (``python -X importtime``) and
+which heavy libraries ended up loaded. With --ref the same is measured for
+another git revision, checked out into a temporary worktree, for a
+before/after comparison:
+
+    python benchmarks/import_time.py --runs 7 --ref HEAD~1
+
+Required settings get throwaway values (a SQLite database in a temp dir)
+unless they are already set in the environment.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+HEAVY = ("weasyprint", "cairocffi", "bs4", "pypdf", "anthropic", "openai", "markdown",
+         "httpx")
+
+PROBE = f"""
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.app
+ready = time.perf_counter()
+print(json.dumps({{
+    "import_ms": (imported - started) * 1000,
+    "ready_ms": (ready - started) * 1000,
+    "heavy": [m for m in {HEAVY!r} if m in sys.modules],
+}}))
+"""
+
+
+def probe_env(workdir):
+    os.makedirs(workdir, exist_ok=True)
+    env = dict(os.environ)
+    defaults = {
+        "SECRET_KEY": "import-time", "CLAUDE_APIKEY": "import-time",
+        "GOOGLE_CLIENT_ID": "import-time", "GOOGLE_CLIENT_SECRET": "import-time",
+        "REDIRECT_URI": "http://localhost/authorize",
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'app.db')}",
+        "PDF_JOBS_DIR": os.path.join(workdir, "pdf-jobs"),
+        "PDF_CACHE_DIR": os.path.join(workdir, "pdf-cache"),
+    }
+    for name, value in defaults.items():
+        env.setdefault(name, value)
+    return env
+
+
+def measure(tree, runs, env):
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", PROBE], cwd=tree, env=env,
+                             capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(out.strip().splitlines()[-1]))
+    trace = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app; app.app"],
+                           cwd=tree, env=env, capture_output=True, text=True, check=True).stderr
+    # Modules imported directly by app.py (and by site, which is negligible)
+    direct = []
+    for line in trace.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        name = name[1:]
+        if cumulative.strip().isdigit() and name.startswith("  ") and name[2] != " ":
+            direct.append((int(cumulative) / 1000, name.strip()))
+    direct.sort(reverse=True)
+    return {
+        "import_ms": round(statistics.median(s["import_ms"] for s in samples), 1),
+        "ready_ms": round(statistics.median(s["ready_ms"] for s in samples), 1),
+        "heavy_modules_loaded": samples[-1]["heavy"],
+        "slowest_imports_ms": {name: round(ms, 1) for ms, name in direct[:10]},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--ref", help="also measure this git revision (e.g. HEAD~1)")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        results["working_tree"] = measure(ROOT, args.runs, probe_env(os.path.join(workdir, "a")))
+        if args.ref:
+            tree = os.path.join(workdir, "ref")
+            subprocess.run(["git", "worktree", "add", "--detach", tree, args.ref],
+                           cwd=ROOT, check=True, capture_output=True)
+            try:
+                results[args.ref] = measure(tree, args.runs, probe_env(os.path.join(workdir, "b")))
+            finally:
+                subprocess.run(["git", "worktree", "remove", "--force", tree],
+                               cwd=ROOT, check=True, capture_output=True)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+"""Load test /generate-stream or /generate under gunicorn, offline.
+
+Starts tools/fake_anthropic.py, boots the app under gunicorn with
+LLM_BASE_URL pointing at it, and for each --concurrency level keeps that
+many clients busy for --duration seconds (each sends its next request as
+soon as the last one is done). Every run reports:
+
+* time to first byte (the first SSE data frame; the whole response for
+  /generate) and total time, as percentiles;
+* throughput: completed requests/s and streamed characters/s;
+* errors by kind (HTTP status, error frames, client timeouts);
+* worker saturation: requests in progress inside the app, sampled every
+  --sample-ms from the workers' Prometheus files (telemetry.py), against
+  what the workers can serve at once (workers x threads; unbounded for
+  uvicorn). A high saturated share together with a growing TTFB means
+  requests are queueing for a worker;
+* what the fake upstream saw (streams, peak concurrent streams, errors).
+
+Each --workers value boots a fresh gunicorn, so a sweep shows where adding
+workers stops helping:
+
+    python benchmarks/load_test.py --workers 2 4 8 --concurrency 8 32 128 --duration 30
+    python benchmarks/load_test.py --worker-class gthread --threads 8 --workers 2
+    python benchmarks/load_test.py --worker-class uvicorn --route /generate
+    python benchmarks/load_test.py --url http://127.0.0.1:8000   # a server you started
+
+--secondary starts a second fake as the OpenAI provider (providers.py), so
+the effect of hedging on tail latency can be measured, e.g. with a primary
+that sometimes never answers:
+
+    python benchmarks/load_test.py --errors hang=0.02 --timeout 30              # p99 TTFB = timeout
+    python benchmarks/load_test.py --errors hang=0.02 --timeout 30 --secondary --hedge-after-ms 1500
+
+With --url the in-progress count comes from GET /metrics instead, which a
+saturated sync worker pool may answer late. The fake's pace and failures
+are set with --latency-ms, --tokens, --tokens-per-second, --jitter and
+--errors (see tools/fake_anthropic.py); for --url start the fake yourself.
+Results are printed as one JSON object per run.
+
+App settings (SECRET_KEY, DATABASE_URL, GOOGLE_*) are taken from the
+environment; throwaway local defaults are filled in when missing.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+
+import fake_anthropic  # noqa: E402
+
+WORKER_CLASSES = {
+    "sync": ("app:app", "sync"),
+    "gthread": ("app:app", "gthread"),
+    "uvicorn": ("asgi:application", "uvicorn.workers.UvicornWorker"),
+}
+PROMPT = "Five lessons from scaling a newsletter to 100k readers"
+IN_FLIGHT = "geniuspost_http_requests_in_flight"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentiles(values):
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def rank(p):
+        return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+    return {"p50": round(rank(50), 1), "p90": round(rank(90), 1),
+            "p99": round(rank(99), 1), "max": round(ordered[-1], 1)}
+
+
+########################## Saturation sampling ##########################
+
+class InFlightSampler:
+    """Samples the app's in-progress request count in a background thread,
+    from the multiprocess directory or from a /metrics URL."""
+
+    def __init__(self, route, interval, multiproc_dir=None, metrics_url=None):
+        self.route = route
+        self.interval = interval
+        self.multiproc_dir = multiproc_dir
+        self.metrics_url = metrics_url
+        self.samples = []
+        self.failures = 0
+        self._stop = threading.Event()
+
+    def _read(self):
+        if self.multiproc_dir:
+            from prometheus_client import CollectorRegistry, multiprocess
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry, path=self.multiproc_dir)
+            families = registry.collect()
+        else:
+            from prometheus_client.parser import text_string_to_metric_families
+            text = httpx.get(self.metrics_url, timeout=self.interval * 10).text
+            families = text_string_to_metric_families(text)
+        for family in families:
+            if family.name == IN_FLIGHT:
+                return sum(sample.value for sample in family.samples
+                           if sample.labels.get("route") == self.route)
+        return 0
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.samples.append(self._read())
+            except Exception:
+                self.failures += 1
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def report(self, capacity):
+        samples = self.samples
+        report = {
+            "capacity": capacity,
+            "samples": len(samples),
+            "failed_samples": self.failures,
+            "in_flight_mean": round(statistics.mean(samples), 1) if samples else None,
+            "in_flight_max": max(samples) if samples else None,
+        }
+        if capacity and samples:
+            report["saturated_share"] = round(
+                sum(1 for value in samples if value >= capacity) / len(samples), 3)
+        return report
+
+
+########################## Clients ##########################
+
+async def one_request(client, url, route):
+    started = time.perf_counter()
+    ttfb, chars, error = None, 0, None
+    try:
+        if route == "/generate-stream":
+            async with client.stream("POST", url, json={"prompt": PROMPT}) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    error = f"http_{response.status_code}"
+                else:
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data: "):
+                            continue
+                        payload = json.loads(line[6:])
+                        if ttfb is None:
+                            ttfb = time.perf_counter() - started
+                        if "error" in payload:
+                            error = "error_frame"
+                        chars += len(payload.get("chunk", ""))
+        else:
+            response = await client.post(url, json={"prompt": PROMPT})
+            ttfb = time.perf_counter() - started
+            if response.status_code != 200:
+                error = f"http_{response.status_code}"
+            else:
+                chars = len(response.json().get("result", ""))
+    except httpx.TimeoutException:
+        error = "timeout"
+    except httpx.HTTPError as e:
+        error = type(e).__name__
+    return {"ttfb": ttfb, "total": time.perf_counter() - started, "chars": chars, "error": error}
+
+
+async def drive(base_url, route, concurrency, duration, timeout):
+    url = base_url + route
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    results = []
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        started = time.perf_counter()
+        deadline = started + duration
+
+        async def client_loop():
+            while time.perf_counter() < deadline:
+                results.append(await one_request(client, url, route))
+
+        await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+        wall = time.perf_counter() - started
+    return results, wall
+
+
+def summarize(results, wall):
+    ok = [r for r in results if r["error"] is None]
+    errors = {}
+    for r in results:
+        if r["error"]:
+            errors[r["error"]] = errors.get(r["error"], 0) + 1
+    return {
+        "requests": len(results),
+        "completed": len(ok),
+        "errors": errors,
+        "wall_s": round(wall, 2),
+        "throughput_rps": round(len(ok) / wall, 2),
+        "chars_per_s": round(sum(r["chars"] for r in ok) / wall),
+        "ttfb_ms": percentiles([r["ttfb"] * 1000 for r in ok if r["ttfb"] is not None]),
+        "total_ms": percentiles([r["total"] * 1000 for r in ok]),
+    }
+
+
+########################## Runs ##########################
+
+def app_env(fake, multiproc_dir, workdir, secondary=None, hedge_after=None):
+    env = dict(os.environ)
+    env["LLM_BASE_URL"] = fake.url
+    if secondary is not None:
+        env["GPT_APIKEY"] = "fake-key"
+        env["LLM_OPENAI_BASE_URL"] = secondary.url + "/v1"
+        if hedge_after is not None:
+            env["LLM_HEDGE_AFTER"] = str(hedge_after)
+    env["PROMETHEUS_MULTIPROC_DIR"] = multiproc_dir
+    env.setdefault("CLAUDE_APIKEY", "fake-key")
+    env.setdefault("SECRET_KEY", "load-test")
+    env.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'app.sqlite3')}")
+    env.setdefault("PDF_JOBS_DIR", os.path.join(workdir, "pdf-jobs"))
+    for var in ("GOOGLE_CLIENT_ID", "GOOGLE_CLIENT_SECRET", "REDIRECT_URI"):
+        env.setdefault(var, "load-test")
+    return env
+
+
+def boot(args, workers, env):
+    target, worker_class = WORKER_CLASSES[args.worker_class]
+    port = free_port()
+    cmd = [sys.executable, "-m", "gunicorn", target, "-b", f"127.0.0.1:{port}",
+           "-w", str(workers), "-k", worker_class, "--threads", str(args.threads),
+           "--timeout", "120", "--backlog", "4096", "--log-level", "warning"]
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env)
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(150):
+        try:
+            httpx.get(f"{base_url}/pricing", timeout=1)
+            return proc, base_url
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("gunicorn did not come up")
+
+
+def run_level(args, base_url, concurrency, sampler, fake=None):
+    before = json.loads(json.dumps(fake.stats)) if fake else None
+    with sampler:
+        results, wall = asyncio.run(
+            drive(base_url, args.route, concurrency, args.duration, args.timeout))
+    report = {"route": args.route, "concurrency": concurrency, **summarize(results, wall)}
+    if fake:
+        after = fake.stats
+        report["upstream"] = {
+            "requests": after["requests"] - before["requests"],
+            "peak_open_streams": after["peak_open_streams"],
+            "errors": {kind: count - before["errors"].get(kind, 0)
+                       for kind, count in after["errors"].items()
+                       if count > before["errors"].get(kind, 0)},
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--route", default="/generate-stream",
+                        choices=["/generate-stream", "/generate"])
+    parser.add_argument("--worker-class", default="sync", choices=sorted(WORKER_CLASSES))
+    parser.add_argument("--workers", type=int, nargs="+", default=[2])
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[4, 16, 64])
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--timeout", type=float, default=120, help="client timeout, seconds")
+    parser.add_argument("--sample-ms", type=float, default=100)
+    parser.add_argument("--url", help="load an already running server instead")
+    parser.add_argument("--tokens", type=int, default=300)
+    parser.add_argument("--tokens-per-second", type=float, default=60)
+    parser.add_argument("--latency-ms", type=float, default=500)
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--errors", default="", help="e.g. 429=0.02,529=0.01,midstream=0.01")
+    parser.add_argument("--secondary", action="store_true",
+                        help="also start a fake secondary provider (same pace, no errors)")
+    parser.add_argument("--secondary-latency-ms", type=float, default=500)
+    parser.add_argument("--hedge-after-ms", type=float, help="LLM_HEDGE_AFTER for the app")
+    args = parser.parse_args()
+
+    if args.url:
+        for concurrency in args.concurrency:
+            sampler = InFlightSampler(args.route, args.sample_ms / 1000,
+                                      metrics_url=args.url.rstrip("/") + "/metrics")
+            report = run_level(args, args.url.rstrip("/"), concurrency, sampler)
+            report["saturation"] = sampler.report(None)
+            print(json.dumps(report), flush=True)
+        return
+
+    server, fake = fake_anthropic.serve(
+        tokens=args.tokens, tokens_per_second=args.tokens_per_second,
+        latency=args.latency_ms / 1000, jitter=args.jitter,
+        errors=fake_anthropic.parse_errors(args.errors))
+    secondary = None
+    if args.secondary:
+        _, secondary = fake_anthropic.serve(
+            tokens=args.tokens, tokens_per_second=args.tokens_per_second,
+            latency=args.secondary_latency_ms / 1000, jitter=args.jitter)
+    hedge_after = args.hedge_after_ms / 1000 if args.hedge_after_ms is not None else None
+    for workers in args.workers:
+        with tempfile.TemporaryDirectory() as workdir:
+            multiproc_dir = os.path.join(workdir, "metrics")
+            os.makedirs(multiproc_dir)
+            env = app_env(fake, multiproc_dir, workdir, secondary, hedge_after)
+            proc, base_url = boot(args, workers, env)
+            capacity = None if args.worker_class == "uvicorn" else workers * args.threads
+            try:
+                for concurrency in args.concurrency:
+                    fake.stats["peak_open_streams"] = fake.stats["open_streams"]
+                    sampler = InFlightSampler(args.route, args.sample_ms / 1000,
+                                              multiproc_dir=multiproc_dir)
+                    before = secondary.stats["requests"] if secondary else 0
+                    report = run_level(args, base_url, concurrency, sampler, fake)
+                    if secondary:
+                        report["secondary_requests"] = secondary.stats["requests"] - before
+                    report = {"worker_class": args.worker_class, "workers": workers,
+                              "threads": args.threads, **report,
+                              "saturation": sampler.report(capacity)}
+                    print(json.dumps(report), flush=True)
+            finally:
+                proc.terminate()
+                proc.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""Incremental Markdown rendering: equivalence check and cost per stream.
+
+Streams Markdown through ``markdown_stream.IncrementalMarkdown`` the way
+/generate-stream does with ``render: "html"`` and compares it with
+re-rendering the whole text on every frame:
+
+* the finished blocks joined together must equal rendering the whole text
+  at once, for carousel-style answers (headings, paragraphs, tight and
+  loose lists, fenced code with blank lines, tables, quotes) and for random
+  documents fed in random-sized pieces; ``resets`` counts the streams where
+  the final frame had to fall back to the full HTML;
+* then both are timed on ~2 KB, ~10 KB and ~50 KB answers, fed in frames
+  of --frame-bytes (sse.py's SSE_FLUSH_BYTES), reporting total render time,
+  the slowest frame and how many characters went through the renderer.
+
+    python benchmarks/markdown_stream.py --fuzz 500 --frame-bytes 256 64
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+import markdown_stream  # noqa: E402
+
+
+SIZES = {"2KB": 2 * 1024, "10KB": 10 * 1024, "50KB": 50 * 1024}
+WORDS = ("the carousel story brand audience growth insight hook post slide team "
+         "launch metric value customer strategy result design content reach").split()
+
+
+def sentence(rng, words=12):
+    text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, words)))
+    return rng.choice(["", "**", "*", "`"]).join(["", text, ""]) if rng.random() < 0.2 else text
+
+
+def random_block(rng):
+    roll = rng.random()
+    if roll < 0.12:
+        return "#" * rng.randint(1, 3) + " " + sentence(rng, 6)
+    if roll < 0.4:
+        return "\n".join(sentence(rng) for _ in range(rng.randint(1, 3)))
+    if roll < 0.6:
+        marker = rng.choice(["- ", "* ", "1. "])
+        sep = "\n\n" if rng.random() < 0.3 else "\n"
+        items = [marker + sentence(rng) for _ in range(rng.randint(1, 5))]
+        if rng.random() < 0.3:
+            items.insert(1, "    " + marker + sentence(rng))
+        return sep.join(items)
+    if roll < 0.72:
+        fence = rng.choice(["```", "~~~", "````"])
+        code = "\n".join(rng.choice(["x = %d" % i, "", "    return x", "# note"])
+                         for i in range(rng.randint(1, 8)))
+        return f"{fence}{rng.choice(['', 'python'])}\n{code}\n{fence}"
+    if roll < 0.8:
+        rows = ["| a | b |", "|---|---|"] + [
+            f"| {rng.choice(WORDS)} | {rng.randint(0, 99)} |" for _ in range(rng.randint(1, 4))]
+        return "\n".join(rows)
+    if roll < 0.88:
+        return "\n".join("> " + sentence(rng) for _ in range(rng.randint(1, 3)))
+    if roll < 0.92:
+        return "    indented code\n    more code"
+    return rng.choice(["---", "Closing line.", "Setext heading\n---", sentence(rng)])
+
+
+def random_document(rng, size):
+    blocks, total = [], 0
+    while total < size:
+        block = random_block(rng)
+        blocks.append(block)
+        total += len(block) + 2
+    separators = ["\n\n", "\n\n", "\n\n", "\n", "\n\n\n"]
+    return "".join(block + rng.choice(separators) for block in blocks).rstrip("\n") + \
+        rng.choice(["", "\n"])
+
+
+def carousel_answer(rng, size):
+    """What the prompt asks Claude for: slides with a heading, copy and bullets"""
+    parts, slide = [], 0
+    while sum(map(len, parts)) < size:
+        slide += 1
+        parts.append(f"## Slide {slide}: {sentence(rng, 5)}\n\n{sentence(rng, 30)}\n\n")
+        parts.append("\n".join("- " + sentence(rng) for _ in range(rng.randint(2, 5))) + "\n\n")
+        if slide % 4 == 0:
+            parts.append("```python\nresult = grow(audience)\n\nprint(result)\n```\n\n")
+    return "".join(parts)
+
+
+def pieces(text, rng=None, size=256):
+    """text split into frames: fixed-size, or random sizes when rng is given"""
+    i = 0
+    while i < len(text):
+        step = rng.randint(1, 40) if rng else size
+        yield text[i:i + step]
+        i += step
+
+
+def check_equivalence(fuzz, seed):
+    rng = random.Random(seed)
+    cases = [carousel_answer(rng, size) for size in SIZES.values()]
+    cases += [random_document(rng, rng.randint(50, 3000)) for _ in range(fuzz)]
+    mismatches, resets = [], 0
+    for i, text in enumerate(cases):
+        renderer = markdown_stream.IncrementalMarkdown()
+        blocks = []
+        for piece in pieces(text, rng):
+            patch = renderer.feed(piece)
+            blocks[patch["start"]:] = patch["blocks"]
+        patch = renderer.close()
+        blocks[patch["start"]:] = patch["blocks"]
+        expected = markdown_stream.render(text)
+        if "reset" in patch:
+            resets += 1
+            if patch["reset"] != expected:
+                mismatches.append(i)
+        elif "\n".join(blocks) != expected:
+            mismatches.append(i)
+    return {"cases": len(cases), "resets": resets, "mismatches": mismatches}
+
+
+def time_stream(text, frame_bytes, incremental):
+    renderer = markdown_stream.IncrementalMarkdown()
+    md, seen = renderer.md, ""
+    frames, slowest, rendered = 0, 0.0, 0
+    started = time.perf_counter()
+    for piece in pieces(text, size=frame_bytes):
+        frame_started = time.perf_counter()
+        if incremental:
+            renderer.feed(piece)
+        else:
+            seen += piece
+            markdown_stream.render(seen, md)
+            rendered += len(seen)
+        slowest = max(slowest, time.perf_counter() - frame_started)
+        frames += 1
+    if incremental:
+        renderer.close()
+        rendered = renderer.stats["rendered_chars"]
+    return {"frames": frames, "total_ms": round((time.perf_counter() - started) * 1000, 1),
+            "slowest_frame_ms": round(slowest * 1000, 2), "rendered_chars": rendered}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fuzz", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--frame-bytes", type=int, nargs="+", default=[256])
+    args = parser.parse_args()
+
+    results = {"equivalence": check_equivalence(args.fuzz, args.seed), "timings": {}}
+    rng = random.Random(args.seed)
+    for label, size in SIZES.items():
+        text = carousel_answer(rng, size)
+        for frame_bytes in args.frame_bytes:
+            results["timings"][f"{label}/{frame_bytes}B"] = {
+                "full_rerender": time_stream(text, frame_bytes, incremental=False),
+                "incremental": time_stream(text, frame_bytes, incremental=True),
+            }
+    print(json.dumps(results, indent=2))
+    if results["equivalence"]["mismatches"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
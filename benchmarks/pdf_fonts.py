@@ -0,0 +1,75 @@
+"""Per-render cost of font setup: fresh FontConfiguration vs the shared one.
+
+"cold" reproduces the old behaviour - the @font-face and @page CSS inlined in
+the document and a new FontConfiguration for every PDF, so all TTFs in
+static/fonts are loaded again each time. "hot" is ``pdf_render.render_pdf``
+with the per-thread FontConfiguration and precompiled stylesheet (after one
+warm-up render).
+
+    python benchmarks/pdf_fonts.py --renders 20
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+from weasyprint import HTML  # noqa: E402
+from weasyprint.text.fonts import FontConfiguration  # noqa: E402
+
+import pdf_render  # noqa: E402
+
+
+SAMPLE_CONTENT = "".join(
+    f"<h2>Slide {i}</h2>"
+    f"<p>Variable fonts, <em>italics</em> and <code>code</code> on slide {i}.</p>"
+    "<ul><li>First point</li><li>Second point</li></ul>"
+    for i in range(1, 6)
+)
+
+
+def render_cold(content, template):
+    html = pdf_render.create_enhanced_pdf_html(content, template)
+    inline = f"<style>{pdf_render.FONT_FACE_CSS}{pdf_render.PAGE_CSS}</style>"
+    html = html.replace("<style>", inline + "<style>", 1)
+    return HTML(string=html, base_url=ROOT).write_pdf(
+        font_config=FontConfiguration(), presentational_hints=True)
+
+
+def render_hot(content, template):
+    return pdf_render.render_pdf(content, template, base_url=ROOT)
+
+
+def measure(render, renders, content, template):
+    timings = []
+    for _ in range(renders):
+        started = time.perf_counter()
+        render(content, template)
+        timings.append((time.perf_counter() - started) * 1000)
+    return {
+        "renders": renders,
+        "mean_ms": round(statistics.mean(timings), 1),
+        "p50_ms": round(statistics.median(timings), 1),
+        "max_ms": round(max(timings), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--renders", type=int, default=20)
+    parser.add_argument("--template", default="tech-neural")
+    args = parser.parse_args()
+
+    results = {"cold": measure(render_cold, args.renders, SAMPLE_CONTENT, args.template)}
+    pdf_render.warm_up()
+    render_hot(SAMPLE_CONTENT, args.template)
+    results["hot"] = measure(render_hot, args.renders, SAMPLE_CONTENT, args.template)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
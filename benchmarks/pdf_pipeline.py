@@ -0,0 +1,452 @@
+"""PDF export pipeline benchmark: per-stage latency, peak RSS and output size.
+
+Renders a fixed set of documents with every carousel template and times the
+stages of ``pdf_render.render_pdf`` separately:
+
+    images      pdf_images.normalize_images()
+    preprocess  preprocess_content_for_pdf()
+    html        create_enhanced_pdf_html()
+    layout      WeasyPrint HTML.render() with pdf_render.render_options()
+    write       Document.write_pdf()
+
+The documents are synthetic carousels in four size classes (3, 8, 20 and 50
+slides), each with and without photos, plus the anonymized real exports in
+benchmarks/corpus/. Template CSS is the <style> of
+templates/carousel_template.html, standing in for the styles the editor
+captures and sends with an export.
+
+Every stage gets p50/p90/p95/p99/max latency (nearest rank, so with few
+--repeat runs the high percentiles are the maximum), the peak RSS while it
+ran (VmHWM, reset before each stage through /proc/self/clear_refs; where
+that is unavailable, the process-wide peak) and the size of its output.
+Results are JSON; save one run and compare later ones against it:
+
+    python benchmarks/pdf_pipeline.py run --output baseline.json
+    python benchmarks/pdf_pipeline.py run --baseline baseline.json --output new.json
+    python benchmarks/pdf_pipeline.py compare baseline.json new.json
+
+Comparing exits with status 1 when a stage's p50 or peak RSS grew by more
+than --threshold (10%) and by more than 1 ms / 1 MB. --templates and
+--documents take glob patterns for a quicker subset, e.g.
+``--templates tech-neural --documents 'synthetic-*'``.
+
+To add a real export to the corpus without its text, links and images
+(they become ``synthetic:WxH`` placeholders, filled with generated photos
+of the same size when the benchmark runs):
+
+    python benchmarks/pdf_pipeline.py anonymize export.html > benchmarks/corpus/name.html
+"""
+import argparse
+import base64
+import fnmatch
+import gc
+import glob
+import json
+import math
+import os
+import platform
+import random
+import re
+import resource
+import struct
+import subprocess
+import sys
+import time
+import zlib
+from datetime import datetime, timezone
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+TEMPLATES_HTML = os.path.join(ROOT, "templates", "carousel_template.html")
+
+SIZE_CLASSES = {"small": 3, "medium": 8, "large": 20, "xlarge": 50}
+# Photos go on every other slide, at most this many per document
+MAX_PHOTOS = 8
+PHOTO_SIZES = [(1200, 800), (1600, 1200), (800, 600), (1080, 1350)]
+STAGES = ("images", "preprocess", "html", "layout", "write")
+PERCENTILES = (50, 90, 95, 99)
+
+WORDS = ("carousel growth audience story brand launch insight metric funnel hook "
+         "creator post engagement reach strategy content format design slide tip "
+         "customer product value team data result").split()
+
+
+########################## Documents ##########################
+
+def photo_png(width, height, seed):
+    """A noisy gradient PNG, about as hard to compress as a photo."""
+    rng = random.Random(seed)
+    row_bytes = width * 3
+    noise = rng.randbytes(row_bytes + 4096)
+    # Per-row lookup tables keep the pixel work in bytes.translate
+    tables = [bytes((value // 16 + shade) & 255 for value in range(256)) for shade in range(256)]
+    raw = bytearray()
+    for y in range(height):
+        offset = (y * 37) % 4096
+        raw += b"\x00" + noise[offset:offset + row_bytes].translate(tables[(y * 200 // height + seed) % 256])
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(bytes(raw), 6))
+            + chunk(b"IEND", b""))
+
+
+def photo_uri(width, height, seed):
+    return "data:image/png;base64," + base64.b64encode(photo_png(width, height, seed)).decode()
+
+
+def _sentence(rng, words=None):
+    words = [rng.choice(WORDS) for _ in range(words or rng.randint(6, 18))]
+    return " ".join(words).capitalize() + "."
+
+
+def synthetic_document(slides, photos, seed=0):
+    """Carousel markup like the editor produces: a heading per slide,
+    paragraphs, lists, now and then a code block or a long paragraph."""
+    rng = random.Random(seed)
+    parts = [f"<h1>{_sentence(rng, 5)[:-1]}</h1>"]
+    photo_count = 0
+    for slide in range(slides):
+        parts.append(f"<h2>{slide + 1}. {_sentence(rng, 4)[:-1]}</h2>")
+        parts.append(f"<p>{' '.join(_sentence(rng) for _ in range(rng.randint(1, 3)))}</p>")
+        if photos and slide % 2 == 0 and photo_count < MAX_PHOTOS:
+            width, height = PHOTO_SIZES[photo_count % len(PHOTO_SIZES)]
+            parts.append(f'<p><img alt="Photo" src="{photo_uri(width, height, seed + slide)}"></p>')
+            photo_count += 1
+        roll = rng.random()
+        if roll < 0.4:
+            items = "".join(f"<li>{_sentence(rng, 7)}</li>" for _ in range(rng.randint(3, 10)))
+            tag = rng.choice(["ul", "ol"])
+            parts.append(f"<{tag}>{items}</{tag}>")
+        elif roll < 0.55:
+            lines = "\n".join(f"result_{i} = compute({i}, {rng.randint(0, 99)})"
+                              for i in range(rng.randint(5, 40)))
+            parts.append(f"<pre><code>{lines}</code></pre>")
+        elif roll < 0.7:
+            parts.append(f"<p>{' '.join(_sentence(rng) for _ in range(12))}</p>")
+        else:
+            parts.append(f"<p><strong>{_sentence(rng, 5)}</strong> {_sentence(rng)}</p>")
+    return "\n".join(parts)
+
+
+def fill_placeholders(html):
+    """Replace synthetic:WxH image sources (from ``anonymize``) with photos."""
+    count = iter(range(1_000_000))
+    return re.sub(r'synthetic:(\d+)x(\d+)',
+                  lambda m: photo_uri(int(m.group(1)), int(m.group(2)), next(count)), html)
+
+
+def load_documents():
+    documents = {}
+    for size, slides in SIZE_CLASSES.items():
+        documents[f"synthetic-{size}"] = synthetic_document(slides, photos=False, seed=slides)
+        documents[f"synthetic-{size}-photos"] = synthetic_document(slides, photos=True, seed=slides)
+    for path in sorted(glob.glob(os.path.join(CORPUS_DIR, "*.html"))):
+        with open(path, encoding="utf-8") as f:
+            documents["corpus-" + os.path.basename(path)[:-5]] = fill_placeholders(f.read())
+    return documents
+
+
+def load_templates():
+    """The carousel template CSS and the template names it defines."""
+    with open(TEMPLATES_HTML, encoding="utf-8") as f:
+        page = f.read()
+    styles = "\n".join(re.findall(r"<style[^>]*>(.*?)</style>", page, re.S))
+    names = sorted(set(re.findall(r"\.([a-z]+(?:-[a-z]+)*)-template\b", styles)))
+    return styles, names
+
+
+########################## Anonymizing ##########################
+
+def _scramble(text, rng):
+    """Same shape, different letters: keeps line breaks and word lengths."""
+    out = []
+    for char in text:
+        if char.isupper():
+            out.append(chr(rng.randint(65, 90)))
+        elif char.islower():
+            out.append(chr(rng.randint(97, 122)))
+        elif char.isdigit():
+            out.append(str(rng.randint(0, 9)))
+        else:
+            out.append(char)
+    return "".join(out)
+
+
+def _image_size(src):
+    """Pixel size of a PNG or JPEG data URI, if it can be read."""
+    if not src.startswith("data:") or "," not in src:
+        return None
+    try:
+        data = base64.b64decode(src.split(",", 1)[1])
+    except ValueError:
+        return None
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return struct.unpack(">II", data[16:24])
+    if data[:2] == b"\xff\xd8":
+        i = 2
+        while i + 9 < len(data):
+            marker, length = data[i + 1], struct.unpack(">H", data[i + 2:i + 4])[0]
+            if marker in (0xC0, 0xC1, 0xC2):
+                height, width = struct.unpack(">HH", data[i + 5:i + 9])
+                return width, height
+            i += 2 + length
+    return None
+
+
+def anonymize(html, seed=0):
+    from bs4 import BeautifulSoup, Comment
+    rng = random.Random(seed)
+    soup = BeautifulSoup(html, "html.parser")
+    for node in soup.find_all(["script", "style"]):
+        node.decompose()
+    for comment in soup.find_all(string=lambda s: isinstance(s, Comment)):
+        comment.extract()
+    for text in soup.find_all(string=True):
+        text.replace_with(_scramble(str(text), rng))
+    for img in soup.find_all("img"):
+        width, height = _image_size(img.get("src", "")) or (
+            int(img.get("width", 1200)), int(img.get("height", 800)))
+        img["src"] = f"synthetic:{width}x{height}"
+        for attr in ("alt", "title"):
+            if img.get(attr):
+                img[attr] = _scramble(img[attr], rng)
+    for link in soup.find_all(href=True):
+        link["href"] = "https://example.com/"
+    return str(soup)
+
+
+########################## Measuring ##########################
+
+def _reset_peak_rss():
+    """Start a new VmHWM window (Linux); False where that is not possible."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def _timed(record, stage, function, *args, **kwargs):
+    gc.collect()
+    _reset_peak_rss()
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    record[stage] = ((time.perf_counter() - started) * 1000, _peak_rss_mb())
+    return result
+
+
+def render_once(content, template, styles):
+    """One export, stage by stage, the way render_pdf does it. Returns
+    {stage: (ms, peak_rss_mb)} and {stage: output size}."""
+    from weasyprint import HTML
+    import pdf_images
+    import pdf_render
+
+    font_config, options = pdf_render.render_options()
+    record = {}
+    # Timed as a first export: re-exports would find the images in the cache
+    pdf_images.clear_cache()
+    normalized = _timed(record, "images", pdf_images.normalize_images, content)
+    processed = _timed(record, "preprocess", pdf_render.preprocess_content_for_pdf, normalized)
+    full_html = _timed(record, "html", pdf_render.create_enhanced_pdf_html,
+                       processed, template, styles, True, True)
+    document = _timed(record, "layout", lambda: HTML(
+        string=full_html, base_url=ROOT, encoding="utf-8").render(font_config, None, **options))
+    pdf = _timed(record, "write", document.write_pdf, None, 1, None, **options)
+    sizes = {
+        "images": len(normalized.encode()),
+        "preprocess": len(processed.encode()),
+        "html": len(full_html.encode()),
+        "layout": len(getattr(document, "pages", ())),
+        "write": len(pdf),
+    }
+    return record, sizes
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1))]
+
+
+def summarize(timings, peaks):
+    summary = {f"p{p}_ms": round(percentile(timings, p), 2) for p in PERCENTILES}
+    summary["max_ms"] = round(max(timings), 2)
+    summary["peak_rss_mb"] = round(max(peaks), 1)
+    return summary
+
+
+def run_case(content, template, styles, repeat):
+    samples = {stage: ([], []) for stage in STAGES + ("total",)}
+    # The first render warms up fonts and caches and is not counted
+    for run in range(repeat + 1):
+        record, sizes = render_once(content, template, styles)
+        if run == 0:
+            continue
+        for stage, (ms, peak) in record.items():
+            samples[stage][0].append(ms)
+            samples[stage][1].append(peak)
+        samples["total"][0].append(sum(ms for ms, _ in record.values()))
+        samples["total"][1].append(max(peak for _, peak in record.values()))
+    stages = {stage: summarize(*samples[stage]) for stage in samples}
+    for stage in ("images", "preprocess", "html", "write"):
+        stages[stage]["output_bytes"] = sizes[stage]
+    stages["layout"]["pages"] = sizes["layout"]
+    return {"document_bytes": len(content.encode()), "stages": stages}
+
+
+def _metadata(args):
+    from importlib import metadata
+    try:
+        revision = subprocess.run(["git", "describe", "--always", "--dirty"], cwd=ROOT,
+                                  capture_output=True, text=True).stdout.strip()
+    except OSError:
+        revision = None
+    import pdf_render
+    return {
+        "revision": revision,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "weasyprint": metadata.version("weasyprint"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "html_parser": pdf_render.PDF_HTML_PARSER,
+        "repeat": args.repeat,
+        "peak_rss_per_stage": _reset_peak_rss(),
+    }
+
+
+########################## Comparing ##########################
+
+def compare(baseline, current, threshold):
+    """Per-stage changes of p50 latency and peak RSS between two runs."""
+    regressions, improvements, ratios = [], [], {}
+    for case, result in current["cases"].items():
+        base = baseline["cases"].get(case)
+        if base is None:
+            continue
+        for stage, stats in result["stages"].items():
+            old = base["stages"].get(stage)
+            if not old:
+                continue
+            for metric, floor in (("p50_ms", 1.0), ("peak_rss_mb", 1.0)):
+                before, after = old[metric], stats[metric]
+                if metric == "p50_ms" and before > 0 and after > 0:
+                    ratios.setdefault(stage, []).append(after / before)
+                if before <= 0 or abs(after - before) < floor:
+                    continue
+                change = after / before - 1
+                entry = {"case": case, "stage": stage, "metric": metric,
+                         "baseline": before, "current": after, "change": round(change, 3)}
+                if change > threshold:
+                    regressions.append(entry)
+                elif change < -threshold:
+                    improvements.append(entry)
+    return {
+        "baseline": baseline.get("meta", {}).get("revision"),
+        "current": current.get("meta", {}).get("revision"),
+        # Geometric mean over all cases of current p50 / baseline p50
+        "p50_ratio_by_stage": {
+            stage: round(math.exp(sum(map(math.log, values)) / len(values)), 3)
+            for stage, values in ratios.items()
+        },
+        "regressions": sorted(regressions, key=lambda e: -e["change"]),
+        "improvements": sorted(improvements, key=lambda e: e["change"]),
+    }
+
+
+def _load(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+########################## Commands ##########################
+
+def command_run(args):
+    documents = load_documents()
+    styles, templates = load_templates()
+    documents = {name: html for name, html in documents.items()
+                 if any(fnmatch.fnmatch(name, pattern) for pattern in args.documents)}
+    templates = [name for name in templates
+                 if any(fnmatch.fnmatch(name, pattern) for pattern in args.templates)]
+    results = {"meta": _metadata(args), "cases": {}}
+    total = len(documents) * len(templates)
+    for i, (name, html) in enumerate(documents.items()):
+        for j, template in enumerate(templates):
+            case = f"{name}/{template}"
+            print(f"[{i * len(templates) + j + 1}/{total}] {case}", file=sys.stderr)
+            results["cases"][case] = run_case(html, template, styles, args.repeat)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if args.baseline:
+        report = compare(_load(args.baseline), results, args.threshold)
+        print(json.dumps(report, indent=2))
+        return 1 if report["regressions"] else 0
+    return 0
+
+
+def command_compare(args):
+    report = compare(_load(args.baseline), _load(args.current), args.threshold)
+    print(json.dumps(report, indent=2))
+    return 1 if report["regressions"] else 0
+
+
+def command_anonymize(args):
+    with open(args.path, encoding="utf-8") as f:
+        print(anonymize(f.read(), args.seed))
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="benchmark and print/save JSON results")
+    run.add_argument("--repeat", type=int, default=5)
+    run.add_argument("--templates", nargs="+", default=["*"], help="glob patterns")
+    run.add_argument("--documents", nargs="+", default=["*"], help="glob patterns")
+    run.add_argument("--output", help="write the results here instead of stdout")
+    run.add_argument("--baseline", help="results file to compare this run against")
+    run.add_argument("--threshold", type=float, default=0.10)
+    run.set_defaults(handler=command_run)
+
+    comparison = commands.add_parser("compare", help="compare two results files")
+    comparison.add_argument("baseline")
+    comparison.add_argument("current")
+    comparison.add_argument("--threshold", type=float, default=0.10)
+    comparison.set_defaults(handler=command_compare)
+
+    anonymizing = commands.add_parser("anonymize", help="strip text and images from an export")
+    anonymizing.add_argument("path")
+    anonymizing.add_argument("--seed", type=int, default=0)
+    anonymizing.set_defaults(handler=command_anonymize)
+
+    args = parser.parse_args()
+    sys.exit(args.handler(args))
+
+
+if __name__ == "__main__":
+    main()
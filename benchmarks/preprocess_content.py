@@ -0,0 +1,209 @@
+"""preprocess_content_for_pdf: equivalence check and scaling benchmark.
+
+Compares ``pdf_render.preprocess_content_for_pdf`` with the multi-pass
+version it replaced (copied below as ``legacy_preprocess``):
+
+* every document in benchmarks/corpus/ (carousel HTML as the preview
+  produces it) and randomly generated markup with nested paragraphs, lists
+  and code blocks must come out byte-for-byte identical;
+* then both are timed on ~10 KB, ~100 KB and ~1 MB documents made by
+  concatenating the corpus, plus the lxml parser when it is installed.
+
+    python benchmarks/preprocess_content.py --fuzz 2000 --repeat 5
+"""
+import argparse
+import glob
+import importlib.util
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+import pdf_render  # noqa: E402
+
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+SIZES = {"10KB": 10 * 1024, "100KB": 100 * 1024, "1MB": 1024 * 1024}
+
+
+def legacy_preprocess(content):
+    """preprocess_content_for_pdf as it was before the single-pass rewrite,
+    minus its catch-all: it raises where the original fell back to
+    returning the content untouched."""
+    soup = BeautifulSoup(content, 'html.parser')
+    for p in soup.find_all('p'):
+        if p.get_text() and len(p.get_text()) > 800:
+            p['class'] = p.get('class', []) + ['long-content']
+            text = p.get_text()
+            if len(text) > 1200:
+                sentences = text.split('. ')
+                if len(sentences) > 3:
+                    p.clear()
+                    mid_point = len(sentences) // 2
+                    first_half = '. '.join(sentences[:mid_point]) + '.'
+                    first_p = soup.new_tag('p', **{'class': 'long-content'})
+                    first_p.string = first_half
+                    second_half = '. '.join(sentences[mid_point:])
+                    if not second_half.endswith('.'):
+                        second_half += '.'
+                    second_p = soup.new_tag('p', **{'class': 'long-content'})
+                    second_p.string = second_half
+                    p.insert_before(first_p)
+                    p.insert_before(second_p)
+                    p.decompose()
+    for ul in soup.find_all(['ul', 'ol']):
+        items = ul.find_all('li')
+        if len(items) > 8:
+            for i, item in enumerate(items):
+                if i > 0 and i % 7 == 0:
+                    item['style'] = item.get('style', '') + ' page-break-before: auto;'
+    for pre in soup.find_all('pre'):
+        code_text = pre.get_text()
+        if len(code_text) > 1000:
+            lines = code_text.split('\n')
+            if len(lines) > 25:
+                pre.clear()
+                chunk_size = 20
+                for i in range(0, len(lines), chunk_size):
+                    chunk_lines = lines[i:i + chunk_size]
+                    new_pre = soup.new_tag('pre')
+                    new_pre.string = '\n'.join(chunk_lines)
+                    if i > 0:
+                        spacing = soup.new_tag('div', style='height: 10px;')
+                        pre.insert_before(spacing)
+                    pre.insert_before(new_pre)
+                pre.decompose()
+    headings = soup.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
+    for i, heading in enumerate(headings):
+        if i > 0 and i % 3 == 0:
+            break_div = soup.new_tag('div', **{
+                'class': 'page-break-opportunity',
+                'style': 'page-break-before: auto; height: 1px;'
+            })
+            heading.insert_before(break_div)
+    for br in soup.find_all('br'):
+        next_sibling = br.next_sibling
+        if next_sibling and next_sibling.name == 'br':
+            br.decompose()
+    for p in soup.find_all('p'):
+        if not p.get_text().strip() and not p.find('img'):
+            p.decompose()
+    return str(soup)
+
+
+def load_corpus():
+    corpus = {}
+    for path in sorted(glob.glob(os.path.join(CORPUS_DIR, "*.html"))):
+        with open(path, encoding="utf-8") as f:
+            corpus[os.path.basename(path)] = f.read()
+    return corpus
+
+
+def sized_document(corpus, size):
+    documents = list(corpus.values())
+    parts, total = [], 0
+    while total < size:
+        document = documents[len(parts) % len(documents)]
+        parts.append(document)
+        total += len(document)
+    return "\n".join(parts)
+
+
+def random_markup(rng, depth=0):
+    """Random, often invalid, nesting of the tags the preprocessor touches"""
+    parts = []
+    for _ in range(rng.randint(1, 6)):
+        roll = rng.random()
+        if depth < 4 and roll < 0.45:
+            tag = rng.choice(["p", "p", "ul", "ol", "li", "li", "pre", "div", "h1", "h2", "h3"])
+            attrs = rng.choice(["", "", ' class="lead"', ' style="color: red;"'])
+            parts.append(f"<{tag}{attrs}>{random_markup(rng, depth + 1)}</{tag}>")
+        elif roll < 0.6:
+            parts.append("<br>" * rng.randint(1, 3))
+        elif roll < 0.65:
+            parts.append('<img src="data:image/png;base64,AAAA">')
+        elif roll < 0.75:
+            sentence = "Sentence number %d keeps going for a while" % rng.randint(0, 99)
+            parts.append(". ".join([sentence] * rng.randint(5, 40)) + rng.choice(["", "."]))
+        elif roll < 0.8:
+            parts.append("\n".join("line %d = %d" % (i, i * i) for i in range(rng.randint(10, 120))))
+        else:
+            parts.append(rng.choice(["", " ", "text", "\n", "x. y. z. w. v"]))
+    return "".join(parts)
+
+
+def check_equivalence(corpus, fuzz, seed):
+    cases = list(corpus.items())
+    cases += [(name, sized_document(corpus, size)) for name, size in SIZES.items()]
+    rng = random.Random(seed)
+    cases += [(f"random-{i}", random_markup(rng)) for i in range(fuzz)]
+    mismatches, legacy_errors = [], 0
+    for name, html in cases:
+        try:
+            expected = legacy_preprocess(html)
+        except Exception:
+            # Nested long paragraphs/code blocks, where the old code tried to
+            # split an element it had just detached and gave up on the page
+            legacy_errors += 1
+            continue
+        if pdf_render.preprocess_content_for_pdf(html) != expected:
+            mismatches.append(name)
+    return {"cases": len(cases), "legacy_errors": legacy_errors, "mismatches": mismatches}
+
+
+def with_parser(name):
+    def run(html):
+        previous, pdf_render.PDF_HTML_PARSER = pdf_render.PDF_HTML_PARSER, name
+        try:
+            return pdf_render.preprocess_content_for_pdf(html)
+        finally:
+            pdf_render.PDF_HTML_PARSER = previous
+    return run
+
+
+def time_call(function, html, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(html)
+        timings.append((time.perf_counter() - started) * 1000)
+    return round(statistics.median(timings), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fuzz", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    results = {"equivalence": check_equivalence(corpus, args.fuzz, args.seed), "timings_ms": {}}
+
+    variants = {
+        # Floor: what html.parser and serializing cost on their own
+        "parse_and_serialize": lambda html: str(BeautifulSoup(html, "html.parser")),
+        "legacy": legacy_preprocess,
+        "single_pass": pdf_render.preprocess_content_for_pdf,
+    }
+    if importlib.util.find_spec("lxml") is not None:
+        variants["single_pass_lxml"] = with_parser("lxml")
+    for label, size in SIZES.items():
+        html = sized_document(corpus, size)
+        results["timings_ms"][label] = {
+            name: time_call(function, html, args.repeat) for name, function in variants.items()
+        }
+    print(json.dumps(results, indent=2))
+    if results["equivalence"]["mismatches"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
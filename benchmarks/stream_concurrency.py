@@ -0,0 +1,134 @@
+"""Concurrency comparison: sync gunicorn /generate-stream vs the ASGI path.
+
+Starts tools/fake_anthropic.py on localhost (so no API money is spent),
+boots the app twice under gunicorn - once with sync workers (app:app) and
+once with uvicorn workers (asgi:application) - and opens N concurrent
+/generate-stream requests against each.
+
+    python benchmarks/stream_concurrency.py --streams 200 --workers 2
+
+App settings (SECRET_KEY, DATABASE_URL, GOOGLE_*) are taken from the
+environment; throwaway local defaults are filled in when missing.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+
+import fake_anthropic  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+########################## Load driver ##########################
+
+async def one_stream(client, url):
+    t0 = time.perf_counter()
+    ttfb = None
+    async with client.stream("POST", url, json={"prompt": "benchmark"}) as response:
+        async for _ in response.aiter_bytes():
+            if ttfb is None:
+                ttfb = time.perf_counter() - t0
+    return ttfb, time.perf_counter() - t0
+
+
+async def drive(url, streams, timeout):
+    limits = httpx.Limits(max_connections=streams, max_keepalive_connections=0)
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        t0 = time.perf_counter()
+        results = await asyncio.gather(
+            *(one_stream(client, url) for _ in range(streams)),
+            return_exceptions=True)
+        wall = time.perf_counter() - t0
+    ok = [r for r in results if not isinstance(r, BaseException)]
+    return ok, len(results) - len(ok), wall
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def run_mode(name, target, worker_class, args, env):
+    port = free_port()
+    cmd = [sys.executable, "-m", "gunicorn", target, "-b", f"127.0.0.1:{port}",
+           "-w", str(args.workers), "-k", worker_class, "--timeout", "120",
+           "--log-level", "warning"]
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env)
+    try:
+        for _ in range(100):
+            try:
+                httpx.get(f"http://127.0.0.1:{port}/pricing", timeout=1)
+                break
+            except httpx.HTTPError:
+                time.sleep(0.2)
+        ok, failed, wall = asyncio.run(
+            drive(f"http://127.0.0.1:{port}/generate-stream", args.streams, args.timeout))
+    finally:
+        proc.terminate()
+        proc.wait()
+    ttfb = [r[0] for r in ok if r[0] is not None]
+    total = [r[1] for r in ok]
+    report = {
+        "mode": name,
+        "workers": args.workers,
+        "streams": args.streams,
+        "completed": len(ok),
+        "failed": failed,
+        "wall_s": round(wall, 2),
+        "ttfb_p50_s": round(statistics.median(ttfb), 3) if ttfb else None,
+        "ttfb_p95_s": round(pct(ttfb, 95), 3) if ttfb else None,
+        "ttfb_max_s": round(max(ttfb), 3) if ttfb else None,
+        "stream_p50_s": round(statistics.median(total), 3) if total else None,
+    }
+    print(json.dumps(report))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--streams", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--tokens", type=int, default=100)
+    parser.add_argument("--token-interval", type=float, default=0.02)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--modes", default="sync,asgi")
+    args = parser.parse_args()
+
+    server, fake = fake_anthropic.serve(tokens=args.tokens, latency=0,
+                                        tokens_per_second=1 / args.token_interval)
+
+    env = dict(os.environ)
+    env["LLM_BASE_URL"] = fake.url
+    env.setdefault("CLAUDE_APIKEY", "fake-key")
+    env.setdefault("SECRET_KEY", "benchmark")
+    env.setdefault("DATABASE_URL", "sqlite:////tmp/geniuspost-bench.sqlite3")
+    for var in ("GOOGLE_CLIENT_ID", "GOOGLE_CLIENT_SECRET", "REDIRECT_URI"):
+        env.setdefault(var, "benchmark")
+
+    modes = {
+        "sync": ("app:app", "sync"),
+        "asgi": ("asgi:application", "uvicorn.workers.UvicornWorker"),
+    }
+    for name in args.modes.split(","):
+        target, worker_class = modes[name]
+        run_mode(name, target, worker_class, args, env)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+"""Resumable generations for /generate-stream.
+
+Each streaming request starts a ``Generation``: a background thread drives
+the upstream Claude stream to completion and appends its text to an
+in-process buffer, independent of the HTTP response reading it. Responses
+are subscribers reading from a character offset, so a client that drops off
+can reconnect with ``Last-Event-ID: <generation id>:<offset>`` and pick up
+where it left off without paying for a second Claude call.
+
+A generation with no readers left is cancelled once GENERATION_ORPHAN_GRACE
+seconds pass without a reconnect (or straight away through ``cancel()``),
+which closes the upstream Claude stream instead of paying for output nobody
+will read.
+
+Finished generations stay readable for GENERATION_TTL seconds, and each
+worker keeps at most GENERATION_MAX_BUFFERED of them. Buffers are per
+process, so resuming needs to land on the same worker (one uvicorn/threaded
+worker per host, or sticky routing).
+"""
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import sse
+
+
+GENERATION_TTL = float(os.environ.get("GENERATION_TTL", "300"))
+GENERATION_MAX_BUFFERED = int(os.environ.get("GENERATION_MAX_BUFFERED", "256"))
+GENERATION_ORPHAN_GRACE = float(os.environ.get("GENERATION_ORPHAN_GRACE", "5"))
+
+_local = threading.local()
+
+
+class GenerationError(Exception):
+    """The upstream call behind a generation failed."""
+
+
+class GenerationCancelled(Exception):
+    """The generation was cancelled before the upstream call finished."""
+
+
+def current():
+    """The generation being produced on the calling thread, if any."""
+    return getattr(_local, "generation", None)
+
+
+def detach():
+    """Mark the generation on the calling thread as going on upstream for
+    other readers: cancelling it stops nothing, so it does not count as
+    cancelled work."""
+    generation = current()
+    if generation is not None:
+        generation.detached = True
+
+
+def parse_event_id(value):
+    """Split a ``Last-Event-ID`` of the form ``<generation id>:<offset>``."""
+    generation_id, sep, offset = (value or "").strip().rpartition(":")
+    if not sep or not generation_id or not offset.isdigit():
+        return None
+    return generation_id, int(offset)
+
+
+class Generation:
+    def __init__(self, on_orphaned=None):
+        self.id = uuid.uuid4().hex
+        self.text = ""
+        self.done = False
+        self.error = None
+        self.started_at = time.time()
+        self.finished_at = None
+        self.subscribers = 0
+        self.cancelled = False
+        self.cancel_reason = None
+        self.detached = False
+        self._cancel_callbacks = []
+        self._on_orphaned = on_orphaned
+        self._cond = threading.Condition()
+        # Events set on every change, for readers of several generations
+        self._wakers = []
+
+    def _changed(self):
+        self._cond.notify_all()
+        for event in self._wakers:
+            event.set()
+
+    def append(self, text):
+        with self._cond:
+            self.text += text
+            self._changed()
+
+    def finish(self, error=None):
+        with self._cond:
+            self.done = True
+            self.error = (str(error) or error.__class__.__name__) if error else None
+            self.finished_at = time.time()
+            self._changed()
+
+    def read(self, offset, timeout):
+        """Return ``(text after offset, done, error)``, waiting up to timeout
+        for something new."""
+        with self._cond:
+            if offset >= len(self.text) and not self.done:
+                self._cond.wait(timeout)
+            return self.text[offset:], self.done, self.error
+
+    def subscribe(self, offset=0, waker=None):
+        with self._cond:
+            self.subscribers += 1
+            if waker is not None:
+                self._wakers.append(waker)
+            return Subscription(self, min(max(offset, 0), len(self.text)), waker)
+
+    def _unsubscribe(self, waker=None):
+        with self._cond:
+            self.subscribers -= 1
+            if waker is not None:
+                self._wakers.remove(waker)
+            orphaned = self.subscribers == 0 and not self.done
+        if orphaned and self._on_orphaned is not None:
+            self._on_orphaned(self)
+
+    def on_cancel(self, callback):
+        """Run callback (e.g. closing the upstream stream) if this generation
+        gets cancelled."""
+        with self._cond:
+            if not self.cancelled:
+                self._cancel_callbacks.append(callback)
+                return
+        callback()
+
+    def cancel(self, reason="cancelled"):
+        """Stop the upstream call; returns False if it had already finished."""
+        with self._cond:
+            if self.done or self.cancelled:
+                return False
+            self.cancelled = True
+            self.cancel_reason = reason
+            callbacks = self._cancel_callbacks
+            self._cancel_callbacks = []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Generation {self.id} cancel callback failed: {e}")
+        return True
+
+
+class Subscription:
+    """Queue-like view of a generation from an offset, for ``sse.StreamWriter``."""
+
+    def __init__(self, generation, offset, waker=None):
+        self.generation = generation
+        self.offset = offset
+        self.waker = waker
+
+    def close(self):
+        if self.generation is not None:
+            generation, self.generation = self.generation, None
+            generation._unsubscribe(self.waker)
+
+    def get(self, timeout=None):
+        text, done, error = self.generation.read(self.offset, timeout)
+        if text:
+            self.offset += len(text)
+            return text
+        if done:
+            return GenerationError(error) if error else sse.END
+        raise queue.Empty
+
+
+class MultiSubscription:
+    """Several generations read at once (for ``sse.multiplex``): ``get()``
+    returns ``(index, item)`` for whichever has something new, taking turns."""
+
+    def __init__(self, generations, offset=0):
+        self._wake = threading.Event()
+        self.subscriptions = [generation.subscribe(offset, self._wake)
+                              for generation in generations]
+        self._finished = set()
+        self._next = 0
+
+    def close(self):
+        for subscription in self.subscriptions:
+            subscription.close()
+
+    def get(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        count = len(self.subscriptions)
+        while True:
+            # Cleared before looking, so a change made meanwhile still wakes us
+            self._wake.clear()
+            for step in range(count):
+                index = (self._next + step) % count
+                if index in self._finished:
+                    continue
+                try:
+                    item = self.subscriptions[index].get(timeout=0)
+                except queue.Empty:
+                    continue
+                if item is sse.END or isinstance(item, Exception):
+                    self._finished.add(index)
+                self._next = index + 1
+                return index, item
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise queue.Empty
+            if not self._wake.wait(remaining):
+                raise queue.Empty
+
+
+class KeyedLimiter:
+    """At most ``limit`` concurrent holders per key (e.g. per user)."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.stats = {"acquired": 0, "waited": 0, "gave_up": 0}
+        self._active = {}
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def hold(self, key, cancelled=lambda: False):
+        """Wait for a free place for key; gives up (GenerationCancelled) once
+        cancelled() says the work is no longer wanted."""
+        with self._cond:
+            if self._active.get(key, 0) >= self.limit:
+                self.stats["waited"] += 1
+            while self._active.get(key, 0) >= self.limit:
+                if cancelled():
+                    self.stats["gave_up"] += 1
+                    raise GenerationCancelled("cancelled while waiting for a free slot")
+                self._cond.wait(1)
+            self._active[key] = self._active.get(key, 0) + 1
+            self.stats["acquired"] += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active[key] -= 1
+                if not self._active[key]:
+                    del self._active[key]
+                self._cond.notify_all()
+
+
+class GenerationRegistry:
+    def __init__(self, ttl=GENERATION_TTL, max_buffered=GENERATION_MAX_BUFFERED,
+                 orphan_grace=GENERATION_ORPHAN_GRACE):
+        self.ttl = ttl
+        self.max_buffered = max_buffered
+        self.orphan_grace = orphan_grace
+        self.stats = {
+            "completed": 0,
+            "completed_seconds": 0.0,
+            "cancelled": 0,
+            "cancelled_seconds": 0.0,
+            "cancelled_chars": 0,
+            "detached": 0,
+            "detached_seconds": 0.0,
+        }
+        self._generations = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start(self, deltas):
+        """Run the iterable of text deltas in the background until it ends or
+        the generation is cancelled."""
+        generation = Generation(on_orphaned=self._schedule_reap)
+        with self._lock:
+            self._generations[generation.id] = generation
+            self._prune()
+        threading.Thread(target=self._run, args=(generation, deltas), daemon=True).start()
+        # Covers a client that disconnects before it ever starts reading
+        self._schedule_reap(generation)
+        return generation
+
+    def _run(self, generation, deltas):
+        _local.generation = generation
+        error = None
+        try:
+            for text in deltas:
+                if generation.cancelled:
+                    break
+                generation.append(text)
+        except Exception as e:
+            error = e
+        finally:
+            try:
+                # Still current while closing, for the stream's cleanup (detach())
+                close = getattr(deltas, "close", None)
+                if close is not None:
+                    close()
+            finally:
+                _local.generation = None
+
+        elapsed = time.time() - generation.started_at
+        if generation.cancelled:
+            generation.finish(GenerationCancelled(generation.cancel_reason))
+            print(f"Generation {generation.id} cancelled ({generation.cancel_reason}) "
+                  f"after {elapsed:.1f}s and {len(generation.text)} chars")
+        else:
+            generation.finish(error)
+        if not generation.cancelled:
+            outcome = "completed"
+        else:
+            outcome = "detached" if generation.detached else "cancelled"
+        self.record(elapsed, len(generation.text), outcome)
+
+    def record(self, elapsed, chars, outcome):
+        """Count a finished stream as "completed", "cancelled" or "detached"
+        (cancelled, but its upstream call went on for other readers);
+        asgi.py streams outside the registry and reports theirs here too."""
+        with self._lock:
+            self.stats[outcome] += 1
+            self.stats[f"{outcome}_seconds"] += elapsed
+            if outcome == "cancelled":
+                self.stats["cancelled_chars"] += chars
+
+    def _schedule_reap(self, generation):
+        timer = threading.Timer(self.orphan_grace, self._reap, args=(generation,))
+        timer.daemon = True
+        timer.start()
+
+    def _reap(self, generation):
+        if generation.subscribers == 0:
+            generation.cancel("client disconnected")
+
+    def cancellation_report(self):
+        """Cancellation counters plus rough estimates of what they saved.
+
+        Worker time saved assumes a cancelled generation would have run as
+        long as the average completed one; tokens are estimated at ~4
+        characters each. Detached generations saved nothing and are left out.
+        """
+        with self._lock:
+            stats = dict(self.stats)
+        average = stats["completed_seconds"] / stats["completed"] if stats["completed"] else 0.0
+        stats["estimated_worker_seconds_saved"] = round(
+            max(0.0, stats["cancelled"] * average - stats["cancelled_seconds"]), 1)
+        stats["estimated_tokens_before_cancel"] = stats["cancelled_chars"] // 4
+        return stats
+
+    def get(self, generation_id):
+        with self._lock:
+            self._prune()
+            return self._generations.get(generation_id)
+
+    def _prune(self):
+        expired = time.time() - self.ttl
+        finished = [g for g in self._generations.values() if g.done]
+        overflow = len(self._generations) - self.max_buffered
+        for generation in finished:
+            if generation.finished_at < expired or overflow > 0:
+                del self._generations[generation.id]
+                overflow -= 1
@@ -0,0 +1,156 @@
+"""Google sign-in: code exchange and local id_token verification.
+
+The OAuth callback used to make two blocking calls with bare
+``requests.post/get`` (no timeouts, a new TLS connection each): the token
+exchange and a userinfo lookup. Now the token exchange goes through a
+per-process pooled ``requests.Session`` with connect/read timeouts, and the
+user comes from the ``id_token`` in its response, verified here against
+Google's signing keys (JWKS). The keys are cached for as long as Google's
+Cache-Control allows and fetched again when they expire or a token names a
+key we have not seen (rotation), so a login costs one upstream round trip.
+
+Every endpoint is configurable, so tools/fake_google_oauth.py can stand in
+for Google locally (benchmarks/google_login.py compares both flows with it).
+"""
+import os
+import re
+import threading
+import time
+
+import requests
+
+
+GOOGLE_AUTH_URL = os.environ.get("GOOGLE_AUTH_URL", "https://accounts.google.com/o/oauth2/auth")
+GOOGLE_TOKEN_URL = os.environ.get("GOOGLE_TOKEN_URL", "https://oauth2.googleapis.com/token")
+GOOGLE_CERTS_URL = os.environ.get("GOOGLE_CERTS_URL", "https://www.googleapis.com/oauth2/v3/certs")
+GOOGLE_ISSUERS = os.environ.get(
+    "GOOGLE_ISSUERS", "https://accounts.google.com,accounts.google.com").split(",")
+GOOGLE_CONNECT_TIMEOUT = float(os.environ.get("GOOGLE_CONNECT_TIMEOUT", "3"))
+GOOGLE_READ_TIMEOUT = float(os.environ.get("GOOGLE_READ_TIMEOUT", "10"))
+# Used when the certs response has no max-age
+GOOGLE_CERTS_TTL = float(os.environ.get("GOOGLE_CERTS_TTL", "3600"))
+# Unknown key ids trigger a refetch at most this often
+GOOGLE_CERTS_MIN_REFRESH = float(os.environ.get("GOOGLE_CERTS_MIN_REFRESH", "60"))
+# Clock skew allowed on exp/iat
+GOOGLE_TOKEN_LEEWAY = int(os.environ.get("GOOGLE_TOKEN_LEEWAY", "60"))
+
+
+class GoogleAuthError(Exception):
+    """The code exchange failed or the id_token did not verify."""
+
+
+_lock = threading.Lock()
+_session = None
+_session_pid = None
+
+
+def get_session():
+    """This process's pooled HTTP session to Google (rebuilt after a fork)."""
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is not None and _session_pid == pid:
+        return _session
+    with _lock:
+        if _session is None or _session_pid != pid:
+            _session = requests.Session()
+            _session_pid = pid
+    return _session
+
+
+def _timeout():
+    return (GOOGLE_CONNECT_TIMEOUT, GOOGLE_READ_TIMEOUT)
+
+
+class SigningKeys:
+    """Google's JWKS, cached until it expires."""
+
+    def __init__(self, url=GOOGLE_CERTS_URL):
+        self.url = url
+        self.stats = {"fetches": 0}
+        self._keys = None
+        self._kids = set()
+        self._expires = 0.0
+        self._fetched = 0.0
+        self._lock = threading.Lock()
+
+    def _fetch(self):
+        from joserfc.jwk import KeySet
+        response = get_session().get(self.url, timeout=_timeout())
+        response.raise_for_status()
+        max_age = re.search(r"max-age=(\d+)", response.headers.get("Cache-Control", ""))
+        ttl = int(max_age.group(1)) if max_age else GOOGLE_CERTS_TTL
+        data = response.json()
+        self._keys = KeySet.import_key_set(data)
+        self._kids = {key.get("kid") for key in data.get("keys", [])}
+        self._fetched = time.monotonic()
+        self._expires = self._fetched + ttl
+        self.stats["fetches"] += 1
+
+    def get(self, kid):
+        """The key set, refetched if it expired or does not have kid yet."""
+        with self._lock:
+            now = time.monotonic()
+            stale = self._keys is None or now >= self._expires
+            unknown = kid not in self._kids and now - self._fetched >= GOOGLE_CERTS_MIN_REFRESH
+            if stale or unknown:
+                try:
+                    self._fetch()
+                except (requests.RequestException, ValueError) as e:
+                    if self._keys is None:
+                        raise GoogleAuthError(f"Could not fetch Google signing keys: {e}")
+                    print(f"Google signing keys refresh failed, keeping the old ones: {e}")
+            return self._keys
+
+
+signing_keys = SigningKeys()
+
+
+def auth_url(client_id, redirect_uri, state):
+    return requests.Request("GET", GOOGLE_AUTH_URL, params={
+        "response_type": "code",
+        "client_id": client_id,
+        "redirect_uri": redirect_uri,
+        "scope": "openid email profile",
+        "state": state,
+    }).prepare().url
+
+
+def exchange_code(code, client_id, client_secret, redirect_uri):
+    """Trade the authorization code for Google's token response."""
+    try:
+        response = get_session().post(GOOGLE_TOKEN_URL, timeout=_timeout(), data={
+            "code": code,
+            "client_id": client_id,
+            "client_secret": client_secret,
+            "redirect_uri": redirect_uri,
+            "grant_type": "authorization_code",
+        })
+        tokens = response.json()
+    except (requests.RequestException, ValueError) as e:
+        raise GoogleAuthError(f"Token exchange failed: {e}")
+    if response.status_code != 200 or "id_token" not in tokens:
+        raise GoogleAuthError(f"Token exchange failed ({response.status_code}): "
+                              f"{tokens.get('error_description') or tokens.get('error')}")
+    return tokens
+
+
+def verify_id_token(id_token, client_id, keys=signing_keys):
+    """Check the id_token's signature, issuer, audience and expiry and
+    return its claims (sub, email, name, picture, ...)."""
+    # joserfc (and cryptography under it) only loads on the first login
+    from joserfc import jwt
+    from joserfc.errors import JoseError
+    claims_registry = jwt.JWTClaimsRegistry(
+        leeway=GOOGLE_TOKEN_LEEWAY,
+        iss={"essential": True, "values": GOOGLE_ISSUERS},
+        aud={"essential": True, "value": client_id},
+        sub={"essential": True},
+        exp={"essential": True},
+    )
+    try:
+        token = jwt.decode(id_token, lambda guest: keys.get(guest.headers().get("kid")),
+                           algorithms=["RS256"])
+        claims_registry.validate(token.claims)
+    except (JoseError, ValueError) as e:
+        raise GoogleAuthError(f"Invalid id_token: {e}")
+    return token.claims
@@ -0,0 +1,28 @@
+"""Gunicorn settings, picked up from the working directory by
+``gunicorn app:app`` and ``gunicorn asgi:application``.
+
+Sets up prometheus_client's multiprocess mode for telemetry.py: the workers
+share PROMETHEUS_MULTIPROC_DIR (a fresh temporary one unless it is set),
+which is emptied when the server starts, and exited workers are marked dead
+so their in-flight gauges drop out of /metrics.
+"""
+import glob
+import os
+import tempfile
+
+# Here rather than in on_starting so it is also set before --preload imports the app
+if not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="geniuspost-metrics-")
+
+
+def on_starting(server):
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    os.makedirs(path, exist_ok=True)
+    # Counters left over from the last run would be added to this one's
+    for name in glob.glob(os.path.join(path, "*.db")):
+        os.remove(name)
+
+
+def child_exit(server, worker):
+    import telemetry
+    telemetry.mark_process_dead(worker.pid)
@@ -0,0 +1,257 @@
+"""Process-wide gateway to the Anthropic API.
+
+Every gunicorn worker keeps exactly one long-lived ``anthropic.Anthropic``
+client backed by a keep-alive connection pool, so requests reuse warm TLS
+connections instead of paying for a new handshake each time.
+
+The gateway also owns:
+  * explicit connect / read timeouts,
+  * bounded retries (the SDK backs off exponentially with jitter and honours
+    ``retry-after``),
+  * a per-process concurrency cap so a burst of generations cannot open an
+    unbounded number of upstream streams.
+
+The asyncio entry point (asgi.py) gets the same treatment through
+``get_async_client()`` / ``async_stream_message()``, with its own, much higher
+cap since an open stream there costs a coroutine rather than a thread.
+
+The OpenAI client used as the secondary provider (providers.py; enabled by
+GPT_APIKEY, with GPT_ORG / GPT_PROJECT) is kept the same way, with its own
+slots so a hedged request never waits behind Claude's.
+"""
+import asyncio
+import os
+import threading
+from contextlib import asynccontextmanager, contextmanager
+
+
+LLM_CONNECT_TIMEOUT = float(os.environ.get("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.environ.get("LLM_READ_TIMEOUT", "60"))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "2"))
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "32"))
+# How long a request may wait for a free upstream slot before we give up
+LLM_QUEUE_TIMEOUT = float(os.environ.get("LLM_QUEUE_TIMEOUT", "10"))
+LLM_KEEPALIVE_EXPIRY = float(os.environ.get("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_ASYNC_MAX_CONCURRENCY = int(os.environ.get("LLM_ASYNC_MAX_CONCURRENCY", "512"))
+# Point the clients somewhere else than api.anthropic.com, e.g. at
+# tools/fake_anthropic.py for load tests; unset means the SDK default
+LLM_BASE_URL = os.environ.get("LLM_BASE_URL") or None
+# Same for the OpenAI clients (e.g. tools/fake_anthropic.py's /v1/chat/completions)
+LLM_OPENAI_BASE_URL = os.environ.get("LLM_OPENAI_BASE_URL") or None
+
+
+class GatewayBusy(Exception):
+    """Raised when no upstream slot frees up within LLM_QUEUE_TIMEOUT."""
+
+
+_lock = threading.Lock()
+_client = None
+_client_pid = None
+_slots = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+_async_client = None
+_async_client_pid = None
+_async_slots = None
+_openai_client = None
+_openai_client_pid = None
+_openai_slots = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+_async_openai_client = None
+_async_openai_client_pid = None
+_async_openai_slots = None
+
+
+# anthropic and httpx are imported on first use rather than at import time:
+# they are a good part of a worker's boot and most requests never need them
+
+def _timeout():
+    import httpx
+    return httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+
+
+def get_client():
+    """Return this process's shared Anthropic client, creating it on first use.
+
+    The client is rebuilt after a fork so workers never share sockets with
+    the gunicorn master.
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+    with _lock:
+        if _client is None or _client_pid != pid:
+            import anthropic
+            import httpx
+            http_client = anthropic.DefaultHttpxClient(
+                timeout=_timeout(),
+                limits=httpx.Limits(
+                    max_connections=LLM_MAX_CONCURRENCY,
+                    max_keepalive_connections=LLM_MAX_CONCURRENCY,
+                    keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+                ),
+            )
+            _client = anthropic.Anthropic(
+                api_key=os.environ["CLAUDE_APIKEY"],
+                base_url=LLM_BASE_URL,
+                http_client=http_client,
+                timeout=_timeout(),
+                max_retries=LLM_MAX_RETRIES,
+            )
+            _client_pid = pid
+    return _client
+
+
+@contextmanager
+def slot(slots=_slots):
+    """Hold one of the LLM_MAX_CONCURRENCY upstream slots."""
+    if not slots.acquire(timeout=LLM_QUEUE_TIMEOUT):
+        raise GatewayBusy("Too many generations in progress, please retry shortly.")
+    try:
+        yield
+    finally:
+        slots.release()
+
+
+@contextmanager
+def stream_message(**params):
+    """``messages.stream`` through the shared client; the slot is held until
+    the stream is closed."""
+    with slot():
+        with get_client().messages.stream(**params) as stream:
+            yield stream
+
+
+def get_async_client():
+    """Return this process's shared AsyncAnthropic client.
+
+    Must be called from the worker's event loop; the underlying connection
+    pool is bound to it.
+    """
+    global _async_client, _async_client_pid, _async_slots
+    pid = os.getpid()
+    if _async_client is None or _async_client_pid != pid:
+        import anthropic
+        import httpx
+        http_client = anthropic.DefaultAsyncHttpxClient(
+            timeout=_timeout(),
+            limits=httpx.Limits(
+                max_connections=LLM_ASYNC_MAX_CONCURRENCY,
+                max_keepalive_connections=LLM_ASYNC_MAX_CONCURRENCY,
+                keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+            ),
+        )
+        _async_client = anthropic.AsyncAnthropic(
+            api_key=os.environ["CLAUDE_APIKEY"],
+            base_url=LLM_BASE_URL,
+            http_client=http_client,
+            timeout=_timeout(),
+            max_retries=LLM_MAX_RETRIES,
+        )
+        _async_slots = asyncio.Semaphore(LLM_ASYNC_MAX_CONCURRENCY)
+        _async_client_pid = pid
+    return _async_client
+
+
+@asynccontextmanager
+async def async_stream_message(**params):
+    """Async counterpart of ``stream_message``."""
+    client = get_async_client()
+    try:
+        await asyncio.wait_for(_async_slots.acquire(), LLM_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise GatewayBusy("Too many generations in progress, please retry shortly.")
+    try:
+        async with client.messages.stream(**params) as stream:
+            yield stream
+    finally:
+        _async_slots.release()
+
+
+########################## OpenAI (secondary provider) ##########################
+
+def openai_configured():
+    return bool(os.environ.get("GPT_APIKEY"))
+
+
+def _openai_options():
+    return dict(
+        api_key=os.environ["GPT_APIKEY"],
+        organization=os.environ.get("GPT_ORG") or None,
+        project=os.environ.get("GPT_PROJECT") or None,
+        base_url=LLM_OPENAI_BASE_URL,
+        timeout=_timeout(),
+        max_retries=LLM_MAX_RETRIES,
+    )
+
+
+def get_openai_client():
+    """This process's shared ``openai.OpenAI`` client (see ``get_client``)."""
+    global _openai_client, _openai_client_pid
+    pid = os.getpid()
+    if _openai_client is not None and _openai_client_pid == pid:
+        return _openai_client
+    with _lock:
+        if _openai_client is None or _openai_client_pid != pid:
+            import httpx
+            import openai
+            http_client = openai.DefaultHttpxClient(
+                timeout=_timeout(),
+                limits=httpx.Limits(
+                    max_connections=LLM_MAX_CONCURRENCY,
+                    max_keepalive_connections=LLM_MAX_CONCURRENCY,
+                    keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+                ),
+            )
+            _openai_client = openai.OpenAI(http_client=http_client, **_openai_options())
+            _openai_client_pid = pid
+    return _openai_client
+
+
+@contextmanager
+def openai_stream(**params):
+    """Streaming ``chat.completions.create``; the slot is held until the
+    stream is closed."""
+    with slot(_openai_slots):
+        stream = get_openai_client().chat.completions.create(stream=True, **params)
+        try:
+            yield stream
+        finally:
+            stream.close()
+
+
+def get_async_openai_client():
+    """This process's shared ``openai.AsyncOpenAI`` client (see ``get_async_client``)."""
+    global _async_openai_client, _async_openai_client_pid, _async_openai_slots
+    pid = os.getpid()
+    if _async_openai_client is None or _async_openai_client_pid != pid:
+        import httpx
+        import openai
+        http_client = openai.DefaultAsyncHttpxClient(
+            timeout=_timeout(),
+            limits=httpx.Limits(
+                max_connections=LLM_ASYNC_MAX_CONCURRENCY,
+                max_keepalive_connections=LLM_ASYNC_MAX_CONCURRENCY,
+                keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+            ),
+        )
+        _async_openai_client = openai.AsyncOpenAI(http_client=http_client, **_openai_options())
+        _async_openai_slots = asyncio.Semaphore(LLM_ASYNC_MAX_CONCURRENCY)
+        _async_openai_client_pid = pid
+    return _async_openai_client
+
+
+@asynccontextmanager
+async def async_openai_stream(**params):
+    """Async counterpart of ``openai_stream``."""
+    client = get_async_openai_client()
+    try:
+        await asyncio.wait_for(_async_openai_slots.acquire(), LLM_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise GatewayBusy("Too many generations in progress, please retry shortly.")
+    try:
+        stream = await client.chat.completions.create(stream=True, **params)
+        try:
+            yield stream
+        finally:
+            await stream.close()
+    finally:
+        _async_openai_slots.release()
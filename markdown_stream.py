@@ -0,0 +1,150 @@
+"""Incremental Markdown to HTML for the generation stream.
+
+Re-rendering the whole growing answer on every chunk costs O(n^2) over a
+long post. ``IncrementalMarkdown`` instead splits the text at block
+boundaries that later text can no longer change, renders each finished
+region once, and only re-renders the unfinished tail. With ``render: "html"``
+the /generate-stream frames carry, next to the raw ``chunk``:
+
+    "html": {"start": 3, "blocks": ["<h2>...</h2>", ...], "tail": "<p>..."}
+
+``blocks`` are finished HTML blocks, the first of them at index ``start``
+(they replace any the client has from there on, so a resumed stream can
+start over at 0); ``tail`` replaces the previous tail. The page is the blocks
+joined by newlines, plus the tail. A region is finished when a blank line
+outside a code fence is followed by a line that cannot continue it (an
+indented line can, and so can a list item after a list or a quote after a
+quote), and an ATX heading is a region of its own unless a table or an
+indented block swallows it.
+
+Reference-style link definitions and raw HTML spanning blank lines can
+change how earlier text renders. When the final HTML differs from
+rendering the whole text at once, the last frame carries ``"reset"`` with the
+full HTML instead.
+"""
+import re
+
+
+MARKDOWN_EXTENSIONS = ["fenced_code", "tables", "sane_lists"]
+
+# As fenced_code sees them: at the start of the line, closed by the same fence
+_FENCE = re.compile(r"(`{3,}|~{3,})")
+_HEADING = re.compile(r"#{1,6}")
+_LIST_ITEM = re.compile(r" {0,3}(?:[*+-]|\d+[.)])(?:[ \t]|$)")
+
+
+def render(text, md=None):
+    """Render a whole Markdown document."""
+    import markdown
+    md = md or markdown.Markdown(extensions=MARKDOWN_EXTENSIONS)
+    return md.reset().convert(text)
+
+
+class IncrementalMarkdown:
+    def __init__(self):
+        # Imported here so the app does not pay for it until a stream asks
+        import markdown
+        self.md = markdown.Markdown(extensions=MARKDOWN_EXTENSIONS)
+        self.text = ""
+        self.blocks = []
+        self.stats = {"renders": 0, "rendered_chars": 0}
+        # Start of the unfinished region and of the next line to scan
+        self._region = 0
+        self._scan = 0
+        self._fence = None
+        # What the region's blocks so far contain ("list", "quote", "table"):
+        # Python-Markdown adds a list item or quote after blank lines to a
+        # list or quote just before it, and a table swallows a heading line
+        self._kinds = set()
+        # An indented block after blank lines goes into the list item before
+        # it, headings included
+        self._new_block = True
+        self._indented_block = False
+        # End of the blank lines that may end the region
+        self._boundary = None
+
+    def _render(self, text):
+        self.stats["renders"] += 1
+        self.stats["rendered_chars"] += len(text)
+        return self.md.reset().convert(text)
+
+    def _finish(self, end):
+        """Render the region up to end as finished blocks."""
+        region = self.text[self._region:end]
+        self._region = end
+        self._boundary = None
+        self._kinds = set()
+        if region.strip():
+            self.blocks.append(self._render(region))
+
+    def _scan_lines(self):
+        while True:
+            newline = self.text.find("\n", self._scan)
+            if newline < 0:
+                return
+            start, self._scan = self._scan, newline + 1
+            line = self.text[start:newline]
+            if self._fence:
+                if line.rstrip(" ") == self._fence:
+                    self._fence = None
+                continue
+            if not line.strip():
+                if self._kinds:
+                    self._boundary = self._scan
+                self._new_block = True
+                continue
+            if self._new_block:
+                self._new_block = False
+                self._indented_block = line[0] in " \t"
+            kinds = set()
+            if _LIST_ITEM.match(line):
+                kinds.add("list")
+            if line.lstrip(" ").startswith(">"):
+                kinds.add("quote")
+            if "|" in line:
+                kinds.add("table")
+            if self._boundary is not None:
+                if line[0] in " \t" or kinds & self._kinds & {"list", "quote"}:
+                    self._boundary = None
+                else:
+                    self._finish(self._boundary)
+            if _HEADING.match(line) and "table" not in self._kinds and not self._indented_block:
+                self._finish(start)
+                self._finish(self._scan)
+                continue
+            # Remembered even for plain lines, so the region counts as started
+            self._kinds |= kinds or {"text"}
+            fence = _FENCE.match(line)
+            if fence:
+                self._fence = fence.group(1)
+
+    def _tail(self):
+        tail = self.text[self._region:]
+        if not tail.strip():
+            return ""
+        if self._fence:
+            # Close the open code block so the preview shows it as code
+            tail += "\n" + self._fence
+        return self._render(tail)
+
+    def feed(self, text, since=None):
+        """Add streamed text; returns the html patch for it, with the blocks
+        from index ``since`` on (by default the ones it finished)."""
+        start = len(self.blocks) if since is None else since
+        self.text += text
+        self._scan_lines()
+        return {"start": start, "blocks": self.blocks[start:], "tail": self._tail()}
+
+    def close(self, since=None):
+        """Finish everything; the patch includes ``reset`` if block-wise
+        rendering came out different from rendering the whole text."""
+        start = len(self.blocks) if since is None else since
+        if not self.text.endswith("\n"):
+            self.text += "\n"
+            self._scan_lines()
+        self._finish(len(self.text))
+        patch = {"start": start, "blocks": self.blocks[start:], "tail": ""}
+        full = self._render(self.text)
+        if full != "\n".join(self.blocks):
+            patch["reset"] = full
+        return patch
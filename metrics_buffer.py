@@ -0,0 +1,227 @@
+"""Write-behind counters for the user_metrics table.
+
+``/track_action`` and login used to load the user's UserMetrics row, bump a
+counter in Python and commit: a database round trip per click, and two
+concurrent clicks could both read 5 and both write 6. ``CounterBuffer``
+instead adds the click to an in-memory delta and a background thread writes
+all pending deltas every METRICS_FLUSH_INTERVAL seconds with one
+``INSERT ... ON CONFLICT (user_id) DO UPDATE SET x = x + excluded.x``, so
+the increment itself happens in the database and nothing is lost.
+
+At most METRICS_BUFFER_MAX_USERS users are buffered per worker; reaching it
+flushes straight away. Pending deltas are also flushed when the worker
+exits. Counts in the table can lag the clicks by up to one interval.
+
+Given a ``totals`` model (name/value rows), every flush also adds to running
+totals of the table in the same transaction - per counter the sum and the
+number of users above zero, plus the number of users with any count - so
+the admin aggregates never have to scan user_metrics. ``rebuild_totals()``
+recomputes them from a full scan (needed once, for rows written before).
+"""
+import atexit
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy.dialects import postgresql, sqlite
+
+
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", "5"))
+METRICS_BUFFER_MAX_USERS = int(os.environ.get("METRICS_BUFFER_MAX_USERS", "5000"))
+
+_UPSERT_DIALECTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+# Rows per INSERT: at a dozen columns this stays below SQLite's limit of
+# 32,766 bound parameters per statement
+_UPSERT_ROWS = 2000
+
+
+def upsert(db, table):
+    insert = _UPSERT_DIALECTS.get(db.engine.dialect.name)
+    if insert is None:
+        raise RuntimeError(f"Upsert not supported on {db.engine.dialect.name}")
+    return insert(table)
+
+
+def add_totals(conn, db, model, deltas):
+    """value += delta for each name in deltas (missing rows start at 0)."""
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    table = model.__table__
+    statement = upsert(db, table).values(
+        [{"name": name, "value": delta} for name, delta in sorted(deltas.items())])
+    conn.execute(statement.on_conflict_do_update(
+        index_elements=[table.c.name],
+        set_={"value": table.c.value + statement.excluded.value},
+    ))
+
+
+def set_totals(conn, db, model, values):
+    table = model.__table__
+    statement = upsert(db, table).values(
+        [{"name": name, "value": value} for name, value in sorted(values.items())])
+    conn.execute(statement.on_conflict_do_update(
+        index_elements=[table.c.name], set_={"value": statement.excluded.value}))
+
+
+class CounterBuffer:
+    def __init__(self, db, model, interval=METRICS_FLUSH_INTERVAL,
+                 max_users=METRICS_BUFFER_MAX_USERS, totals=None):
+        self.app = None
+        self.db = db
+        self.table = model.__table__
+        self.totals = totals
+        self.counters = [c.name for c in self.table.c if c.name.endswith("_count")]
+        self.interval = interval
+        self.max_users = max_users
+        self.stats = {"added": 0, "flushes": 0, "rows_written": 0, "dropped": 0}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pid = None
+        atexit.register(self.flush)
+
+    def init_app(self, app):
+        """Flushes run in this app's context."""
+        self.app = app
+
+    def add(self, user, action):
+        """Count one action ("login", "generate", ...) for user."""
+        self._start()
+        column = f"{action}_count"
+        if column not in self.table.c:
+            raise ValueError(f"Unknown metrics action: {action}")
+        with self._lock:
+            entry = self._pending.get(user.id)
+            if entry is None:
+                entry = self._pending[user.id] = {
+                    "username": user.name, "email": user.email, "counts": {}}
+            entry["counts"][column] = entry["counts"].get(column, 0) + 1
+            entry["updated_at"] = datetime.now(timezone.utc)
+            self.stats["added"] += 1
+            full = len(self._pending) >= self.max_users
+        if full:
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Metrics flush failed: {e}")
+
+    def _start(self):
+        """Start this process's flusher (again after a fork)."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._pending = {}
+            threading.Thread(target=self._flush_loop, daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Metrics flush failed: {e}")
+
+    def flush(self):
+        """Write every pending delta; failed batches are kept for next time."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return
+            try:
+                with self.app.app_context():
+                    self._write(batch)
+            except Exception:
+                self._requeue(batch)
+                raise
+            self.stats["flushes"] += 1
+            self.stats["rows_written"] += len(batch)
+
+    def _write(self, batch):
+        counters = self.counters
+        rows = [
+            dict({c: entry["counts"].get(c, 0) for c in counters},
+                 user_id=user_id, username=entry["username"], email=entry["email"],
+                 updated_at=entry["updated_at"])
+            for user_id, entry in batch.items()
+        ]
+        deltas = {}
+        # One transaction, so a failed batch is written by none of the chunks
+        with self.db.engine.begin() as conn:
+            for start in range(0, len(rows), _UPSERT_ROWS):
+                statement = upsert(self.db, self.table).values(rows[start:start + _UPSERT_ROWS])
+                statement = statement.on_conflict_do_update(
+                    index_elements=[self.table.c.user_id],
+                    set_=dict(
+                        {c: self.db.func.coalesce(self.table.c[c], 0) + statement.excluded[c]
+                         for c in counters},
+                        updated_at=statement.excluded.updated_at,
+                    ),
+                )
+                if self.totals is not None:
+                    statement = statement.returning(self.table.c.user_id,
+                                                    *[self.table.c[c] for c in counters])
+                result = conn.execute(statement)
+                if self.totals is not None:
+                    self._total_deltas(result, batch, deltas)
+            if self.totals is not None:
+                add_totals(conn, self.db, self.totals, deltas)
+
+    def _total_deltas(self, result, batch, deltas):
+        """Add to deltas what these rows add to the totals, from their new values."""
+        name = self.table.name
+        for row in result.mappings():
+            counts = batch[row["user_id"]]["counts"]
+            newly_active = True
+            for c in self.counters:
+                delta = counts.get(c, 0)
+                before = (row[c] or 0) - delta
+                if before > 0:
+                    newly_active = False
+                deltas[f"{name}.{c}"] = deltas.get(f"{name}.{c}", 0) + delta
+                if before <= 0 < delta:
+                    deltas[f"{name}.{c}.users"] = deltas.get(f"{name}.{c}.users", 0) + 1
+            if newly_active:
+                deltas[f"{name}.users"] = deltas.get(f"{name}.users", 0) + 1
+
+    def rebuild_totals(self):
+        """Recompute the totals with a full scan of the table.
+
+        On Postgres the table is locked against writes meanwhile, so a flush
+        waits instead of adding to totals that are about to be replaced.
+        """
+        name = self.table.name
+        func = self.db.func
+        columns = [func.count().filter(
+            self.db.or_(*[self.table.c[c] > 0 for c in self.counters]))]
+        for c in self.counters:
+            columns += [func.coalesce(func.sum(self.table.c[c]), 0),
+                        func.count().filter(self.table.c[c] > 0)]
+        with self.db.engine.begin() as conn:
+            if conn.dialect.name == "postgresql":
+                conn.execute(self.db.text(f"LOCK TABLE {name} IN SHARE MODE"))
+            row = list(conn.execute(self.db.select(*columns)).one())
+            values = {f"{name}.users": row.pop(0), f"{name}.rebuilt_at": int(time.time())}
+            for c in self.counters:
+                values[f"{name}.{c}"] = row.pop(0)
+                values[f"{name}.{c}.users"] = row.pop(0)
+            set_totals(conn, self.db, self.totals, values)
+        return values
+
+    def _requeue(self, batch):
+        with self._lock:
+            for user_id, entry in batch.items():
+                current = self._pending.get(user_id)
+                if current is None:
+                    if len(self._pending) >= self.max_users:
+                        self.stats["dropped"] += sum(entry["counts"].values())
+                        continue
+                    self._pending[user_id] = entry
+                    continue
+                for column, delta in entry["counts"].items():
+                    current["counts"][column] = current["counts"].get(column, 0) + delta
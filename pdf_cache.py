@@ -0,0 +1,190 @@
+"""Content-addressed cache of rendered PDFs.
+
+Users export the same carousel again and again (retries, a second device, a
+double click), so finished renders are kept on local disk keyed on a hash of
+the content, template and captured styles plus ``RENDERER_VERSION``. A hit is
+hard-linked into the job's result file without touching WeasyPrint.
+
+The index is a SQLite table shared by every worker on the host. Once the
+files add up to more than PDF_CACHE_MAX_BYTES the least recently used ones
+are evicted; PDF_CACHE_MAX_BYTES=0 disables the cache.
+
+RENDERER_VERSION changes whenever pdf_render.py, pdf_images.py (or its
+PDF_IMAGE_* settings) or the WeasyPrint version changes, so stale renders
+stop matching on their own; ``invalidate()`` also deletes them, and runs at
+startup.
+"""
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import time
+import uuid
+from importlib import metadata
+
+import pdf_images
+
+
+PDF_CACHE_DIR = os.environ.get("PDF_CACHE_DIR", "/tmp/geniuspost-pdf-cache")
+PDF_CACHE_MAX_BYTES = int(os.environ.get("PDF_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+
+def _renderer_version():
+    """Changes with any edit to pdf_render.py or pdf_images.py, the
+    WeasyPrint version, the parser, the section or the image settings. Worked out from
+    the files, so the web worker never imports WeasyPrint (or Pillow) just
+    to find out."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    parts = [
+        metadata.version("weasyprint").encode(),
+        os.environ.get("PDF_HTML_PARSER", "html.parser").encode(),
+        os.environ.get("PDF_SECTION_MIN_CHARS", "50").encode(),
+        str(pdf_images.PDF_IMAGE_MAX_WIDTH).encode(),
+        str(pdf_images.PDF_IMAGE_JPEG_QUALITY).encode(),
+    ]
+    for name in ("pdf_render.py", "pdf_images.py"):
+        with open(os.path.join(here, name), "rb") as source:
+            parts.append(source.read())
+    return hashlib.sha256(b"\0".join(parts)).hexdigest()[:16]
+
+
+RENDERER_VERSION = _renderer_version()
+
+
+def make_key(content, template, styles, mode="single", version=RENDERER_VERSION):
+    payload = json.dumps(
+        {"content": content, "template": template, "styles": styles, "mode": mode,
+         "version": version},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _link_or_copy(source, dest):
+    try:
+        os.link(source, dest)
+    except OSError:
+        # Different filesystem, or no hard links there
+        shutil.copyfile(source, dest)
+
+
+class PDFCache:
+    def __init__(self, directory=PDF_CACHE_DIR, max_bytes=PDF_CACHE_MAX_BYTES,
+                 version=RENDERER_VERSION):
+        self.directory = directory
+        self.db_path = os.path.join(directory, "index.sqlite3")
+        self.max_bytes = max_bytes
+        self.version = version
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS pdf_cache ("
+                " key TEXT PRIMARY KEY,"
+                " version TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " last_used REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS pdf_cache_last_used ON pdf_cache (last_used)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=5)
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.pdf")
+
+    def fetch(self, key, dest):
+        """Link a cached render to dest; returns False on a miss."""
+        with self._connect() as conn:
+            found = conn.execute(
+                "UPDATE pdf_cache SET last_used = ? WHERE key = ? AND version = ?",
+                (time.time(), key, self.version),
+            ).rowcount
+        if found:
+            try:
+                _link_or_copy(self.path(key), dest)
+                self.stats["hits"] += 1
+                return True
+            except FileNotFoundError:
+                # Evicted by another worker in the meantime
+                self._delete([key])
+        self.stats["misses"] += 1
+        return False
+
+    def store(self, key, source):
+        """Add a finished render (source stays where it is)."""
+        tmp_path = os.path.join(self.directory, f".{uuid.uuid4().hex}.part")
+        _link_or_copy(source, tmp_path)
+        os.replace(tmp_path, self.path(key))
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO pdf_cache VALUES (?, ?, ?, ?)",
+                (key, self.version, os.path.getsize(source), time.time()),
+            )
+        self._evict()
+
+    def _evict(self):
+        with self._connect() as conn:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM pdf_cache").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            evicted = []
+            for key, size in conn.execute(
+                "SELECT key, size FROM pdf_cache ORDER BY last_used"
+            ).fetchall():
+                if total <= self.max_bytes:
+                    break
+                evicted.append(key)
+                total -= size
+        self._delete(evicted)
+        self.stats["evictions"] += len(evicted)
+
+    def _delete(self, keys):
+        with self._connect() as conn:
+            conn.executemany("DELETE FROM pdf_cache WHERE key = ?", [(k,) for k in keys])
+        for key in keys:
+            try:
+                os.unlink(self.path(key))
+            except FileNotFoundError:
+                pass
+
+    def invalidate(self, everything=False):
+        """Drop renders made by another renderer version (or all of them).
+
+        Call with everything=True after changing something the version hash
+        does not cover, e.g. the font files themselves.
+        """
+        with self._connect() as conn:
+            if everything:
+                rows = conn.execute("SELECT key FROM pdf_cache").fetchall()
+            else:
+                rows = conn.execute(
+                    "SELECT key FROM pdf_cache WHERE version != ?", (self.version,)
+                ).fetchall()
+        keys = [row[0] for row in rows]
+        self._delete(keys)
+        return len(keys)
+
+    def report(self):
+        with self._connect() as conn:
+            entries, size = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pdf_cache"
+            ).fetchone()
+        return dict(self.stats, entries=entries, bytes=size, max_bytes=self.max_bytes,
+                    version=self.version)
+
+
+def from_env():
+    """Build the cache, or None when PDF_CACHE_MAX_BYTES is 0."""
+    if PDF_CACHE_MAX_BYTES <= 0:
+        return None
+    cache = PDFCache()
+    dropped = cache.invalidate()
+    if dropped:
+        print(f"PDF cache: dropped {dropped} renders from older renderer versions")
+    return cache
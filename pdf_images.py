@@ -0,0 +1,182 @@
+"""Embedded image normalization before WeasyPrint.
+
+Images added with the editor's image insert arrive in the export inlined as
+base64 data URIs at their original resolution, but the export CSS never
+draws an image wider than PDF_IMAGE_MAX_WIDTH (1004px). WeasyPrint runs
+with optimize_images=False, so it decoded every copy at full size and
+embedded the full pixels; a PNG photo went in as deflated raw pixels.
+
+``normalize_images()`` decodes each distinct image once, applies its EXIF
+orientation, downscales it to PDF_IMAGE_MAX_WIDTH and re-encodes it: JPEG
+for photos, PNG for images with transparency or few colours (screenshots,
+diagrams). The original stays when the result is not smaller, or when
+Pillow cannot read it (SVG, animations). Identical images come out as the
+same data URI, which WeasyPrint loads and embeds once.
+
+Results are kept in a per-process LRU of PDF_IMAGE_CACHE_MB keyed by a hash
+of the image data, so re-exporting the same carousel skips the work.
+"""
+import base64
+import hashlib
+import io
+import math
+import os
+import re
+import threading
+from collections import OrderedDict
+
+
+PDF_IMAGE_MAX_WIDTH = int(os.environ.get("PDF_IMAGE_MAX_WIDTH", "1004"))
+PDF_IMAGE_JPEG_QUALITY = int(os.environ.get("PDF_IMAGE_JPEG_QUALITY", "85"))
+PDF_IMAGE_CACHE_MB = float(os.environ.get("PDF_IMAGE_CACHE_MB", "64"))
+
+# An image with at most this many colours in a sample of its pixels is
+# kept lossless: JPEG blurs the text and edges of screenshots
+_LOSSLESS_COLOURS = 1024
+_SAMPLE_SIZE = (96, 96)
+_EXIF_ORIENTATION = 0x0112
+
+_DATA_URI = re.compile(
+    r'(<img\b[^>]*?\ssrc\s*=\s*)(["\'])data:(image/[\w.+-]+);base64,([^"\'<>]*)\2',
+    re.I)
+
+stats = {"images": 0, "duplicates": 0, "cache_hits": 0, "normalized": 0, "resized": 0,
+         "kept": 0, "errors": 0, "bytes_in": 0, "bytes_out": 0}
+
+_cache = OrderedDict()
+_cache_bytes = 0
+_lock = threading.Lock()
+
+
+def _has_alpha(image):
+    if image.mode in ("RGBA", "LA"):
+        # Plenty of photos carry an alpha channel that is opaque everywhere
+        return image.getchannel("A").getextrema()[0] < 255
+    return "transparency" in image.info
+
+
+def _normalize(mime, data):
+    """The (mime type, bytes) to embed for one image."""
+    from PIL import Image, ImageOps
+
+    image = Image.open(io.BytesIO(data))
+    if getattr(image, "n_frames", 1) > 1:
+        return mime, data
+    source = image.format
+    orientation = image.getexif().get(_EXIF_ORIENTATION, 1)
+    width, height = image.size
+    if orientation in (5, 6, 7, 8):
+        # Drawn rotated by 90 degrees
+        width, height = height, width
+    resized = width > PDF_IMAGE_MAX_WIDTH
+    if resized:
+        scale = PDF_IMAGE_MAX_WIDTH / width
+        width, height = PDF_IMAGE_MAX_WIDTH, max(1, round(height * scale))
+        # JPEGs decode straight at a fraction of their size (DCT scaling)
+        image.draft(None, tuple(math.ceil(side * scale) for side in image.size))
+    if orientation > 1:
+        image = ImageOps.exif_transpose(image)
+    if resized:
+        # Bicubic: about twice as fast as Lanczos, the same at these ratios
+        image = image.resize((width, height), Image.BICUBIC, reducing_gap=3.0)
+    if image.mode not in ("1", "L", "LA", "P", "RGB", "RGBA"):
+        # CMYK and the like: converting would shift the colours
+        return mime, data
+
+    icc_profile = image.info.get("icc_profile")
+    alpha = _has_alpha(image)
+    lossless = source != "JPEG" and (alpha or image.resize(
+        _SAMPLE_SIZE, Image.NEAREST).getcolors(_LOSSLESS_COLOURS) is not None)
+    out = io.BytesIO()
+    if lossless:
+        if not alpha and image.mode in ("LA", "RGBA"):
+            image = image.convert(image.mode[:-1])
+        image.save(out, "PNG", icc_profile=icc_profile)
+        new_mime = "image/png"
+    else:
+        image = image.convert("L" if image.mode in ("1", "L", "LA") else "RGB")
+        image.save(out, "JPEG", quality=PDF_IMAGE_JPEG_QUALITY, optimize=True,
+                   icc_profile=icc_profile)
+        new_mime = "image/jpeg"
+    encoded = out.getvalue()
+    if resized or len(encoded) < len(data):
+        if resized:
+            stats["resized"] += 1
+        return new_mime, encoded
+    return mime, data
+
+
+def _remember(key, src):
+    global _cache_bytes
+    with _lock:
+        if key in _cache:
+            return
+        _cache[key] = src
+        _cache_bytes += len(src)
+        while _cache_bytes > PDF_IMAGE_CACHE_MB * 1024 * 1024 and _cache:
+            _, evicted = _cache.popitem(last=False)
+            _cache_bytes -= len(evicted)
+
+
+def _cached(key):
+    with _lock:
+        src = _cache.get(key)
+        if src is not None:
+            _cache.move_to_end(key)
+        return src
+
+
+def clear_cache():
+    global _cache_bytes
+    with _lock:
+        _cache.clear()
+        _cache_bytes = 0
+
+
+def normalized_src(mime, payload):
+    """The data URI to use instead of data:<mime>;base64,<payload>."""
+    payload = "".join(payload.split())
+    key = hashlib.sha256(payload.encode("ascii")).digest()
+    src = _cached(key)
+    if src is not None:
+        stats["cache_hits"] += 1
+        return src
+    original = f"data:{mime};base64,{payload}"
+    if mime.lower() == "image/svg+xml":
+        # Vector: nothing to downscale
+        return original
+    try:
+        data = base64.b64decode(payload, validate=True)
+        new_mime, encoded = _normalize(mime.lower(), data)
+    except Exception as e:
+        print(f"Image normalization error: {e}")
+        stats["errors"] += 1
+        src = original
+    else:
+        if encoded is data:
+            stats["kept"] += 1
+            src = original
+        else:
+            stats["normalized"] += 1
+            src = f"data:{new_mime};base64,{base64.b64encode(encoded).decode('ascii')}"
+    stats["bytes_in"] += len(original)
+    stats["bytes_out"] += len(src)
+    _remember(key, src)
+    return src
+
+
+def normalize_images(content):
+    """Replace the data URI images in content with normalized ones."""
+    seen = {}
+
+    def replace(match):
+        prefix, quote, mime, payload = match.groups()
+        stats["images"] += 1
+        if payload in seen:
+            stats["duplicates"] += 1
+            src = seen[payload]
+        else:
+            src = seen[payload] = normalized_src(mime, payload)
+        return f"{prefix}{quote}{src}{quote}"
+
+    return _DATA_URI.sub(replace, content)
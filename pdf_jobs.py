@@ -0,0 +1,464 @@
+"""Asynchronous PDF export jobs.
+
+``POST /pdf-jobs`` queues a render and returns a job id. Clients poll
+``/pdf-jobs/<id>`` and fetch ``/pdf-jobs/<id>/download`` once it is done, so a
+slow WeasyPrint layout never ties up a request thread.
+
+Renders run on a bounded process pool (PDF_RENDER_WORKERS per web worker),
+each one cut off after PDF_JOB_TIMEOUT seconds. At most PDF_QUEUE_LIMIT jobs
+may be queued or running on the host; past that ``submit()`` raises
+``QueueFull`` and the route answers 429 with a Retry-After estimate.
+
+The queue is a SQLite database in PDF_JOBS_DIR, next to the finished PDFs,
+so jobs queued before a worker restart are picked up again and jobs left
+"running" by a dead worker are retried.
+
+With a ``pdf_cache.PDFCache``, a submit whose render is already cached is
+finished on the spot, and fresh renders are added to the cache.
+
+Jobs submitted with mode="sections" are cut into slide-sized sections
+(``pdf_render.split_sections``) that are laid out in parallel on the pool
+and merged into one PDF, so a long carousel uses more than one core. Raise
+PDF_RENDER_WORKERS towards the core count to get the most out of it.
+"""
+import json
+import math
+import multiprocessing
+import os
+import signal
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import pdf_cache
+
+
+PDF_JOBS_DIR = os.environ.get("PDF_JOBS_DIR", "/tmp/geniuspost-pdf-jobs")
+PDF_RENDER_WORKERS = int(os.environ.get("PDF_RENDER_WORKERS", "2"))
+PDF_QUEUE_LIMIT = int(os.environ.get("PDF_QUEUE_LIMIT", "20"))
+PDF_JOB_TIMEOUT = float(os.environ.get("PDF_JOB_TIMEOUT", "60"))
+PDF_RESULT_TTL = float(os.environ.get("PDF_RESULT_TTL", "3600"))
+# How long /generate-pdf waits for its job (queueing included)
+PDF_SYNC_WAIT = float(os.environ.get("PDF_SYNC_WAIT", "120"))
+PDF_JOB_MAX_ATTEMPTS = 2
+# Default export mode when the request does not pick one
+PDF_RENDER_MODE = os.environ.get("PDF_RENDER_MODE", "single")
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+# single: one WeasyPrint pass. sections: one pass per slide-sized section,
+# in parallel on the pool, merged afterwards
+RENDER_MODES = ("single", "sections")
+
+
+class QueueFull(Exception):
+    def __init__(self, retry_after):
+        super().__init__("PDF export queue is full, please retry shortly.")
+        self.retry_after = retry_after
+
+
+class RenderTimeout(Exception):
+    pass
+
+
+@contextmanager
+def _time_limit(timeout):
+    """Hard time limit for work in a pool process."""
+    def expire(signum, frame):
+        raise RenderTimeout(f"PDF render took longer than {timeout:.0f}s")
+
+    previous = signal.signal(signal.SIGALRM, expire)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+@contextmanager
+def _writing(result_path):
+    """Yield a temporary path that becomes result_path on success."""
+    partial_path = result_path + ".part"
+    try:
+        yield partial_path
+        os.replace(partial_path, result_path)
+    finally:
+        if os.path.exists(partial_path):
+            os.unlink(partial_path)
+
+
+# pdf_render (WeasyPrint, bs4, pypdf) is only imported in the pool processes,
+# where the forkserver preloads it; the web worker never needs it
+
+def _warm_up():
+    import pdf_render
+    pdf_render.warm_up()
+
+
+def _render_job(payload, timeout, result_path):
+    """Runs in a pool process: render with a hard per-job time limit.
+
+    The PDF is written straight to its result file, so the bytes never
+    travel back through the web worker.
+    """
+    import pdf_render
+    with _time_limit(timeout), _writing(result_path) as partial_path:
+        pdf_render.render_pdf(target=partial_path, **payload)
+
+
+def _split_job(content, timeout):
+    import pdf_render
+    with _time_limit(timeout):
+        return pdf_render.split_sections(content)
+
+
+def _merge_job(paths, timeout, result_path):
+    import pdf_render
+    with _time_limit(timeout), _writing(result_path) as partial_path:
+        pdf_render.merge_pdfs(paths, partial_path)
+
+
+def _alive(pid):
+    """Whether a process with this pid exists on the host."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    def __init__(self, directory=PDF_JOBS_DIR, workers=PDF_RENDER_WORKERS,
+                 limit=PDF_QUEUE_LIMIT, timeout=PDF_JOB_TIMEOUT, cache=None):
+        self.directory = directory
+        self.results_dir = os.path.join(directory, "results")
+        self.db_path = os.path.join(directory, "jobs.sqlite3")
+        self.workers = workers
+        self.limit = limit
+        self.timeout = timeout
+        self.cache = cache
+        os.makedirs(self.results_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS pdf_jobs ("
+                " id TEXT PRIMARY KEY,"
+                " status TEXT NOT NULL,"
+                " payload TEXT,"
+                " filename TEXT NOT NULL,"
+                " error TEXT,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " created_at REAL NOT NULL,"
+                " started_at REAL,"
+                " finished_at REAL,"
+                " owner_pid INTEGER)"
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(pdf_jobs)")}
+            if "owner_pid" not in columns:
+                conn.execute("ALTER TABLE pdf_jobs ADD COLUMN owner_pid INTEGER")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS pdf_jobs_status ON pdf_jobs (status, created_at)"
+            )
+        self._pid = None
+        self._pool = None
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(workers)
+        self._wake = threading.Event()
+        self._finished = {}
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    ########################## Web-facing API ##########################
+
+    def submit(self, content, template, styles, base_url, mode=PDF_RENDER_MODE):
+        """Queue a render and return its job id, or raise QueueFull."""
+        if mode not in RENDER_MODES:
+            raise ValueError(f"Unknown PDF render mode: {mode}")
+        self.start()
+        job_id = uuid.uuid4().hex
+        payload = json.dumps({"content": content, "template": template,
+                              "styles": styles, "base_url": base_url, "mode": mode})
+        filename = f"carousel-{template}-{int(time.time())}.pdf"
+        if self.cache is not None and self.cache.fetch(
+                pdf_cache.make_key(content, template, styles, mode), self.result_path(job_id)):
+            now = time.time()
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT INTO pdf_jobs (id, status, filename, created_at, finished_at)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (job_id, DONE, filename, now, now),
+                )
+            return job_id
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            depth = conn.execute(
+                "SELECT COUNT(*) FROM pdf_jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)
+            ).fetchone()[0]
+            if depth >= self.limit:
+                conn.execute("ROLLBACK")
+                raise QueueFull(self._retry_after(conn, depth))
+            conn.execute(
+                "INSERT INTO pdf_jobs (id, status, payload, filename, created_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (job_id, QUEUED, payload, filename, time.time()),
+            )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        self._wake.set()
+        return job_id
+
+    def get(self, job_id):
+        """Job status as a dict (without the payload), or None."""
+        self.start()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT id AS job_id, status, filename, error, created_at, started_at, finished_at"
+                " FROM pdf_jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def result_path(self, job_id):
+        return os.path.join(self.results_dir, f"{job_id}.pdf")
+
+    def wait(self, job_id, timeout):
+        """Block until the job is done or failed (or timeout passes)."""
+        deadline = time.monotonic() + timeout
+        event = self._finished.setdefault(job_id, threading.Event())
+        try:
+            while True:
+                job = self.get(job_id)
+                if job is None or job["status"] in (DONE, FAILED):
+                    return job
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return job
+                # Another web worker may finish it, so poll now and then too
+                event.wait(min(remaining, 0.5))
+        finally:
+            self._finished.pop(job_id, None)
+
+    def _retry_after(self, conn, depth):
+        row = conn.execute(
+            "SELECT AVG(finished_at - started_at) FROM ("
+            " SELECT finished_at, started_at FROM pdf_jobs"
+            " WHERE status = ? AND started_at IS NOT NULL"
+            " ORDER BY finished_at DESC LIMIT 20)", (DONE,)
+        ).fetchone()
+        average = row[0] or 5.0
+        return max(1, math.ceil(average * depth / max(self.workers, 1)))
+
+    ########################## Dispatcher ##########################
+
+    def start(self):
+        """Start this process's pool and dispatcher (again after a fork)."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._pool = None
+            self._slots = threading.Semaphore(self.workers)
+            self._requeue_stale(starting=True)
+            threading.Thread(target=self._dispatch_loop, daemon=True).start()
+
+    def _get_pool(self):
+        # Called from the dispatcher and from _render_sections threads
+        with self._lock:
+            if self._pool is None:
+                context = multiprocessing.get_context("forkserver")
+                context.set_forkserver_preload(["pdf_render"])
+                self._pool = ProcessPoolExecutor(
+                    self.workers, mp_context=context, initializer=_warm_up)
+            return self._pool
+
+    def _dispatch_loop(self):
+        last_cleanup = 0.0
+        while True:
+            self._slots.acquire()
+            try:
+                job = self._claim()
+            except Exception as e:
+                print(f"PDF job claim failed: {e}")
+                job = None
+            if job is None:
+                self._slots.release()
+                if time.time() - last_cleanup > 60:
+                    self._cleanup()
+                    last_cleanup = time.time()
+                self._wake.wait(1.0)
+                self._wake.clear()
+                continue
+            try:
+                payload = json.loads(job["payload"])
+                mode = payload.pop("mode", "single")
+                cache_key = pdf_cache.make_key(
+                    payload["content"], payload["template"], payload["styles"], mode)
+                if mode == "sections":
+                    threading.Thread(
+                        target=self._render_sections,
+                        args=(job["id"], payload, cache_key), daemon=True).start()
+                    continue
+                future = self._get_pool().submit(
+                    _render_job, payload, self.timeout, self.result_path(job["id"]))
+            except Exception as e:
+                self._complete(job["id"], error=e)
+                continue
+            future.add_done_callback(
+                lambda f, job_id=job["id"], key=cache_key: self._on_rendered(job_id, f, key))
+
+    def _render_sections(self, job_id, payload, cache_key):
+        """Lay out each section on its own pool process, then merge the pages.
+
+        Holds the job's dispatcher slot throughout, but uses as many pool
+        processes as there are sections.
+        """
+        result_path = self.result_path(job_id)
+        part_paths, renders = [], []
+        outcome = Future()
+        try:
+            pool = self._get_pool()
+            sections = pool.submit(_split_job, payload["content"], self.timeout).result()
+            part_paths = [f"{result_path}.{i}" for i in range(len(sections))]
+            renders = [
+                pool.submit(_render_job, dict(payload, content=section, preprocessed=True,
+                                              first_page_footer=(i == 0)),
+                            self.timeout, part_path)
+                for i, (section, part_path) in enumerate(zip(sections, part_paths))
+            ]
+            for render in renders:
+                render.result()
+            if len(part_paths) == 1:
+                os.replace(part_paths[0], result_path)
+            else:
+                pool.submit(_merge_job, part_paths, self.timeout, result_path).result()
+        except Exception as e:
+            outcome.set_exception(e)
+        else:
+            outcome.set_result(None)
+        finally:
+            # Let sibling renders finish before their files are removed
+            wait(renders)
+            for part_path in part_paths:
+                if os.path.exists(part_path):
+                    os.unlink(part_path)
+        self._on_rendered(job_id, outcome, cache_key)
+
+    def _claim(self):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id, payload FROM pdf_jobs WHERE status = ?"
+                " ORDER BY created_at LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE pdf_jobs SET status = ?, started_at = ?, attempts = attempts + 1,"
+                " owner_pid = ? WHERE id = ?", (RUNNING, time.time(), os.getpid(), row["id"])
+            )
+            conn.execute("COMMIT")
+            return row
+        finally:
+            conn.close()
+
+    def _on_rendered(self, job_id, future, cache_key=None):
+        try:
+            future.result()
+        except BrokenProcessPool as e:
+            # A render process died (e.g. OOM); start a fresh pool next time
+            with self._lock:
+                self._pool = None
+            self._complete(job_id, error=e)
+        except Exception as e:
+            self._complete(job_id, error=e)
+        else:
+            if self.cache is not None:
+                try:
+                    self.cache.store(cache_key, self.result_path(job_id))
+                except Exception as e:
+                    print(f"PDF cache store failed for job {job_id}: {e}")
+            self._complete(job_id)
+
+    def _complete(self, job_id, error=None):
+        try:
+            if error is None:
+                status, message = DONE, None
+            else:
+                print(f"PDF job {job_id} failed: {error}")
+                status, message = FAILED, str(error) or error.__class__.__name__
+            with self._connect() as conn:
+                conn.execute(
+                    "UPDATE pdf_jobs SET status = ?, error = ?, finished_at = ?, payload = NULL"
+                    " WHERE id = ?", (status, message, time.time(), job_id)
+                )
+        finally:
+            self._slots.release()
+            event = self._finished.get(job_id)
+            if event is not None:
+                event.set()
+
+    def _requeue_stale(self, starting=False):
+        """Retry jobs a dead worker left behind in the running state.
+
+        A job is stale once the web worker that claimed it is gone: a
+        sections job (split, one render per section, merge) can run far
+        longer than one render. When starting, jobs under this process's
+        own pid were claimed by an earlier process that had it. Jobs from
+        before owner_pid was recorded fall back to a time limit.
+        """
+        stale_before = time.time() - (2 * self.timeout + 30)
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, attempts, started_at, owner_pid FROM pdf_jobs WHERE status = ?",
+                (RUNNING,),
+            ).fetchall()
+            for row in rows:
+                if row["owner_pid"] is None:
+                    if row["started_at"] >= stale_before:
+                        continue
+                elif _alive(row["owner_pid"]) and not (
+                        starting and row["owner_pid"] == os.getpid()):
+                    continue
+                if row["attempts"] >= PDF_JOB_MAX_ATTEMPTS:
+                    conn.execute(
+                        "UPDATE pdf_jobs SET status = ?, error = 'render worker died',"
+                        " finished_at = ?, payload = NULL WHERE id = ? AND status = ?",
+                        (FAILED, time.time(), row["id"], RUNNING),
+                    )
+                else:
+                    conn.execute(
+                        "UPDATE pdf_jobs SET status = ? WHERE id = ? AND status = ?",
+                        (QUEUED, row["id"], RUNNING),
+                    )
+
+    def _cleanup(self):
+        expired = time.time() - PDF_RESULT_TTL
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id FROM pdf_jobs WHERE status IN (?, ?) AND finished_at < ?",
+                (DONE, FAILED, expired),
+            ).fetchall()
+            for row in rows:
+                try:
+                    os.unlink(self.result_path(row["id"]))
+                except FileNotFoundError:
+                    pass
+            conn.execute(
+                "DELETE FROM pdf_jobs WHERE status IN (?, ?) AND finished_at < ?",
+                (DONE, FAILED, expired),
+            )
+        self._requeue_stale()
@@ -0,0 +1,721 @@
+"""PDF rendering for carousel exports.
+
+Kept free of Flask and the database so the PDF job workers (pdf_jobs.py) can
+import it in their own processes.
+"""
+import bisect
+import os
+import re
+import threading
+
+from weasyprint import DEFAULT_OPTIONS, HTML, CSS
+from weasyprint.text.fonts import FontConfiguration
+from bs4 import BeautifulSoup, Tag
+from pypdf import PdfWriter
+
+import pdf_images
+import telemetry
+
+
+STATIC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), 'static'))
+FONTS_DIR = os.path.join(STATIC_DIR, 'fonts')
+
+# 'lxml' parses much faster; html.parser stays the default because lxml
+# repairs invalid nesting (e.g. <ul> inside <p>) differently
+PDF_HTML_PARSER = os.environ.get('PDF_HTML_PARSER', 'html.parser')
+_INDEXED_TAGS = ('p', 'ul', 'ol', 'li', 'pre', 'br', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6')
+
+# Variable font-face declarations with absolute file paths
+FONT_FACE_CSS = f"""
+    /* Variable Font Definitions for PDF */
+    @font-face {{
+        font-family: 'Inter';
+        src: url('file://{FONTS_DIR}/Inter-VariableFont.ttf') format('truetype');
+        font-weight: 100 900;
+        font-style: normal;
+    }}
+    @font-face {{
+        font-family: 'Inter';
+        src: url('file://{FONTS_DIR}/Inter-Italic-VariableFont.ttf') format('truetype');
+        font-weight: 100 900;
+        font-style: italic;
+    }}
+
+    @font-face {{
+        font-family: 'JetBrains Mono';
+        src: url('file://{FONTS_DIR}/JetBrainsMono-VariableFont.ttf') format('truetype');
+        font-weight: 100 800;
+        font-style: normal;
+    }}
+    @font-face {{ 
+        font-family: 'JetBrains Mono';
+        src: url('file://{FONTS_DIR}/JetBrainsMono-Italic-VariableFont.ttf') format('truetype');
+        font-weight: 100 800;
+        font-style: italic;
+    }}
+
+    @font-face {{
+        font-family: 'Playfair Display';
+        src: url('file://{FONTS_DIR}/PlayfairDisplay-VariableFont.ttf') format('truetype');
+        font-weight: 400 900;
+        font-style: normal;
+    }}
+    @font-face {{
+        font-family: 'Playfair Display';
+        src: url('file://{FONTS_DIR}/PlayfairDisplay-Italic-VariableFont.ttf') format('truetype');
+        font-weight: 400 900;
+        font-style: italic;
+    }}
+
+    @font-face {{
+        font-family: 'Space Grotesk';
+        src: url('file://{FONTS_DIR}/SpaceGrotesk-VariableFont.ttf') format('truetype');
+        font-weight: 300 700;
+        font-style: normal;
+    }}
+
+    @font-face {{
+        font-family: 'Crimson Pro';
+        src: url('file://{FONTS_DIR}/CrimsonPro-VariableFont.ttf') format('truetype');
+        font-weight: 200 900;
+        font-style: normal;
+    }}
+    @font-face {{
+        font-family: 'Crimson Pro';
+        src: url('file://{FONTS_DIR}/CrimsonPro-Italic-VariableFont.ttf') format('truetype');
+        font-weight: 200 900;
+        font-style: italic;
+    }}
+
+    @font-face {{
+        font-family: 'Fraunces';
+        src: url('file://{FONTS_DIR}/Fraunces-VariableFont.ttf') format('truetype');
+        font-weight: 100 900;
+        font-style: normal;
+    }}
+    @font-face {{
+        font-family: 'Fraunces';
+        src: url('file://{FONTS_DIR}/Fraunces-Italic-VariableFont.ttf') format('truetype');
+        font-weight: 100 900;
+        font-style: italic;
+    }}
+
+    @font-face {{
+        font-family: 'Open Sans';
+        src: url('file://{FONTS_DIR}/OpenSans-VariableFont.ttf') format('truetype');
+        font-weight: 300 800;
+        font-style: normal;
+    }}
+    @font-face {{
+        font-family: 'Open Sans';
+        src: url('file://{FONTS_DIR}/OpenSans-Italic-VariableFont.ttf') format('truetype');
+        font-weight: 300 800;
+        font-style: italic;
+    }}
+
+    /* Static fonts */
+    @font-face {{
+        font-family: 'Kalam';
+        src: url('file://{FONTS_DIR}/Kalam-Light.ttf') format('truetype');
+        font-weight: 300;
+        font-style: normal;
+    }}
+    @font-face {{
+        font-family: 'Kalam';
+        src: url('file://{FONTS_DIR}/Kalam-Regular.ttf') format('truetype');
+        font-weight: 400;
+        font-style: normal;
+    }}
+    @font-face {{
+        font-family: 'Kalam';
+        src: url('file://{FONTS_DIR}/Kalam-Bold.ttf') format('truetype');
+        font-weight: 700;
+        font-style: normal;
+    }}
+"""
+
+# PDF page control: fixed page size and the first-page footer
+PAGE_CSS = """
+    /* PDF PAGE CONTROL - CUSTOM SIZE */
+    @page {
+        size: 1080px 1350px;
+        margin: 8px;
+        padding: 0px;
+    }
+    
+    /* ✅ FIRST PAGE ONLY - Footer */
+    @page :first {
+        margin: 8px 8px 30px 8px; 
+        
+        @bottom-center {
+            content: "Generated with GeniusPost AI";
+            font-family: 'Space Grotesk', Arial, sans-serif;
+            font-size: 18px;
+            font-weight: 700;
+            color: #2c3e50;
+            background: rgba(255,255,255,0.9);
+            padding: 8px 16px;
+            border-radius: 20px;
+            letter-spacing: 1px;
+            text-transform: uppercase;
+            box-shadow: 0 2px 8px rgba(0,0,0,0.15);
+            margin-top: 5px;
+        }
+    }
+"""
+
+# Overrides PAGE_CSS (author rules beat write_pdf() stylesheets)
+NO_FOOTER_CSS = """
+    /* Later section of a split render: no first-page footer */
+    @page :first {
+        margin: 8px;
+        @bottom-center { content: none; }
+    }
+"""
+
+# A new section starts at these top-level tags and at forced page breaks
+SECTION_TAGS = ('h1', 'h2')
+# Sections with less text than this and no image go with the one before
+# them: hashtag lines and one-line closers rather than slides
+PDF_SECTION_MIN_CHARS = int(os.environ.get('PDF_SECTION_MIN_CHARS', '50'))
+_FORCED_BREAK = re.compile(r'(?:page-)?break-(before|after)\s*:\s*(?:always|page)', re.I)
+
+_local = threading.local()
+
+
+def get_render_config():
+    """This thread's FontConfiguration and the precompiled font/page stylesheet.
+
+    Building them means parsing the @font-face rules and loading all the
+    TTFs in static/fonts into fontconfig, so it happens once per render
+    thread instead of once per PDF. WeasyPrint also skips fonts a
+    FontConfiguration has already loaded, which covers @font-face rules
+    repeated in the captured styles.
+    """
+    config = getattr(_local, 'config', None)
+    if config is None:
+        font_config = FontConfiguration()
+        stylesheet = CSS(string=FONT_FACE_CSS + PAGE_CSS, font_config=font_config)
+        config = _local.config = (font_config, [stylesheet])
+    return config
+
+
+def warm_up():
+    """Pool initializer: pay for font loading before the first job arrives."""
+    get_render_config()
+    telemetry.export_stats("pdf_images", lambda: pdf_images.stats)
+
+
+def create_enhanced_pdf_html(content, template, captured_styles='',
+                             first_page_footer=True, preprocessed=False):
+    """Create complete HTML document for PDF generation.
+
+    Fonts and @page rules are not inlined: they come precompiled from
+    get_render_config(). Sections after the first of a split render pass
+    first_page_footer=False, and already preprocessed content.
+    """
+    
+    # Element rules stay inline: write_pdf() stylesheets have user origin,
+    # where their !important rules would beat the captured styles below
+    complete_template_styles = f"""
+    <style>
+        /* BASIC PDF LAYOUT - NO FONT OVERRIDES */
+        * {{
+            box-sizing: border-box;
+            margin: 0;
+            padding: 0;
+        }}
+        
+        html, body {{
+            width: 1064px;
+            margin: 0 !important;
+            padding: 0px !important;
+            /* NO font-family here - let captured styles handle it */
+        }}
+        
+        .pdf-container {{
+            width: 1064px;
+            margin: 0;
+            padding: 0;
+            position: relative;
+        }}
+        
+        .template-base {{
+            width: 1064px !important;
+            min-height: 1324px !important;
+            margin: 0 !important;
+            padding: 30px !important;
+            position: relative;
+            box-sizing: border-box;
+            page-break-inside: auto;
+        }}
+        
+        /* 🔥 PAGE BREAK CONTROLS - NO FONT OVERRIDES */
+        h1, h2, h3, h4, h5, h6 {{
+            page-break-after: auto !important;
+            page-break-inside: avoid;
+            page-break-before: auto;
+            margin-top: 20px;
+            margin-bottom: 15px;
+            orphans: 2;
+            widows: 2;
+        }}
+
+        p {{
+            page-break-inside: auto;
+            orphans: 2;
+            widows: 2;
+            margin-bottom: 12px;
+            line-height: 1.6;
+            /* NO font-family - let captured styles handle it */
+        }}
+        
+        ul, ol {{
+            page-break-inside: auto;
+            margin: 15px 0;
+        }}
+        
+        li {{
+            page-break-inside: auto;
+            orphans: 2;
+            widows: 2;
+            margin-bottom: 8px;
+            /* NO font-family - let captured styles handle it */
+        }}
+        
+        blockquote {{
+            page-break-inside: auto;
+            margin: 20px 0;
+            padding: 15px 20px;
+            border-left: 4px solid #ddd;
+            background: #f9f9f9;
+            orphans: 2;
+            widows: 2;
+        }}
+        
+        table {{
+            page-break-inside: auto;
+            margin: 20px 0;
+            width: 100%;
+            border-collapse: collapse;
+        }}
+        
+        thead {{
+            page-break-after: avoid;
+        }}
+        
+        tbody tr {{
+            page-break-inside: avoid;
+            page-break-after: auto;
+        }}
+        
+        th, td {{
+            padding: 12px;
+            border: 1px solid #ddd;
+            vertical-align: top;
+            /* NO font-family - let captured styles handle it */
+        }}
+        
+        th {{
+            font-weight: 600;
+            /* NO font-family - let captured styles handle it */
+        }}
+        
+        img {{
+            max-width: 1004px !important;
+            width: 100% !important;
+            height: auto !important;
+            display: block !important;
+            page-break-inside: avoid;
+            page-break-before: auto;
+            page-break-after: auto;
+            margin: 20px auto !important;
+            object-fit: contain !important;
+            border-radius: 16px !important;
+            position: relative !important;
+        }}
+        
+        div {{
+            page-break-inside: auto;
+        }}
+        
+        /* CAPTURED STYLES - This handles all fonts and styling */
+        {captured_styles}
+        
+        /* 🔥 MINIMAL OVERRIDES - Only fix what breaks in PDF */
+        @import {{ display: none !important; }}
+        
+        /* Only override code fonts (functional requirement) */
+        pre, code {{
+            font-family: 'JetBrains Mono', 'Courier New', monospace !important;
+        }}
+        
+        /* Print optimization */
+        * {{
+            -webkit-print-color-adjust: exact !important;
+            color-adjust: exact !important;
+        }}
+        {'' if first_page_footer else NO_FOOTER_CSS}
+    </style>
+    """
+    
+    # Preprocess content for better page breaks
+    processed_content = content if preprocessed else preprocess_content_for_pdf(content)
+    
+    return f"""
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <meta charset="UTF-8">
+        <title>Carousel PDF - {template}</title>
+        {complete_template_styles}
+    </head>
+    <body>
+        <div class="pdf-container">
+            <div class="{template}-template template-base">
+                {processed_content}
+            </div>
+        </div>
+    </body>
+    </html>
+    """
+
+
+def _index_tags(soup):
+    """One walk over the tree: (start, end, tag) for the tags preprocessing
+    cares about, grouped by name in document order. start/end number the
+    tag and its last descendant, so a subtree is the range start..end."""
+    found = {name: [] for name in _INDEXED_TAGS}
+    open_tags = []
+    position = 0
+    stack = [iter(soup.contents)]
+    while stack:
+        child = next(stack[-1], None)
+        if child is None:
+            stack.pop()
+            if open_tags:
+                record = open_tags.pop()
+                if record is not None:
+                    record[1] = position - 1
+            continue
+        if not isinstance(child, Tag):
+            continue
+        record = None
+        if child.name in found:
+            record = [position, None, child]
+            found[child.name].append(record)
+        position += 1
+        open_tags.append(record)
+        stack.append(iter(child.contents))
+    return found
+
+
+def _outside(records, removed):
+    """records (in document order) that are not inside a removed subtree"""
+    removed = sorted(removed)
+    kept = []
+    i = 0
+    reach = -1
+    for record in records:
+        while i < len(removed) and removed[i][0] <= record[0]:
+            reach = max(reach, removed[i][1])
+            i += 1
+        if record[0] > reach:
+            kept.append(record)
+    return kept
+
+
+def _apply_edits(edits):
+    """Apply (tag, new tags to insert before it, remove tag) edits, given in
+    document order, back to front. Tag.insert_before() and extract() look
+    the tag up with Tag.index(), a linear scan of its siblings, which made
+    long documents quadratic; going backwards, each parent's child
+    positions only need to be listed once."""
+    positions = {}
+    for tag, before, remove in reversed(edits):
+        parent = tag.parent
+        index = positions.get(id(parent))
+        if index is None:
+            index = positions[id(parent)] = {
+                id(child): i for i, child in enumerate(parent.contents)
+            }
+        i = index[id(tag)]
+        for new_tag in before:
+            parent.insert(i, new_tag)
+            i += 1
+        if remove:
+            tag.extract(_self_index=i)
+            tag.decompose()
+
+
+def _parse(content):
+    if PDF_HTML_PARSER == 'html.parser':
+        return BeautifulSoup(content, 'html.parser'), None
+    soup = BeautifulSoup(content, PDF_HTML_PARSER)
+    # lxml wraps fragments in <html><head>/<body>; keep only what's inside
+    return soup, [part for part in (soup.head, soup.body) if part is not None]
+
+
+def preprocess_content_for_pdf(content):
+    """
+    Preprocess HTML content to optimize for PDF page breaks
+
+    The tree is walked once to find the tags below. Each rule then visits
+    only those tags, in the same order as before, skipping the ones inside
+    a subtree an earlier rule replaced, and its edits are applied in one
+    batch (see _apply_edits).
+    """
+    
+    try:
+        soup, parts = _parse(content)
+        tags = _index_tags(soup)
+        removed = []
+        
+        # 🔥 SMART CONTENT SPLITTING
+        
+        # Find very long paragraphs and add soft breaks
+        edits = []
+        blank_paragraphs = []
+        for record in _outside(tags['p'], removed):
+            if removed and record[0] <= removed[-1][1]:
+                continue  # inside a paragraph being split
+            p = record[2]
+            text = p.get_text()
+            if not text.strip():
+                blank_paragraphs.append(record)
+            if len(text) > 800:  # Long paragraphs
+                p['class'] = p.get('class', []) + ['long-content']
+                
+                # Split very long paragraphs at sentence boundaries
+                if len(text) > 1200:  # Very long content
+                    sentences = text.split('. ')
+                    if len(sentences) > 3:
+                        # Split into smaller paragraphs
+                        p.clear()
+                        mid_point = len(sentences) // 2
+                        
+                        # First half
+                        first_half = '. '.join(sentences[:mid_point]) + '.'
+                        first_p = soup.new_tag('p', **{'class': 'long-content'})
+                        first_p.string = first_half
+                        
+                        # Second half  
+                        second_half = '. '.join(sentences[mid_point:])
+                        if not second_half.endswith('.'):
+                            second_half += '.'
+                        second_p = soup.new_tag('p', **{'class': 'long-content'})
+                        second_p.string = second_half
+                        
+                        # Replace original paragraph
+                        edits.append((p, (first_p, second_p), True))
+                        removed.append(record)
+        _apply_edits(edits)
+        
+        # 🔥 OPTIMIZE LISTS FOR PAGE BREAKS
+        items = _outside(tags['li'], removed)
+        item_starts = [record[0] for record in items]
+        for start, end, _ in _outside(sorted(tags['ul'] + tags['ol']), removed):
+            # Every <li> below this list, nested lists included
+            first = bisect.bisect_right(item_starts, start)
+            last = bisect.bisect_right(item_starts, end)
+            if last - first > 8:  # Long lists
+                # Add page break hints every 6-8 items
+                for i in range(7, last - first, 7):  # Every 7th item
+                    item = items[first + i][2]
+                    item['style'] = item.get('style', '') + ' page-break-before: auto;'
+        
+        # 🔥 HANDLE LARGE CODE BLOCKS
+        edits = []
+        split_pres = []
+        for record in _outside(tags['pre'], removed):
+            if split_pres and record[0] <= split_pres[-1][1]:
+                continue  # inside a code block being split
+            pre = record[2]
+            code_text = pre.get_text()
+            if len(code_text) > 1000:  # Long code blocks
+                # Add line break opportunities
+                lines = code_text.split('\n')
+                if len(lines) > 25:  # Many lines
+                    # Split into smaller code blocks
+                    pre.clear()
+                    chunk_size = 20
+                    replacement = []
+                    
+                    for i in range(0, len(lines), chunk_size):
+                        chunk_lines = lines[i:i + chunk_size]
+                        new_pre = soup.new_tag('pre')
+                        new_pre.string = '\n'.join(chunk_lines)
+                        
+                        if i > 0:  # Add spacing between chunks
+                            spacing = soup.new_tag('div', style='height: 10px;')
+                            replacement.append(spacing)
+                        
+                        replacement.append(new_pre)
+                    
+                    edits.append((pre, replacement, True))
+                    split_pres.append(record)
+        _apply_edits(edits)
+        removed += split_pres
+        
+        # 🔥 ADD SMART BREAK OPPORTUNITIES
+        
+        # Add break opportunities after every few headings
+        headings = _outside(sorted(
+            record for name in ('h1', 'h2', 'h3', 'h4', 'h5', 'h6') for record in tags[name]
+        ), removed)
+        edits = []
+        for i, (_, _, heading) in enumerate(headings):
+            if i > 0 and i % 3 == 0:  # Every 3rd heading
+                # Add a subtle break opportunity
+                break_div = soup.new_tag('div', **{
+                    'class': 'page-break-opportunity',
+                    'style': 'page-break-before: auto; height: 1px;'
+                })
+                edits.append((heading, (break_div,), False))
+        _apply_edits(edits)
+        
+        # 🔥 REMOVE EXCESSIVE WHITE SPACE
+        
+        # Remove multiple consecutive <br> tags
+        edits = []
+        for _, _, br in _outside(tags['br'], removed):
+            next_sibling = br.next_sibling
+            if next_sibling and next_sibling.name == 'br':
+                edits.append((br, (), True))
+        _apply_edits(edits)
+        
+        # Clean up empty paragraphs (split paragraphs are never empty)
+        edits = []
+        dropped_end = -1
+        for start, end, p in _outside(blank_paragraphs, removed):
+            if start <= dropped_end:
+                continue  # inside a paragraph being dropped
+            if not p.find('img'):
+                edits.append((p, (), True))
+                dropped_end = end
+        _apply_edits(edits)
+        
+        if parts is None:
+            return str(soup)
+        return ''.join(part.decode_contents() for part in parts)
+    
+    except Exception as e:
+        print(f"Content preprocessing error: {e}")
+        return content  # Return original content if preprocessing fails
+
+
+# 🔥 ENHANCED WEASYPRINT CONFIGURATION
+def render_options():
+    """This thread's FontConfiguration and the WeasyPrint options for every
+    export (also used by benchmarks/pdf_pipeline.py)."""
+    font_config, stylesheets = get_render_config()
+    options = DEFAULT_OPTIONS.copy()
+    options.update(
+        # pdf_images.normalize_images() already downscaled and re-encoded them
+        optimize_images=False,
+        presentational_hints=True,
+        # 🔥 ENHANCED SETTINGS FOR BETTER PAGE BREAKING
+        stylesheets=stylesheets,
+        attachments=[],
+        # Additional WeasyPrint options for better rendering
+        uncompressed_pdf=False,  # Keep file size reasonable
+        pdf_version='1.7',       # Modern PDF version
+    )
+    return font_config, options
+
+
+def render_pdf(content, template='tech-neural', styles='', base_url=None, target=None,
+               first_page_footer=True, preprocessed=False):
+    """Render carousel content to PDF.
+
+    Returns the PDF bytes straight from WeasyPrint's in-memory buffer, or
+    writes them to target (a path or file object) and returns None.
+    """
+    if not preprocessed:
+        with telemetry.pdf_phase('images'):
+            content = pdf_images.normalize_images(content)
+        with telemetry.pdf_phase('preprocess'):
+            content = preprocess_content_for_pdf(content)
+    # Create the complete HTML document with smart page breaks
+    with telemetry.pdf_phase('html'):
+        full_html = create_enhanced_pdf_html(
+            content, template, styles, first_page_footer, preprocessed=True)
+    
+    font_config, options = render_options()
+    # HTML.write_pdf() is render() + Document.write_pdf(); calling them
+    # separately times layout and PDF writing on their own
+    with telemetry.pdf_phase('layout'):
+        document = HTML(
+            string=full_html, 
+            base_url=base_url,
+            encoding='utf-8'
+        ).render(font_config, None, **options)
+    with telemetry.pdf_phase('write'):
+        return document.write_pdf(target, 1, None, **options)
+
+
+def _is_filler(node):
+    """Whitespace, or the break hint preprocessing puts before headings"""
+    if not isinstance(node, Tag):
+        return not str(node).strip()
+    return node.name == 'div' and 'page-break-opportunity' in node.get('class', [])
+
+
+def split_sections(content):
+    """Normalize images in and preprocess content, and cut it into
+    slide-sized sections that can be laid out independently: a section
+    starts at every top-level <h1>/<h2> and at every forced page break,
+    unless it would hold no image and less than PDF_SECTION_MIN_CHARS of text.
+    Returns the HTML of each section."""
+    with telemetry.pdf_phase('images'):
+        content = pdf_images.normalize_images(content)
+    with telemetry.pdf_phase('preprocess'):
+        content = preprocess_content_for_pdf(content)
+    soup = BeautifulSoup(content, 'html.parser')
+    sections = [[]]
+    break_after = False
+    for node in list(soup.contents):
+        forced = None
+        if isinstance(node, Tag):
+            match = _FORCED_BREAK.search(node.get('style', ''))
+            forced = match.group(1) if match else None
+        starts = break_after or forced == 'before' or (
+            isinstance(node, Tag) and node.name in SECTION_TAGS)
+        current = sections[-1]
+        if starts and not all(_is_filler(n) for n in current):
+            # Break hints and whitespace go along with the new section
+            carried = []
+            while _is_filler(current[-1]):
+                carried.insert(0, current.pop())
+            sections.append(carried)
+        sections[-1].append(node)
+        break_after = forced == 'after'
+    # A fragment (a closing hashtag line, a short "Bonus") would otherwise
+    # come out on a page of its own; a short first section takes the next
+    merged, lengths = [], []
+    for section in sections:
+        length = sum(len(node.get_text(strip=True)) if isinstance(node, Tag)
+                     else len(node.strip()) for node in section)
+        if any(isinstance(node, Tag) and (node.name == 'img' or node.find('img'))
+               for node in section):
+            length += PDF_SECTION_MIN_CHARS
+        if merged and min(length, lengths[-1]) < PDF_SECTION_MIN_CHARS:
+            merged[-1].extend(section)
+            lengths[-1] += length
+        else:
+            merged.append(section)
+            lengths.append(length)
+    return [''.join(node.decode() if isinstance(node, Tag) else node.output_ready()
+                    for node in section)
+            for section in merged]
+
+
+def merge_pdfs(paths, target):
+    """Concatenate the PDFs at paths, in order, into target"""
+    with telemetry.pdf_phase('merge'):
+        writer = PdfWriter()
+        for path in paths:
+            writer.append(path)
+        writer.write(target)
+    writer.close()
+
@@ -0,0 +1,73 @@
+"""What /generate and /generate-stream (and asgi.py) send to Claude.
+
+The fixed instructions are a system block marked with
+``cache_control: ephemeral`` and the user's prompt is the only message, so
+every request starts with the same prefix and Anthropic can serve it from
+its prompt cache (cheaper input tokens and a shorter time to first token)
+instead of appending the instructions to each prompt.
+
+Anthropic only caches a prefix of at least 1024 tokens on Sonnet and Opus
+models (2048 on Haiku); anything shorter is processed normally and the
+usage shows no cache tokens. The instructions below are far shorter, so the
+marker only starts paying off once they (or few-shot examples) grow past
+that. ``log_usage()`` prints and counts cache reads and writes for every
+call, which shows whether it does.
+"""
+import telemetry
+
+
+SYSTEM_PROMPT = 'Important: 1) Dont give unnecessary information. 2) Sound as human-like as possible. Understand when to be creative, formal, casual, or smart. 3) Always use headings and subheadings unless mentioned otherwise. 4) Always split the code into smaller chunks.'
+
+SYSTEM = [{"type": "text", "text": SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}]
+
+CLAUDE_PARAMS = {
+    "model": "claude-sonnet-4-20250514",
+    "max_tokens": 1200,
+    "temperature": 1,
+}
+
+# The secondary provider (providers.py); OpenAI caches long prefixes on its own
+OPENAI_PARAMS = {
+    "model": "gpt-4o-mini",
+    "max_tokens": CLAUDE_PARAMS["max_tokens"],
+    "temperature": 0.7,
+}
+
+
+def message_params(prompt):
+    """Keyword arguments for messages.create()/stream() for a user prompt."""
+    return dict(CLAUDE_PARAMS, system=SYSTEM, messages=[{"role": "user", "content": prompt}])
+
+
+def openai_params(prompt):
+    """The same request for ``chat.completions.create(stream=True)``."""
+    return dict(OPENAI_PARAMS, stream_options={"include_usage": True}, messages=[
+        {"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}])
+
+
+def variant_prompt(prompt, style):
+    """One version of prompt for /generate-variants, in the given style or tone."""
+    return f"{prompt}\n\nWrite this version in this style or tone: {style}"
+
+
+def cache_params():
+    """What besides the prompt decides the answer (for response_cache keys)."""
+    return dict(CLAUDE_PARAMS, system=SYSTEM_PROMPT)
+
+
+def log_usage(usage, provider="anthropic"):
+    """Print and count a response's input tokens, split into uncached,
+    read from the prompt cache and written to it (Anthropic's usage fields)."""
+    if usage is None:
+        return
+    tokens = {
+        "uncached": getattr(usage, "input_tokens", 0) or 0,
+        "cache_read": getattr(usage, "cache_read_input_tokens", 0) or 0,
+        "cache_creation": getattr(usage, "cache_creation_input_tokens", 0) or 0,
+    }
+    for kind, count in tokens.items():
+        if count:
+            telemetry.LLM_INPUT_TOKENS.labels(provider, kind).inc(count)
+    print(f"{provider} usage: input={tokens['uncached']} cache_read={tokens['cache_read']} "
+          f"cache_creation={tokens['cache_creation']} "
+          f"output={getattr(usage, 'output_tokens', 0) or 0}")
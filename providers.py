@@ -0,0 +1,545 @@
+"""LLM providers behind /generate and /generate-stream: Claude first,
+gpt-4o-mini as the secondary, with first-token hedging and circuit breakers.
+
+``stream(prompt)`` (and ``astream(prompt)`` for asgi.py) yields the
+answer's text deltas:
+
+* Claude is asked first. If it has produced no text LLM_HEDGE_AFTER
+  seconds later, or fails before its first text, the same prompt also goes
+  to the secondary and whichever streams first wins; the other request is
+  closed. An answer always comes from a single provider, so a failure after
+  the first text is raised rather than failed over.
+* Each provider has a ``CircuitBreaker`` over its last LLM_BREAKER_WINDOW
+  calls. Once at least LLM_BREAKER_MIN_CALLS of them are in and the error
+  share reaches LLM_BREAKER_ERROR_RATE, the provider is skipped for
+  LLM_BREAKER_COOLDOWN seconds and then gets one probe call. While Claude's
+  breaker is open the secondary serves alone (and is hedged with nothing).
+  A provider is still tried when it is the only one left, since failing
+  the request outright would not be better.
+
+The secondary is enabled by GPT_APIKEY; without it there is nothing to
+hedge to and ``stream()`` reads Claude on the calling thread as before.
+Breakers and counters are per process; the counters are exported to
+/metrics as ``llm_providers`` and ``llm_breaker_<name>`` (telemetry.py).
+"""
+import asyncio
+import os
+import queue
+import threading
+import time
+import types
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+import llm_gateway
+import prompts
+
+
+LLM_HEDGE_AFTER = float(os.environ.get("LLM_HEDGE_AFTER", "3"))
+LLM_BREAKER_WINDOW = int(os.environ.get("LLM_BREAKER_WINDOW", "20"))
+LLM_BREAKER_MIN_CALLS = int(os.environ.get("LLM_BREAKER_MIN_CALLS", "5"))
+LLM_BREAKER_ERROR_RATE = float(os.environ.get("LLM_BREAKER_ERROR_RATE", "0.5"))
+LLM_BREAKER_COOLDOWN = float(os.environ.get("LLM_BREAKER_COOLDOWN", "30"))
+
+stats = {"streams": 0, "hedged_on_deadline": 0, "hedged_on_error": 0,
+         "won_primary": 0, "won_secondary": 0, "failed": 0}
+
+# Returned by a provider stream once it is complete
+END = object()
+
+
+class CircuitBreaker:
+    """Closed -> open on a high error rate -> one probe after the cooldown.
+
+    Every call carries the ticket it was let through with, ``(probe,
+    epoch)``; the epoch moves whenever the breaker opens or closes. Only the
+    probe moves an open breaker, and results of calls that started in an
+    earlier epoch are ignored.
+    """
+
+    def __init__(self, window=LLM_BREAKER_WINDOW, min_calls=LLM_BREAKER_MIN_CALLS,
+                 error_rate=LLM_BREAKER_ERROR_RATE, cooldown=LLM_BREAKER_COOLDOWN):
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        self.outcomes = deque(maxlen=window)
+        self.opened_at = None
+        self.probing = False
+        self.epoch = 0
+        self.stats = {"opened": 0, "rejected": 0, "probes": 0, "errors": 0}
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.cooldown or self.probing:
+            return "open"
+        return "half_open"
+
+    def allow(self):
+        """The ticket for calling the provider now, or None; in half-open
+        state only the first caller gets through, as the probe."""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return (False, self.epoch)
+            if state == "half_open":
+                self.probing = True
+                self.stats["probes"] += 1
+                return (True, self.epoch)
+            self.stats["rejected"] += 1
+            return None
+
+    def ticket(self):
+        """A ticket for a call made regardless of the state (the last
+        provider left); it counts only while the breaker stays closed."""
+        return (False, self.epoch)
+
+    def _move(self, opened):
+        self.opened_at = time.monotonic() if opened else None
+        self.outcomes.clear()
+        self.epoch += 1
+        if opened:
+            self.stats["opened"] += 1
+
+    def record(self, ok, ticket):
+        """ok: True/False for a finished or failed call, None when the call
+        ended without a verdict (cancelled, or our own queue was full)."""
+        probe, epoch = ticket
+        with self._lock:
+            if probe:
+                self.probing = False
+            if ok is None:
+                return
+            if not ok:
+                self.stats["errors"] += 1
+            if probe:
+                # The probe decides: close (with a clean window) or open again
+                if epoch == self.epoch:
+                    self._move(opened=not ok)
+                return
+            if self.opened_at is not None or epoch != self.epoch:
+                # Started before the breaker last opened or closed
+                return
+            self.outcomes.append(ok)
+            failures = self.outcomes.count(False)
+            if (len(self.outcomes) >= self.min_calls
+                    and failures / len(self.outcomes) >= self.error_rate):
+                self._move(opened=True)
+
+
+########################## Providers ##########################
+
+class _AnthropicStream:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def texts(self):
+        return (text for text in self.stream.text_stream if text)
+
+    async def atexts(self):
+        async for text in self.stream.text_stream:
+            if text:
+                yield text
+
+    def usage(self):
+        snapshot = getattr(self.stream, "current_message_snapshot", None)
+        return getattr(snapshot, "usage", None)
+
+    def close(self):
+        self.stream.close()
+
+
+class _OpenAIStream:
+    def __init__(self, stream):
+        self.stream = stream
+        self._usage = None
+
+    def _text(self, chunk):
+        if chunk.usage is not None:
+            self._usage = chunk.usage
+        if chunk.choices:
+            return chunk.choices[0].delta.content
+
+    def texts(self):
+        for chunk in self.stream:
+            text = self._text(chunk)
+            if text:
+                yield text
+
+    async def atexts(self):
+        async for chunk in self.stream:
+            text = self._text(chunk)
+            if text:
+                yield text
+
+    def usage(self):
+        """The usage in Anthropic's terms, for prompts.log_usage()"""
+        usage = self._usage
+        if usage is None:
+            return None
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", 0) or 0
+        return types.SimpleNamespace(
+            input_tokens=usage.prompt_tokens - cached, cache_read_input_tokens=cached,
+            cache_creation_input_tokens=0, output_tokens=usage.completion_tokens)
+
+    def close(self):
+        self.stream.close()
+
+
+class AnthropicProvider:
+    name = "anthropic"
+
+    @contextmanager
+    def open(self, prompt):
+        with llm_gateway.stream_message(**prompts.message_params(prompt)) as stream:
+            yield _AnthropicStream(stream)
+
+    @asynccontextmanager
+    async def aopen(self, prompt):
+        async with llm_gateway.async_stream_message(**prompts.message_params(prompt)) as stream:
+            yield _AnthropicStream(stream)
+
+
+class OpenAIProvider:
+    name = "openai"
+
+    @contextmanager
+    def open(self, prompt):
+        with llm_gateway.openai_stream(**prompts.openai_params(prompt)) as stream:
+            yield _OpenAIStream(stream)
+
+    @asynccontextmanager
+    async def aopen(self, prompt):
+        async with llm_gateway.async_openai_stream(**prompts.openai_params(prompt)) as stream:
+            yield _OpenAIStream(stream)
+
+
+PROVIDERS = [AnthropicProvider()]
+if llm_gateway.openai_configured():
+    PROVIDERS.append(OpenAIProvider())
+breakers = {provider.name: CircuitBreaker() for provider in PROVIDERS}
+
+
+def _plan():
+    """Providers to use, in order, for the next generation: those whose
+    breaker is not open, or the primary alone if all of them are."""
+    return [provider for provider in PROVIDERS
+            if breakers[provider.name].state != "open"] or PROVIDERS[:1]
+
+
+def _take(pending):
+    """Pop the next provider whose breaker lets a call through (the probe
+    of a half-open one may have been taken in the meantime), as
+    ``(provider, ticket)``."""
+    while pending:
+        provider = pending.pop(0)
+        ticket = breakers[provider.name].allow()
+        if ticket is not None:
+            return provider, ticket
+    return None
+
+
+def _first(pending):
+    """``_take()``, falling back to the primary when no breaker allows a call."""
+    return _take(pending) or (PROVIDERS[0], breakers[PROVIDERS[0].name].ticket())
+
+
+def _verdict(error):
+    # A full local queue says nothing about the provider
+    return None if isinstance(error, llm_gateway.GatewayBusy) else False
+
+
+class _Attempt:
+    def __init__(self, provider, ticket):
+        self.provider = provider
+        self.ticket = ticket
+        self.stream = None
+        self.closed = False
+        self.failed = False
+        self.recorded = False
+        self.started = time.perf_counter()
+
+    def record(self, ok):
+        """Report the call to its breaker, once (a probe must end either way)."""
+        if not self.recorded:
+            self.recorded = True
+            breakers[self.provider.name].record(ok, self.ticket)
+
+    def output_tokens(self):
+        return getattr(self.stream.usage(), "output_tokens", 0) if self.stream else 0
+
+
+########################## Threads ##########################
+
+class HedgedStream:
+    """Iterate for the text deltas; ``close()`` (from any thread) closes
+    every upstream request still open."""
+
+    def __init__(self, prompt):
+        self.prompt = prompt
+        self.winner = None
+        self._attempts = []
+        self._events = queue.Queue()
+        self._closed = False
+
+    def _start(self, provider, ticket):
+        attempt = _Attempt(provider, ticket)
+        if self._closed:
+            attempt.record(None)
+            return
+        self._attempts.append(attempt)
+        threading.Thread(target=self._pump, args=(attempt,), daemon=True).start()
+
+    def _pump(self, attempt):
+        item, ok = END, None
+        try:
+            with attempt.provider.open(self.prompt) as stream:
+                attempt.stream = stream
+                try:
+                    if not attempt.closed:
+                        for text in stream.texts():
+                            self._events.put((attempt, text))
+                finally:
+                    prompts.log_usage(stream.usage(), attempt.provider.name)
+            ok = True
+        except Exception as e:
+            item, ok = e, _verdict(e)
+        finally:
+            # Also when closed during open(): ends a probe, wakes _hedged()
+            attempt.record(None if attempt.closed else ok)
+            self._events.put((attempt, item))
+
+    def _close(self, attempt):
+        attempt.closed = True
+        if attempt.stream is not None:
+            try:
+                attempt.stream.close()
+            except Exception:
+                pass
+
+    def close(self):
+        self._closed = True
+        for attempt in list(self._attempts):
+            self._close(attempt)
+        # Wake _hedged(), which may be waiting for an attempt still in open()
+        self._events.put((None, END))
+
+    def output_tokens(self):
+        return self.winner.output_tokens() if self.winner else 0
+
+    def __iter__(self):
+        stats["streams"] += 1
+        pending = _plan()
+        first, ticket = _first(pending)
+        if not pending:
+            return self._single(first, ticket)
+        return self._hedged(first, ticket, pending)
+
+    def _single(self, provider, ticket):
+        # Nothing to hedge to: read on this thread, no handoff
+        attempt = self.winner = _Attempt(provider, ticket)
+        attempt.closed = self._closed
+        self._attempts.append(attempt)
+        try:
+            with provider.open(self.prompt) as stream:
+                attempt.stream = stream
+                try:
+                    if not attempt.closed:
+                        yield from stream.texts()
+                finally:
+                    prompts.log_usage(stream.usage(), provider.name)
+        except GeneratorExit:
+            attempt.record(None)
+            raise
+        except Exception as e:
+            attempt.record(None if attempt.closed else _verdict(e))
+            if not attempt.closed:
+                stats["failed"] += 1
+            raise
+        attempt.record(None if attempt.closed else True)
+
+    def _hedged(self, first, ticket, pending):
+        self._start(first, ticket)
+        deadline = time.monotonic() + LLM_HEDGE_AFTER
+        errors = []
+        try:
+            while True:
+                timeout = None
+                if self.winner is None and pending:
+                    timeout = max(0.0, deadline - time.monotonic())
+                try:
+                    attempt, item = self._events.get(timeout=timeout)
+                except queue.Empty:
+                    if self._closed:
+                        return
+                    taken = _take(pending)
+                    if taken is not None:
+                        stats["hedged_on_deadline"] += 1
+                        self._start(*taken)
+                    continue
+                if self._closed:
+                    return
+                if self.winner is None:
+                    if isinstance(item, Exception):
+                        attempt.failed = True
+                        errors.append(item)
+                        taken = _take(pending)
+                        if taken is not None:
+                            stats["hedged_on_error"] += 1
+                            self._start(*taken)
+                        elif all(a.failed for a in self._attempts):
+                            raise errors[0]
+                        continue
+                    self.winner = attempt
+                    stats["won_primary" if attempt.provider is first else "won_secondary"] += 1
+                    for other in self._attempts:
+                        if other is not attempt:
+                            self._close(other)
+                if attempt is not self.winner:
+                    continue
+                if item is END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        except Exception:
+            stats["failed"] += 1
+            raise
+        finally:
+            self.close()
+
+
+def stream(prompt):
+    """A ``HedgedStream`` over the configured providers."""
+    return HedgedStream(prompt)
+
+
+def from_primary(stream):
+    """Whether a finished (Async)HedgedStream's answer came from the primary.
+    The response cache is keyed on Claude's parameters, so only those
+    answers go into it."""
+    return stream.winner is not None and stream.winner.provider is PROVIDERS[0]
+
+
+########################## asyncio ##########################
+
+class AsyncHedgedStream:
+    """``HedgedStream`` for the event loop: ``async for`` the text deltas."""
+
+    def __init__(self, prompt):
+        self.prompt = prompt
+        self.winner = None
+        self._attempts = []
+        self._tasks = []
+        self._events = asyncio.Queue()
+
+    def _start(self, provider, ticket):
+        attempt = _Attempt(provider, ticket)
+        self._attempts.append(attempt)
+        task = asyncio.ensure_future(self._pump(attempt))
+        # A task cancelled before it ran never enters _pump()
+        task.add_done_callback(lambda task: attempt.record(None))
+        self._tasks.append(task)
+
+    async def _pump(self, attempt):
+        try:
+            async with attempt.provider.aopen(self.prompt) as stream:
+                attempt.stream = stream
+                try:
+                    async for text in stream.atexts():
+                        await self._events.put((attempt, text))
+                finally:
+                    prompts.log_usage(stream.usage(), attempt.provider.name)
+        except asyncio.CancelledError:
+            attempt.record(None)
+            raise
+        except Exception as e:
+            attempt.record(_verdict(e))
+            await self._events.put((attempt, e))
+        else:
+            attempt.record(True)
+            await self._events.put((attempt, END))
+
+    def output_tokens(self):
+        return self.winner.output_tokens() if self.winner else 0
+
+    async def _single(self, provider, ticket):
+        attempt = self.winner = _Attempt(provider, ticket)
+        try:
+            async with provider.aopen(self.prompt) as stream:
+                attempt.stream = stream
+                try:
+                    async for text in stream.atexts():
+                        yield text
+                finally:
+                    prompts.log_usage(stream.usage(), provider.name)
+        except (GeneratorExit, asyncio.CancelledError):
+            attempt.record(None)
+            raise
+        except Exception as e:
+            attempt.record(_verdict(e))
+            stats["failed"] += 1
+            raise
+        attempt.record(True)
+
+    async def __aiter__(self):
+        stats["streams"] += 1
+        pending = _plan()
+        first, ticket = _first(pending)
+        if not pending:
+            async for text in self._single(first, ticket):
+                yield text
+            return
+        self._start(first, ticket)
+        deadline = time.monotonic() + LLM_HEDGE_AFTER
+        errors = []
+        try:
+            while True:
+                timeout = None
+                if self.winner is None and pending:
+                    timeout = max(0.0, deadline - time.monotonic())
+                try:
+                    attempt, item = await asyncio.wait_for(self._events.get(), timeout)
+                except asyncio.TimeoutError:
+                    taken = _take(pending)
+                    if taken is not None:
+                        stats["hedged_on_deadline"] += 1
+                        self._start(*taken)
+                    continue
+                if self.winner is None:
+                    if isinstance(item, Exception):
+                        attempt.failed = True
+                        errors.append(item)
+                        taken = _take(pending)
+                        if taken is not None:
+                            stats["hedged_on_error"] += 1
+                            self._start(*taken)
+                        elif all(a.failed for a in self._attempts):
+                            raise errors[0]
+                        continue
+                    self.winner = attempt
+                    stats["won_primary" if attempt.provider is first else "won_secondary"] += 1
+                    for other, task in zip(self._attempts, self._tasks):
+                        if other is not attempt:
+                            task.cancel()
+                if attempt is not self.winner:
+                    continue
+                if item is END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        except Exception:
+            stats["failed"] += 1
+            raise
+        finally:
+            for task in self._tasks:
+                task.cancel()
+
+
+def astream(prompt):
+    """An ``AsyncHedgedStream`` over the configured providers."""
+    return AsyncHedgedStream(prompt)
@@ -0,0 +1,272 @@
+"""Opt-in cache for Claude generations plus single-flight de-duplication.
+
+Enable with RESPONSE_CACHE=memory or RESPONSE_CACHE=sqlite. Entries are keyed
+on the normalized prompt together with the model parameters, evicted by LRU
+order once RESPONSE_CACHE_MAX_ENTRIES is reached and expire after
+RESPONSE_CACHE_TTL seconds. The SQLite backend lives on local disk and is
+shared by every worker on the host.
+
+``SingleFlight`` lets concurrent identical requests share one upstream call:
+the first caller (the leader) publishes text deltas into a ``Flight`` and every
+other caller follows it, chunk by chunk, as the text arrives.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+RESPONSE_CACHE = os.environ.get("RESPONSE_CACHE", "").lower()
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+RESPONSE_CACHE_PATH = os.environ.get(
+    "RESPONSE_CACHE_PATH", "/tmp/geniuspost-response-cache.sqlite3"
+)
+# Size of the pieces a cached answer is replayed in over SSE
+REPLAY_CHUNK_CHARS = 256
+
+
+def normalize_prompt(prompt):
+    """Collapse whitespace so trivially different prompts share a key. Case
+    is kept: it changes the answer (code identifiers, acronyms)."""
+    return " ".join(prompt.split())
+
+
+def make_key(prompt, **params):
+    payload = json.dumps(
+        {"prompt": normalize_prompt(prompt), "params": params},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def replay(text, size=REPLAY_CHUNK_CHARS):
+    """Yield a cached answer in stream-sized pieces."""
+    for start in range(0, len(text), size):
+        yield text[start:start + size]
+
+
+class MemoryBackend:
+    """Per-process LRU + TTL store."""
+
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SQLiteBackend:
+    """Host-local LRU + TTL store shared by all workers."""
+
+    def __init__(self, path=RESPONSE_CACHE_PATH, max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " last_used REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS response_cache_last_used"
+                " ON response_cache (last_used)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def get(self, key):
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                return None
+            conn.execute(
+                "UPDATE response_cache SET last_used = ? WHERE key = ?", (now, key)
+            )
+            return row[0]
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?)",
+                (key, value, now + ttl, now),
+            )
+            conn.execute("DELETE FROM response_cache WHERE expires_at < ?", (now,))
+            conn.execute(
+                "DELETE FROM response_cache WHERE key IN ("
+                " SELECT key FROM response_cache ORDER BY last_used DESC"
+                " LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+
+class ResponseCache:
+    def __init__(self, backend, ttl=RESPONSE_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.stats = {"hits": 0, "misses": 0}
+
+    def get(self, key):
+        value = self.backend.get(key)
+        self.stats["hits" if value is not None else "misses"] += 1
+        return value
+
+    def set(self, key, value):
+        if value:
+            self.backend.set(key, value, self.ttl)
+
+
+def from_env():
+    """Build the cache selected by RESPONSE_CACHE, or None when disabled."""
+    if RESPONSE_CACHE == "memory":
+        return ResponseCache(MemoryBackend())
+    if RESPONSE_CACHE == "sqlite":
+        return ResponseCache(SQLiteBackend())
+    if RESPONSE_CACHE:
+        raise RuntimeError(f"Unknown RESPONSE_CACHE backend: {RESPONSE_CACHE}")
+    return None
+
+
+########################## Single flight ##########################
+
+class FlightError(Exception):
+    """The leader's upstream call failed; followers see the same error."""
+
+
+class Flight:
+    """Text deltas of one in-progress upstream call, readable by many followers."""
+
+    def __init__(self, on_done):
+        self.chunks = []
+        self.followers = 0
+        self.done = False
+        self.error = None
+        self._cond = threading.Condition()
+        self._on_done = on_done
+
+    def append(self, text):
+        with self._cond:
+            self.chunks.append(text)
+            self._cond.notify_all()
+
+    def join(self):
+        """Count a new follower; False once the flight is over."""
+        with self._cond:
+            if self.done:
+                return False
+            self.followers += 1
+            return True
+
+    def leave(self):
+        with self._cond:
+            self.followers -= 1
+
+    def abandon(self, error):
+        """Fail the flight unless someone still follows it. Returns whether
+        the flight is over, i.e. nobody needs the upstream call any more."""
+        with self._cond:
+            if self.done:
+                return True
+            if self.followers:
+                return False
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+        self._on_done()
+        return True
+
+    def finish(self):
+        self._close(None)
+
+    def fail(self, error):
+        self._close(str(error) or error.__class__.__name__)
+
+    def _close(self, error):
+        with self._cond:
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+        self._on_done()
+
+    def text(self):
+        with self._cond:
+            return "".join(self.chunks)
+
+    def follow(self):
+        """Yield every delta, old and new, until the leader finishes. The
+        follower counted by ``join()`` leaves when it stops reading."""
+        seen = 0
+        try:
+            while True:
+                with self._cond:
+                    while seen == len(self.chunks) and not self.done:
+                        self._cond.wait()
+                    fresh = self.chunks[seen:]
+                    seen += len(fresh)
+                    done, error = self.done, self.error
+                yield from fresh
+                if done and seen == len(self.chunks):
+                    if error:
+                        raise FlightError(error)
+                    return
+        finally:
+            self.leave()
+
+    def result(self):
+        return "".join(self.follow())
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.shared = 0
+
+    def join(self, key):
+        """Return ``(flight, is_leader)`` for key."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and flight.join():
+                self.shared += 1
+                return flight, False
+            flight = Flight(lambda: self._forget(key, flight))
+            self._flights[key] = flight
+            return flight, True
+
+    def _forget(self, key, flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
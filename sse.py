@@ -0,0 +1,182 @@
+"""Server-Sent Events framing for the generation streams.
+
+Claude emits many tiny text deltas. Writing one frame per delta means one
+``json.dumps``, one write and one TCP push per token, so ``StreamWriter``
+merges deltas and flushes a frame once SSE_FLUSH_MS has passed since the
+first pending delta or SSE_FLUSH_BYTES have piled up, whichever is first.
+Frames carry an ``id:`` ending in the number of characters streamed so far
+(generations.py resumes from it) and a comment heartbeat goes out when the
+stream is otherwise idle, which also surfaces dead connections early.
+
+Given a ``markdown_stream.IncrementalMarkdown`` renderer, each frame also
+carries an ``html`` patch for the text it adds.
+"""
+import json
+import os
+import queue
+import time
+
+
+SSE_FLUSH_MS = float(os.environ.get("SSE_FLUSH_MS", "30"))
+SSE_FLUSH_BYTES = int(os.environ.get("SSE_FLUSH_BYTES", "256"))
+SSE_HEARTBEAT = float(os.environ.get("SSE_HEARTBEAT", "15"))
+
+MIMETYPE = "text/event-stream"
+HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    # Tell nginx-style proxies not to buffer the stream
+    "X-Accel-Buffering": "no",
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Headers": "Content-Type",
+}
+HEARTBEAT_FRAME = ": ping\n\n"
+
+# Sentinel a source returns once the stream is complete
+END = object()
+
+
+def format_event(payload, event_id=None):
+    frame = f"data: {json.dumps(payload)}\n\n"
+    if event_id is not None:
+        frame = f"id: {event_id}\n" + frame
+    return frame
+
+
+class StreamWriter:
+    """Coalesces text deltas into SSE frames.
+
+    The writer itself does no I/O: ``add()`` / ``flush()`` return frames and
+    ``timeout()`` says how long the caller may block before it should call
+    ``tick()``. ``frames()`` drives it from a blocking queue.
+    """
+
+    def __init__(self, flush_ms=SSE_FLUSH_MS, flush_bytes=SSE_FLUSH_BYTES,
+                 heartbeat=SSE_HEARTBEAT, offset=0, id_prefix="", renderer=None, fields=None):
+        self.flush_interval = flush_ms / 1000
+        self.flush_bytes = flush_bytes
+        self.heartbeat = heartbeat
+        self.offset = offset
+        self.id_prefix = id_prefix
+        self.renderer = renderer
+        # Added to every data frame, e.g. {"variant": 2} on a multiplexed stream
+        self.fields = fields or {}
+        # HTML blocks the client has been sent
+        self._blocks_sent = 0
+        self._pending = []
+        self._pending_bytes = 0
+        self._deadline = None
+        self._last_write = time.monotonic()
+
+    def add(self, text):
+        if not self._pending:
+            self._deadline = time.monotonic() + self.flush_interval
+        self._pending.append(text)
+        self._pending_bytes += len(text.encode("utf-8"))
+        if self._pending_bytes >= self.flush_bytes:
+            return self.flush()
+        return ""
+
+    def flush(self):
+        if not self._pending:
+            return ""
+        text = "".join(self._pending)
+        self._pending = []
+        self._pending_bytes = 0
+        self._deadline = None
+        self.offset += len(text)
+        payload = dict(self.fields, chunk=text, done=False)
+        if self.renderer is not None:
+            payload["html"] = self.renderer.feed(text, self._blocks_sent)
+            self._blocks_sent = len(self.renderer.blocks)
+        return self._written(format_event(payload, self.event_id))
+
+    @property
+    def event_id(self):
+        return f"{self.id_prefix}{self.offset}"
+
+    def timeout(self):
+        now = time.monotonic()
+        wake = self._last_write + self.heartbeat
+        if self._deadline is not None:
+            wake = min(wake, self._deadline)
+        return max(0.0, wake - now)
+
+    def tick(self):
+        """Flush when the time budget is used up, or emit a heartbeat."""
+        now = time.monotonic()
+        if self._deadline is not None and now >= self._deadline:
+            return self.flush()
+        if now - self._last_write >= self.heartbeat:
+            return self._written(HEARTBEAT_FRAME)
+        return ""
+
+    def done(self):
+        frames = self.flush()
+        payload = dict(self.fields, chunk="", done=True)
+        if self.renderer is not None:
+            payload["html"] = self.renderer.close(self._blocks_sent)
+        return frames + self._written(format_event(payload, self.event_id))
+
+    def error(self, error):
+        return self.flush() + self._written(
+            format_event(dict(self.fields, error=str(error), done=True), self.event_id))
+
+    def _written(self, frame):
+        self._last_write = time.monotonic()
+        return frame
+
+    def frames(self, source):
+        """Yield frames for ``source``, a queue-like object whose ``get(timeout)``
+        returns the next text, an exception, or END, and raises queue.Empty
+        when nothing arrived in time."""
+        while True:
+            try:
+                item = source.get(timeout=self.timeout())
+            except queue.Empty:
+                frame = self.tick()
+            else:
+                if item is END:
+                    yield self.done()
+                    return
+                if isinstance(item, Exception):
+                    yield self.error(item)
+                    return
+                frame = self.add(item)
+            if frame:
+                yield frame
+
+
+def multiplex(writers, source):
+    """Yield the frames of several streams over one connection. ``source.get()``
+    returns ``(index, item)`` (see ``StreamWriter.frames``) and ``writers[index]``
+    frames the item; the heartbeat is shared. Ends once every stream has."""
+    running = set(range(len(writers)))
+
+    def written(frame):
+        if frame:
+            # Any frame keeps the connection alive for all of them
+            for writer in writers:
+                writer._last_write = time.monotonic()
+        return frame
+
+    while running:
+        try:
+            index, item = source.get(timeout=min(writers[i].timeout() for i in running))
+        except queue.Empty:
+            for i in sorted(running):
+                frame = written(writers[i].tick())
+                if frame:
+                    yield frame
+            continue
+        writer = writers[index]
+        if item is END:
+            running.discard(index)
+            yield written(writer.done())
+        elif isinstance(item, Exception):
+            running.discard(index)
+            yield written(writer.error(item))
+        else:
+            frame = written(writer.add(item))
+            if frame:
+                yield frame
@@ -0,0 +1,248 @@
+"""Prometheus metrics, served on /metrics.
+
+Gunicorn workers (and the PDF pool processes under them) each count on their
+own, so gunicorn.conf.py points PROMETHEUS_MULTIPROC_DIR at a fresh
+directory before the workers start: prometheus_client then keeps every
+process's values in memory-mapped files there and /metrics adds them up.
+Without it (flask run, tests) the usual in-process registry is used, and
+timings recorded in PDF pool processes are not visible.
+
+Recording a value is a lock and an add on a memory-mapped file, cheap
+enough to leave on in production.
+
+The per-process ``stats`` dicts the caches, the cancellation registry and
+the metrics buffer already keep are registered with ``export_stats()`` and
+copied into ``geniuspost_component_events_total`` every
+TELEMETRY_STATS_INTERVAL seconds (and on every scrape of the scraped worker).
+"""
+import os
+import threading
+import time
+
+PROMETHEUS_MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+if PROMETHEUS_MULTIPROC_DIR:
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+
+from prometheus_client import (  # noqa: E402 - reads PROMETHEUS_MULTIPROC_DIR on import
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+    generate_latest, multiprocess)
+
+
+TELEMETRY_STATS_INTERVAL = float(os.environ.get("TELEMETRY_STATS_INTERVAL", "5"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+HTTP_REQUESTS = Counter(
+    "geniuspost_http_requests_total", "Requests served, by route and status",
+    ["route", "method", "status"])
+HTTP_LATENCY = Histogram(
+    "geniuspost_http_request_duration_seconds",
+    "Time until the response is closed (the whole stream for SSE routes)",
+    ["route", "method"], buckets=LATENCY_BUCKETS)
+HTTP_IN_FLIGHT = Gauge(
+    "geniuspost_http_requests_in_flight", "Requests (and open streams) in progress",
+    ["route"], multiprocess_mode="livesum")
+
+LLM_TIME_TO_FIRST_TOKEN = Histogram(
+    "geniuspost_llm_time_to_first_token_seconds",
+    "From starting a generation to its first text (source: upstream, cache or shared)",
+    ["source"], buckets=LATENCY_BUCKETS)
+LLM_TOKENS_PER_SECOND = Histogram(
+    "geniuspost_llm_tokens_per_second", "Output tokens per second after the first token",
+    buckets=(5, 10, 20, 30, 40, 50, 60, 80, 100, 150, 200, 400))
+LLM_OUTPUT_TOKENS = Counter(
+    "geniuspost_llm_output_tokens_total", "Output tokens streamed from the upstream API")
+LLM_INPUT_TOKENS = Counter(
+    "geniuspost_llm_input_tokens_total",
+    "Input tokens sent upstream by provider and kind: uncached, cache_read, cache_creation",
+    ["provider", "kind"])
+
+GENERATE_LATENCY = Histogram(
+    "geniuspost_generate_duration_seconds", "/generate latency by outcome (ok, busy, error)",
+    ["outcome"], buckets=LATENCY_BUCKETS)
+GENERATE_ERRORS = Counter(
+    "geniuspost_generate_errors_total", "/generate failures by exception type", ["error"])
+
+PDF_PHASE = Histogram(
+    "geniuspost_pdf_phase_seconds",
+    "PDF export phases: images, preprocess, html, layout, write, merge, encode",
+    ["phase"], buckets=LATENCY_BUCKETS)
+
+COMPONENT_EVENTS = Counter(
+    "geniuspost_component_events", "The stats counters of caches, cancellation and buffers",
+    ["component", "event"])
+
+
+class Timer:
+    """``with Timer(PDF_PHASE.labels("layout")):`` observes the block's duration."""
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+def pdf_phase(phase):
+    return Timer(PDF_PHASE.labels(phase))
+
+
+class _StreamClock:
+    def __init__(self, source):
+        self.source = source
+        self.started = time.perf_counter()
+        self.first = None
+
+    def chunk(self):
+        if self.first is None:
+            self.first = time.perf_counter()
+            LLM_TIME_TO_FIRST_TOKEN.labels(self.source).observe(self.first - self.started)
+
+    def done(self, output_tokens):
+        if self.first is None or output_tokens is None:
+            return
+        tokens = output_tokens()
+        if tokens:
+            LLM_OUTPUT_TOKENS.inc(tokens)
+            elapsed = time.perf_counter() - self.first
+            if elapsed > 0:
+                LLM_TOKENS_PER_SECOND.observe(tokens / elapsed)
+
+
+def llm_stream(chunks, source, output_tokens=None):
+    """Pass chunks through, recording time to the first one and, once the
+    stream is done, tokens per second from output_tokens() (the upstream
+    usage count)."""
+    clock = _StreamClock(source)
+    for chunk in chunks:
+        clock.chunk()
+        yield chunk
+    clock.done(output_tokens)
+
+
+async def llm_stream_async(chunks, source, output_tokens=None):
+    """``llm_stream()`` for async iterators."""
+    clock = _StreamClock(source)
+    async for chunk in chunks:
+        clock.chunk()
+        yield chunk
+    clock.done(output_tokens)
+
+
+########################## Existing stats dicts ##########################
+
+_sources = {}
+_exported = {}
+_lock = threading.Lock()
+_pid = None
+
+
+def export_stats(component, get_stats):
+    """Publish the numeric entries of get_stats() (a dict of running
+    counters) as geniuspost_component_events_total{component=...}."""
+    _sources[component] = get_stats
+    _start()
+
+
+def sync_stats():
+    """Add what each stats dict counted since the last sync."""
+    with _lock:
+        for component, get_stats in _sources.items():
+            stats = get_stats() or {}
+            for event, value in stats.items():
+                if not isinstance(value, (int, float)) or isinstance(value, bool):
+                    continue
+                last = _exported.get((component, event), 0)
+                if value > last:
+                    COMPONENT_EVENTS.labels(component, event).inc(value - last)
+                _exported[(component, event)] = value
+
+
+def _start():
+    """Start this process's sync thread (again after a fork)."""
+    global _pid
+    if _pid == os.getpid():
+        return
+    with _lock:
+        if _pid == os.getpid():
+            return
+        _pid = os.getpid()
+        _exported.clear()
+        threading.Thread(target=_sync_loop, daemon=True).start()
+
+
+def _sync_loop():
+    while True:
+        time.sleep(TELEMETRY_STATS_INTERVAL)
+        try:
+            sync_stats()
+        except Exception as e:
+            print(f"Telemetry stats sync failed: {e}")
+
+
+########################## Flask ##########################
+
+def _route(request):
+    return request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+
+
+def init_app(app):
+    """Count and time every request, and serve /metrics."""
+    from flask import Response, g, request
+
+    @app.before_request
+    def start_request_timer():
+        route = _route(request)
+        g.telemetry = (route, time.perf_counter())
+        HTTP_IN_FLIGHT.labels(route).inc()
+
+    @app.after_request
+    def count_request(response):
+        route, started = g.pop("telemetry", (None, None))
+        if route is None:
+            return response
+        HTTP_REQUESTS.labels(route, request.method, response.status_code).inc()
+        method = request.method
+
+        closed = False
+
+        def finished():
+            nonlocal closed
+            # Some servers and adapters call close() more than once
+            if closed:
+                return
+            closed = True
+            HTTP_IN_FLIGHT.labels(route).dec()
+            HTTP_LATENCY.labels(route, method).observe(time.perf_counter() - started)
+
+        # Streams are still running here; they count until the server closes them
+        response.call_on_close(finished)
+        return response
+
+    @app.teardown_request
+    def uncount_failed_request(exc):
+        # after_request never ran (the error escaped every handler)
+        route, started = g.pop("telemetry", (None, None))
+        if route is not None:
+            HTTP_IN_FLIGHT.labels(route).dec()
+
+    def metrics():
+        sync_stats()
+        if PROMETHEUS_MULTIPROC_DIR:
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+    app.add_url_rule("/metrics", "metrics", metrics)
+
+
+def mark_process_dead(pid):
+    """For gunicorn's child_exit hook: drop a dead worker's live gauges."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
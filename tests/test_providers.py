@@ -0,0 +1,98 @@
+"""HedgedStream closed while a provider is still opening its request."""
+import asyncio
+import os
+import sys
+import threading
+import time
+import types
+from contextlib import asynccontextmanager, contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import providers
+
+
+class SlowProvider:
+    """Takes ``delay`` seconds to open, then streams two deltas."""
+
+    def __init__(self, name, delay):
+        self.name = name
+        self.delay = delay
+        self.opened = 0
+
+    def _stream(self):
+        return types.SimpleNamespace(texts=lambda: iter(["a", "b"]), usage=lambda: None,
+                                     close=lambda: None)
+
+    @contextmanager
+    def open(self, prompt):
+        self.opened += 1
+        time.sleep(self.delay)
+        yield self._stream()
+
+    @asynccontextmanager
+    async def aopen(self, prompt):
+        self.opened += 1
+        await asyncio.sleep(self.delay)
+        stream = self._stream()
+
+        async def atexts():
+            for text in stream.texts():
+                yield text
+
+        stream.atexts = atexts
+        yield stream
+
+
+def setup(monkeypatch, hedge_after=0.3):
+    primary, secondary = SlowProvider("primary", 1.0), SlowProvider("secondary", 1.0)
+    breakers = {"primary": providers.CircuitBreaker(cooldown=0),
+                "secondary": providers.CircuitBreaker()}
+    # Open and past its cooldown: the next call is the probe
+    breakers["primary"].opened_at = time.monotonic() - 1
+    monkeypatch.setattr(providers, "PROVIDERS", [primary, secondary])
+    monkeypatch.setattr(providers, "breakers", breakers)
+    monkeypatch.setattr(providers, "LLM_HEDGE_AFTER", hedge_after)
+    return primary, secondary, breakers["primary"]
+
+
+def test_close_during_slow_open(monkeypatch):
+    primary, secondary, breaker = setup(monkeypatch)
+    stream = providers.stream("prompt")
+    texts = []
+    reader = threading.Thread(target=lambda: texts.extend(stream))
+    reader.start()
+    time.sleep(0.1)
+    assert breaker.probing
+    stream.close()
+    reader.join(timeout=0.5)
+    assert not reader.is_alive()
+    assert texts == []
+    time.sleep(1.2)
+    # The secondary was never asked, and the probe that never got an answer
+    # leaves the breaker ready for the next one
+    assert secondary.opened == 0
+    assert not breaker.probing
+    assert breaker.state == "half_open"
+
+
+def test_async_close_during_slow_open(monkeypatch):
+    primary, secondary, breaker = setup(monkeypatch)
+
+    async def main():
+        texts = providers.astream("prompt").__aiter__()
+        reader = asyncio.ensure_future(texts.__anext__())
+        await asyncio.sleep(0.1)
+        assert breaker.probing
+        # What a client disconnect does to the ASGI route
+        reader.cancel()
+        try:
+            await reader
+        except asyncio.CancelledError:
+            pass
+        await asyncio.sleep(0)
+
+    asyncio.run(main())
+    assert secondary.opened == 0
+    assert not breaker.probing
+    assert breaker.state == "half_open"
@@ -0,0 +1,325 @@
+"""Local stand-in for the Anthropic Messages API, for load tests that cost nothing.
+
+Serves ``POST /v1/messages``, streaming (SSE, the events the SDK expects)
+or not, with Markdown-ish text at a set pace, and the same answers as an
+OpenAI ``POST /v1/chat/completions`` for the secondary provider
+(LLM_OPENAI_BASE_URL=<url>/v1):
+
+    --tokens N              output tokens per answer (capped by max_tokens)
+    --tokens-per-second R   streaming pace
+    --latency-ms MS         delay before the response starts (time to first token)
+    --jitter F              latency and pace vary by +-F (0.2 = 20%)
+    --errors MIX            e.g. 429=0.02,529=0.01,500=0.005,midstream=0.01,hang=0.001
+
+Error kinds: 429 (rate_limit_error, with retry-after), 529 (overloaded_error)
+and 500 (api_error) answer instead of the message; ``midstream`` sends an
+``error`` event part way through a stream; ``hang`` never answers (until the
+client's read timeout). ``GET /stats`` returns what the fake has served,
+including the peak number of concurrent streams.
+
+Tokens are counted as 4 characters each. A system prefix marked with
+``cache_control`` is reported as ``cache_creation_input_tokens`` the first
+time and ``cache_read_input_tokens`` after that, if it reaches the API's
+1024-token minimum.
+
+Connections are kept alive like the real API's, and one asyncio loop
+serves thousands of concurrent streams.
+
+    python tools/fake_anthropic.py --port 9200 --latency-ms 600 --tokens-per-second 80
+    export LLM_BASE_URL=http://127.0.0.1:9200
+"""
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+
+
+WORDS = ("the carousel story brand audience growth insight hook post slide team "
+         "launch metric value customer strategy result design content reach").split()
+
+
+def parse_errors(mix):
+    """'429=0.02,midstream=0.01' -> {'429': 0.02, 'midstream': 0.01}"""
+    errors = {}
+    for item in filter(None, (mix or "").split(",")):
+        kind, _, share = item.partition("=")
+        errors[kind.strip()] = float(share)
+    return errors
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+
+
+# Shortest prefix the API caches (Sonnet and Opus)
+MIN_CACHEABLE_TOKENS = 1024
+
+ERROR_TYPES = {
+    "429": (429, "rate_limit_error", "Number of request tokens has exceeded your rate limit."),
+    "529": (529, "overloaded_error", "Overloaded"),
+    "500": (500, "api_error", "Internal server error"),
+}
+
+
+class FakeAnthropic:
+    def __init__(self, tokens=300, tokens_per_second=60.0, latency=0.5, jitter=0.0,
+                 errors=None, seed=None):
+        self.tokens = tokens
+        self.tokens_per_second = tokens_per_second
+        self.latency = latency
+        self.jitter = jitter
+        self.errors = errors or {}
+        self.random = random.Random(seed)
+        self.stats = {"requests": 0, "streams": 0, "completed": 0, "output_tokens": 0,
+                      "errors": {}, "client_disconnects": 0,
+                      "open_streams": 0, "peak_open_streams": 0}
+        self._cached_prefixes = set()
+
+    def _vary(self, value):
+        if not self.jitter:
+            return value
+        return value * self.random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _pick_error(self):
+        roll = self.random.random()
+        for kind, share in self.errors.items():
+            if roll < share:
+                return kind
+            roll -= share
+        return None
+
+    def _count_error(self, kind):
+        self.stats["errors"][kind] = self.stats["errors"].get(kind, 0) + 1
+
+    def _usage_in(self, params):
+        system = params.get("system") or []
+        if isinstance(system, str):
+            system = [{"type": "text", "text": system}]
+        messages = sum(len(str(m.get("content", ""))) // 4 for m in params.get("messages", []))
+        marked = [i for i, block in enumerate(system) if block.get("cache_control")]
+        prefix = "".join(block.get("text", "") for block in system[:marked[-1] + 1]) if marked else ""
+        rest = sum(len(block.get("text", "")) for block in system) - len(prefix)
+        usage = {"input_tokens": messages + rest // 4,
+                 "cache_creation_input_tokens": 0, "cache_read_input_tokens": 0}
+        if len(prefix) // 4 < MIN_CACHEABLE_TOKENS:
+            usage["input_tokens"] += len(prefix) // 4
+        elif prefix in self._cached_prefixes:
+            usage["cache_read_input_tokens"] = len(prefix) // 4
+        else:
+            self._cached_prefixes.add(prefix)
+            usage["cache_creation_input_tokens"] = len(prefix) // 4
+        return usage
+
+    def _pieces(self, count):
+        """count text deltas of roughly one token each, forming Markdown."""
+        pieces = ["# Carousel\n\n"]
+        for i in range(1, count):
+            if i % 60 == 0:
+                pieces.append(f"\n\n## Slide {i // 60 + 1}\n\n")
+            elif i % 12 == 0:
+                pieces.append("\n- ")
+            else:
+                pieces.append(self.random.choice(WORDS) + " ")
+        return pieces[:count]
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except asyncio.IncompleteReadError:
+                    return
+                lines = head.decode("latin-1").split("\r\n")
+                method, path = lines[0].split(" ")[:2]
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                keep_alive = headers.get("connection", "").lower() != "close"
+                await self.route(method, path.split("?")[0], body, writer)
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            self.stats["client_disconnects"] += 1
+        finally:
+            writer.close()
+
+    async def route(self, method, path, body, writer):
+        if method == "GET" and path == "/stats":
+            return self._json(writer, 200, self.stats)
+        if method != "POST" or path not in ("/v1/messages", "/v1/chat/completions"):
+            return self._json(writer, 404, {"type": "error", "error": {
+                "type": "not_found_error", "message": f"{method} {path}"}})
+        self.stats["requests"] += 1
+        params = json.loads(body or b"{}")
+        await asyncio.sleep(self._vary(self.latency))
+        error = self._pick_error()
+        if error == "hang":
+            self._count_error(error)
+            await asyncio.sleep(3600)
+        if error in ERROR_TYPES:
+            self._count_error(error)
+            status, kind, message = ERROR_TYPES[error]
+            extra = [("retry-after", "1")] if status == 429 else []
+            return self._json(writer, status, {"type": "error",
+                                               "error": {"type": kind, "message": message}}, extra)
+        tokens = min(self.tokens, int(params.get("max_tokens", self.tokens)))
+        if path == "/v1/chat/completions":
+            return await self._chat(writer, params, tokens, error == "midstream")
+        message = {"id": f"msg_fake{self.stats['requests']}", "type": "message",
+                   "role": "assistant", "model": params.get("model", "fake"),
+                   "stop_sequence": None}
+        usage_in = self._usage_in(params)
+        if not params.get("stream"):
+            # The whole answer takes as long as streaming it would
+            await asyncio.sleep(self._vary(tokens / self.tokens_per_second))
+            self.stats["completed"] += 1
+            self.stats["output_tokens"] += tokens
+            return self._json(writer, 200, dict(
+                message, content=[{"type": "text", "text": "".join(self._pieces(tokens))}],
+                stop_reason="end_turn", usage=dict(usage_in, output_tokens=tokens)))
+        await self._stream(writer, message, usage_in, tokens, error == "midstream")
+
+    async def _stream(self, writer, message, usage_in, tokens, fail):
+        head = [
+            _sse("message_start", {"type": "message_start", "message": dict(
+                message, content=[], stop_reason=None, usage=dict(usage_in, output_tokens=1))}),
+            _sse("content_block_start", {"type": "content_block_start", "index": 0,
+                                         "content_block": {"type": "text", "text": ""}}),
+        ]
+        deltas = [_sse("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                               "delta": {"type": "text_delta", "text": piece}})
+                  for piece in self._pieces(tokens)]
+        tail = [
+            _sse("content_block_stop", {"type": "content_block_stop", "index": 0}),
+            _sse("message_delta", {"type": "message_delta",
+                                   "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                   "usage": {"output_tokens": tokens}}),
+            _sse("message_stop", {"type": "message_stop"}),
+        ]
+        error = _sse("error", {"type": "error", "error": {
+            "type": "overloaded_error", "message": "Overloaded"}})
+        if await self._paced(writer, head, deltas, tail, error if fail else None):
+            self.stats["output_tokens"] += tokens
+
+    async def _paced(self, writer, head, deltas, tail, error=None):
+        """Send head, then one delta per token at the set pace, then tail;
+        with an error event, it replaces the rest part way through.
+        Returns whether the stream completed."""
+        stats = self.stats
+        stats["streams"] += 1
+        stats["open_streams"] += 1
+        stats["peak_open_streams"] = max(stats["peak_open_streams"], stats["open_streams"])
+        try:
+            writer.write(b"HTTP/1.1 200 OK\r\ncontent-type: text/event-stream\r\n"
+                         b"cache-control: no-cache\r\ntransfer-encoding: chunked\r\n\r\n")
+
+            def chunk(payload):
+                writer.write(b"%x\r\n%s\r\n" % (len(payload), payload))
+
+            for event in head:
+                chunk(event)
+            interval = 1 / self.tokens_per_second
+            fail_at = self.random.randint(1, max(1, len(deltas) - 1)) if error else None
+            next_at = time.monotonic()
+            for i, event in enumerate(deltas):
+                if i == fail_at:
+                    self._count_error("midstream")
+                    chunk(error)
+                    writer.write(b"0\r\n\r\n")
+                    await writer.drain()
+                    return False
+                chunk(event)
+                await writer.drain()
+                # Paced against a schedule so slow loops do not slow the rate
+                next_at += self._vary(interval)
+                await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+            for event in tail:
+                chunk(event)
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+            stats["completed"] += 1
+            return True
+        finally:
+            stats["open_streams"] -= 1
+
+    async def _chat(self, writer, params, tokens, fail):
+        """The OpenAI chat completions flavour of the same answer."""
+        prompt_tokens = sum(len(str(m.get("content", ""))) // 4
+                            for m in params.get("messages", []))
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": tokens,
+                 "total_tokens": prompt_tokens + tokens}
+        base = {"id": f"chatcmpl-fake{self.stats['requests']}", "created": int(time.time()),
+                "model": params.get("model", "fake")}
+        if not params.get("stream"):
+            await asyncio.sleep(self._vary(tokens / self.tokens_per_second))
+            self.stats["completed"] += 1
+            self.stats["output_tokens"] += tokens
+            return self._json(writer, 200, dict(base, object="chat.completion", usage=usage, choices=[{
+                "index": 0, "finish_reason": "stop",
+                "message": {"role": "assistant", "content": "".join(self._pieces(tokens))}}]))
+
+        def event(choices, **extra):
+            data = dict(base, object="chat.completion.chunk", choices=choices, **extra)
+            return f"data: {json.dumps(data)}\n\n".encode()
+
+        def delta(content, finish_reason=None):
+            return [{"index": 0, "delta": content, "finish_reason": finish_reason}]
+
+        head = [event(delta({"role": "assistant", "content": ""}))]
+        deltas = [event(delta({"content": piece})) for piece in self._pieces(tokens)]
+        tail = [event(delta({}, "stop"))]
+        if (params.get("stream_options") or {}).get("include_usage"):
+            tail.append(event([], usage=usage))
+        tail.append(b"data: [DONE]\n\n")
+        error = "data: %s\n\n" % json.dumps({"error": {"message": "Overloaded", "type": "server_error"}})
+        if await self._paced(writer, head, deltas, tail, error.encode() if fail else None):
+            self.stats["output_tokens"] += tokens
+
+    def _json(self, writer, status, payload, headers=()):
+        body = json.dumps(payload).encode()
+        head = [f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}",
+                "content-type: application/json", f"content-length: {len(body)}"]
+        head += [f"{name}: {value}" for name, value in headers]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + body)
+
+
+def serve(port=0, **options):
+    """Start the fake on its own event loop thread; returns (server, fake).
+    fake.url is the base URL to use as LLM_BASE_URL."""
+    fake = FakeAnthropic(**options)
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(
+        asyncio.start_server(fake.handle, "127.0.0.1", port, backlog=4096))
+    fake.url = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return server, fake
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=9200)
+    parser.add_argument("--tokens", type=int, default=300)
+    parser.add_argument("--tokens-per-second", type=float, default=60)
+    parser.add_argument("--latency-ms", type=float, default=500)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--errors", default="", help="e.g. 429=0.02,529=0.01,midstream=0.01")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    server, fake = serve(args.port, tokens=args.tokens, tokens_per_second=args.tokens_per_second,
+                         latency=args.latency_ms / 1000, jitter=args.jitter,
+                         errors=parse_errors(args.errors), seed=args.seed)
+    print(f"Fake Anthropic API on {fake.url}")
+    print(f"export LLM_BASE_URL={fake.url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
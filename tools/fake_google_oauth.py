@@ -0,0 +1,189 @@
+"""Local stand-in for Google's OAuth endpoints, for trying sign-in offline.
+
+Serves the endpoints google_auth.py talks to, signing id_tokens with an
+RSA key generated at startup:
+
+    GET  /auth      redirects straight back to redirect_uri with a code
+                    (login_hint=<email> picks the user, default --email)
+    POST /token     exchanges the code for access_token + id_token
+    GET  /certs     the JWKS, with Cache-Control: max-age=--certs-max-age
+    GET  /userinfo  the claims again, for comparing with the old flow
+
+--latency-ms adds a delay to every response to mimic the round trip to
+Google; --rotate-every N switches to a new signing key after N tokens.
+
+    python tools/fake_google_oauth.py --port 9100
+    export GOOGLE_AUTH_URL=http://127.0.0.1:9100/auth \\
+           GOOGLE_TOKEN_URL=http://127.0.0.1:9100/token \\
+           GOOGLE_CERTS_URL=http://127.0.0.1:9100/certs \\
+           GOOGLE_ISSUERS=http://127.0.0.1:9100
+"""
+import argparse
+import hashlib
+import json
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from joserfc import jwt
+from joserfc.jwk import RSAKey
+
+
+class FakeGoogle:
+    def __init__(self, issuer, email="dev@example.com", latency=0.0, certs_max_age=3600,
+                 rotate_every=0):
+        self.issuer = issuer
+        self.email = email
+        self.latency = latency
+        self.certs_max_age = certs_max_age
+        self.rotate_every = rotate_every
+        self.stats = {"auth": 0, "token": 0, "certs": 0, "userinfo": 0}
+        self._codes = {}
+        self._access = {}
+        self._keys = []
+        self._issued = 0
+        self._lock = threading.Lock()
+        self._new_key()
+
+    def _new_key(self):
+        key = RSAKey.generate_key(2048, parameters={"kid": secrets.token_hex(8),
+                                                    "use": "sig", "alg": "RS256"})
+        # Old keys stay published so tokens signed with them still verify
+        self._keys = [key] + self._keys[:1]
+
+    def authorize(self, query):
+        email = query.get("login_hint", [self.email])[0]
+        code = secrets.token_urlsafe(16)
+        with self._lock:
+            self._codes[code] = {
+                "email": email,
+                "client_id": query.get("client_id", [""])[0],
+                "redirect_uri": query.get("redirect_uri", [""])[0],
+            }
+        redirect_uri = query.get("redirect_uri", [""])[0]
+        return f"{redirect_uri}?{urlencode({'code': code, 'state': query.get('state', [''])[0]})}"
+
+    def token(self, form):
+        with self._lock:
+            grant = self._codes.pop(form.get("code", [""])[0], None)
+            if grant is None or grant["redirect_uri"] != form.get("redirect_uri", [""])[0]:
+                return 400, {"error": "invalid_grant", "error_description": "Bad code"}
+            if self.rotate_every and self._issued and self._issued % self.rotate_every == 0:
+                self._new_key()
+            self._issued += 1
+            key = self._keys[0]
+        email = grant["email"]
+        now = int(time.time())
+        claims = {
+            "iss": self.issuer,
+            "aud": grant["client_id"],
+            "sub": hashlib.sha256(email.encode()).hexdigest()[:21],
+            "email": email,
+            "email_verified": True,
+            "name": email.split("@")[0].title(),
+            "picture": f"{self.issuer}/avatar.png",
+            "iat": now,
+            "exp": now + 3600,
+        }
+        access_token = secrets.token_urlsafe(24)
+        with self._lock:
+            self._access[access_token] = claims
+        id_token = jwt.encode({"alg": "RS256", "kid": key.kid}, claims, key)
+        return 200, {"access_token": access_token, "id_token": id_token, "expires_in": 3599,
+                     "token_type": "Bearer", "scope": "openid email profile"}
+
+    def certs(self):
+        with self._lock:
+            return {"keys": [key.as_dict(private=False) for key in self._keys]}
+
+    def userinfo(self, authorization):
+        with self._lock:
+            return self._access.get(authorization.removeprefix("Bearer "))
+
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body go out in separate writes; without this, Nagle
+        # plus delayed ACKs add ~40 ms to every keep-alive response
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body, headers=()):
+            if fake.latency:
+                time.sleep(fake.latency)
+            payload = json.dumps(body).encode() if body is not None else b""
+            self.send_response(status)
+            for name, value in headers:
+                self.send_header(name, value)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/auth":
+                fake.stats["auth"] += 1
+                self._send(302, None, [("Location", fake.authorize(parse_qs(url.query)))])
+            elif url.path == "/certs":
+                fake.stats["certs"] += 1
+                self._send(200, fake.certs(),
+                           [("Cache-Control", f"public, max-age={fake.certs_max_age}")])
+            elif url.path == "/userinfo":
+                fake.stats["userinfo"] += 1
+                claims = fake.userinfo(self.headers.get("Authorization", ""))
+                self._send(200 if claims else 401, claims or {"error": "invalid_token"})
+            else:
+                self._send(404, {"error": "not_found"})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            form = parse_qs(self.rfile.read(length).decode())
+            if urlparse(self.path).path == "/token":
+                fake.stats["token"] += 1
+                self._send(*fake.token(form))
+            else:
+                self._send(404, {"error": "not_found"})
+
+    return Handler
+
+
+def serve(port=0, **options):
+    """Start the fake in a background thread; returns (server, fake)."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), None)
+    fake = FakeGoogle(issuer=f"http://127.0.0.1:{server.server_port}", **options)
+    server.RequestHandlerClass = make_handler(fake)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, fake
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--email", default="dev@example.com")
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--certs-max-age", type=int, default=3600)
+    parser.add_argument("--rotate-every", type=int, default=0)
+    args = parser.parse_args()
+
+    server, fake = serve(args.port, email=args.email, latency=args.latency_ms / 1000,
+                         certs_max_age=args.certs_max_age, rotate_every=args.rotate_every)
+    print(f"Fake Google OAuth on {fake.issuer}")
+    for name, path in (("GOOGLE_AUTH_URL", "/auth"), ("GOOGLE_TOKEN_URL", "/token"),
+                       ("GOOGLE_CERTS_URL", "/certs")):
+        print(f"export {name}={fake.issuer}{path}")
+    print(f"export GOOGLE_ISSUERS={fake.issuer}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Per-worker cache of logged-in users for Flask-Login's user_loader.
+
+Flask-Login loads the user on every request that touches ``current_user``,
+and every ``render_template`` does (its context processor), so each HTML
+document of a page view cost two ``SELECT``s on the user table. The columns of a
+user row only change when the row is created at first login, so each worker
+keeps them in memory for USER_CACHE_TTL seconds and hands out a fresh,
+session-less ``User`` built from them.
+
+At most USER_CACHE_MAX_USERS users are kept per worker (least recently used
+go first). Login refreshes the entry and logout drops it; other workers
+pick up a change within one TTL.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import inspect
+
+
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", "300"))
+USER_CACHE_MAX_USERS = int(os.environ.get("USER_CACHE_MAX_USERS", "10000"))
+
+
+class UserCache:
+    def __init__(self, model, ttl=USER_CACHE_TTL, max_users=USER_CACHE_MAX_USERS):
+        self.model = model
+        self.ttl = ttl
+        self.max_users = max_users
+        self.columns = [attr.key for attr in inspect(model).column_attrs]
+        self.stats = {"hits": 0, "misses": 0}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """The user with this id, or None; queries the database at most once."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.stats["hits"] += 1
+                return self.model(**entry[1])
+            self.stats["misses"] += 1
+        user = self.model.query.get(user_id)
+        if user is not None:
+            self.put(user)
+        return user
+
+    def put(self, user):
+        values = {column: getattr(user, column) for column in self.columns}
+        with self._lock:
+            self._entries[user.id] = (time.monotonic() + self.ttl, values)
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def forget(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def report(self):
+        with self._lock:
+            entries = len(self._entries)
+        return dict(self.stats, entries=entries, ttl=self.ttl, max_users=self.max_users)